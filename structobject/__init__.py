@@ -6,3 +6,4 @@ from __future__ import unicode_literals
 from .structObject import *
 from .structField import *
 from .compatibility import *
+from .structFile import *
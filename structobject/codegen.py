@@ -0,0 +1,529 @@
+"""
+Ahead of time compilation of structObject classes to a plain python module
+
+The generated module only imports struct (and the modules of any getter, setter or checksum
+functions), its classes use __slots__ attributes and straight line pack/unpack methods built
+on precompiled Struct objects, so importing it does none of the metaclass work.
+
+python -m structobject.codegen mymodule mymodule_compiled.py
+
+Generated classes are constructed with keyword or positional field values, or from bytes with
+Class.from_bytes(data), and provide pack(), unpack(data), unpack_from(buffer, offset), to_tuple(), to_dict() and size.
+Validators run when packing and raise ValueError. Generator, len, selector, present_if, getter,
+setter and validator functions must be lambdas without closures or importable module level
+functions, ValueError is raised for others and TypeError for classes that can't be compiled.
+"""
+from __future__ import absolute_import
+
+import argparse
+import ast
+import dis
+import importlib
+import inspect
+import struct
+import sys
+
+try:
+    import builtins
+except ImportError:  # python 2
+    import __builtin__ as builtins
+
+from .structObject import structObject, structArray, structUnion, structOptional, Empty
+from .structField import structField
+
+_checksum_source = {
+    'crc16_field': ('binascii', "binascii.crc_hqx({}, 0xffff)"),
+    'crc32_field': ('zlib', "(zlib.crc32({}) & 0xffffffff)"),
+    'sum8_field': (None, "(sum({}) & 0xff)"),
+    'sum16_field': (None, "(sum({}) & 0xffff)"),
+}
+
+
+class _moduleWriter(object):
+    """Collects the imports, constants and classes of a generated module"""
+
+    def __init__(self):
+        self.imports = ['import struct']
+        self.constants = []
+        self.late_constants = []  # constants naming generated classes, written after them
+        self.classes = []
+        self.names = {}  # structObject subclass -> generated class name
+        self.references = {}  # id of a referenced object -> constant name
+
+    def add_import(self, module):
+        line = 'import {}'.format(module)
+        if line not in self.imports:
+            self.imports.append(line)
+
+    def constant(self, source, late=False):
+        "Adds a module level constant and returns its name"
+        name = '_c{}'.format(len(self.constants) + len(self.late_constants))
+        (self.late_constants if late else self.constants).append('{} = {}'.format(name, source))
+        return name
+
+    def reference(self, fn):
+        "Returns an expression for fn in the generated module"
+        if getattr(fn, '__name__', None) == '<lambda>':
+            if id(fn) not in self.references:
+                self.references[id(fn)] = self.constant(_lambda_source(fn))
+            return self.references[id(fn)]
+        module = getattr(fn, '__module__', None)
+        qualname = getattr(fn, '__qualname__', getattr(fn, '__name__', ''))
+        if module is None or module == '__main__' or '<' in qualname:
+            raise ValueError("'{}' can't be referenced from a generated module".format(fn))
+        self.add_import(module)
+        return '{}.{}'.format(module, qualname)
+
+    def source(self):
+        lines = ['"""Generated by structobject.codegen, do not edit"""']
+        lines.extend(sorted(self.imports))
+        lines.append('')
+        lines.extend(self.constants)
+        for block in self.classes:
+            lines.append('')
+            lines.append('')
+            lines.extend(block)
+        if len(self.late_constants) > 0:
+            lines.append('')
+            lines.append('')
+            lines.extend(self.late_constants)
+        return '\n'.join(lines) + '\n'
+
+
+def _lambda_source(fn):
+    "Returns the source of a lambda, which must only use its arguments and builtins"
+    code = fn.__code__
+    if fn.__closure__:
+        raise ValueError("lambda on line {} uses a closure".format(code.co_firstlineno))
+    for instruction in dis.get_instructions(fn):
+        if instruction.opname == 'LOAD_GLOBAL' and not hasattr(builtins, instruction.argval):
+            raise ValueError("lambda on line {} uses global '{}'".format(
+                code.co_firstlineno, instruction.argval))
+    source = inspect.getsource(inspect.getmodule(fn))
+    candidates = []
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, ast.Lambda) and node.lineno == code.co_firstlineno:
+            text = ast.get_source_segment(source, node)
+            compiled = compile('(' + text + ')', '<lambda>', 'eval')
+            for const in compiled.co_consts:
+                if hasattr(const, 'co_code') and const.co_code == code.co_code:
+                    candidates.append(text)
+    if len(candidates) != 1:
+        raise ValueError("source of lambda on line {} not found".format(code.co_firstlineno))
+    return '(' + candidates[0] + ')'
+
+
+def _is_scalar(constructor):
+    return issubclass(constructor, structField) and not constructor._variable_length
+
+
+def compile_class(writer, cls):
+    "Adds the generated class for cls, and the classes it depends on, returns the generated name"
+    if cls in writer.names:
+        return writer.names[cls]
+    if Empty in cls._constructors:
+        raise TypeError("'{}' has fields left to be defined by subclasses".format(cls.__name__))
+    for constructor in cls._constructors:
+        if issubclass(constructor, structObject):
+            compile_class(writer, constructor)
+        elif issubclass(constructor, structArray) and issubclass(constructor.object_type, structObject):
+            compile_class(writer, constructor.object_type)
+        elif issubclass(constructor, structUnion):
+            for case in constructor.cases.values():
+                compile_class(writer, case)
+        elif issubclass(constructor, structOptional) and issubclass(constructor.object_type, structObject):
+            compile_class(writer, constructor.object_type)
+        elif issubclass(constructor, structField) and constructor.fmt == 'x':
+            raise TypeError("padding fields of '{}' can't be compiled".format(cls.__name__))
+
+    name = cls.__name__
+    while name in writer.names.values():
+        name += '_'
+    writer.names[cls] = name
+    writer.classes.append(_classCompiler(writer, cls, name).lines())
+    return name
+
+
+class _classCompiler(object):
+    """Writes the source of one generated class"""
+
+    def __init__(self, writer, cls, name):
+        self.writer = writer
+        self.cls = cls
+        self.name = name
+        self.order = cls._byte_order
+        self.fields = list(zip(cls._field_order, cls._constructors))
+
+        # consecutive scalar fields share one Struct, as segments do in the dynamic class
+        self.groups = []
+        for i, (field_name, constructor) in enumerate(self.fields):
+            if _is_scalar(constructor):
+                if len(self.groups) > 0 and isinstance(self.groups[-1], list):
+                    self.groups[-1].append(i)
+                    continue
+                self.groups.append([i])
+            else:
+                self.groups.append(i)
+        self.group_of = {}
+        self.structs = []
+        for n, group in enumerate(self.groups):
+            if isinstance(group, list):
+                fmts = [self.fields[i][1].fmt for i in group]
+                fmt = str(self.order + ''.join(fmts))
+                self.structs.append((writer.constant('struct.Struct({!r})'.format(fmt)), struct.calcsize(fmt)))
+                for k, i in enumerate(group):
+                    self.group_of[i] = (n, struct.calcsize(self.order + ''.join(fmts[:k])))
+            else:
+                self.structs.append(None)
+                self.group_of[group] = (n, None)
+
+    def lines(self):
+        out = ['class {}(object):'.format(self.name)]
+        if self.cls.__doc__:
+            out.append('    {!r}'.format(self.cls.__doc__))
+        slots = [name for name, constructor in self.fields if not self._static(constructor)]
+        out.append('    __slots__ = {!r}'.format(tuple(str(name) for name in slots)))
+        out.append('    _field_order = {!r}'.format(tuple(str(name) for name in self.cls._field_order)))
+        for name, constructor in self.fields:
+            if self._static(constructor):
+                out.append('    {} = {!r}'.format(name, constructor.value))
+        if self.cls._fixed_size is not None:
+            out.append('    size = {}'.format(self.cls._fixed_size))
+        for method in (self._init, self._pack, self._unpack, self._export):
+            out.append('')
+            out.extend('    ' + line if line else line for line in method())
+        if self.cls._fixed_size is None:
+            out.extend(['', '    @property', '    def size(self):', '        return len(self.pack())'])
+        return out
+
+    def _static(self, constructor):
+        return issubclass(constructor, structField) and constructor._static
+
+    def _ref(self, fn):
+        return self.writer.reference(fn)
+
+    def _init(self):
+        params = []
+        body = []
+        for name, constructor in self.fields:
+            if self._static(constructor):
+                continue
+            if issubclass(constructor, structField):
+                params.append('{}={!r}'.format(name, constructor.default))
+                body.append('self.{0} = {0}'.format(name))
+                continue
+            params.append('{}=None'.format(name))
+            if issubclass(constructor, structObject):
+                body.append('self.{0} = {1}() if {0} is None else {0}'.format(name, self.writer.names[constructor]))
+            elif issubclass(constructor, structArray):
+                if constructor._fold_length is not None:
+                    default = '[{!r}] * {}'.format(constructor.object_type.default, constructor._fold_length)
+                else:
+                    default = '[]'
+                body.append('self.{0} = {1} if {0} is None else {0}'.format(name, default))
+            elif issubclass(constructor, structUnion):
+                body.append('if {} is None:'.format(name))
+                body.append('    _type = {}.get({}(self))'.format(self._cases(constructor), self._ref(
+                    constructor.selector[0])))
+                body.append('    {} = None if _type is None else _type()'.format(name))
+                body.append('self.{0} = {0}'.format(name))
+            elif issubclass(constructor, structOptional):
+                object_type = constructor.object_type
+                if issubclass(object_type, structObject):
+                    default = '{}()'.format(self.writer.names[object_type])
+                else:
+                    default = repr(object_type.default)
+                body.append('if {} is None and {}(self):'.format(name, self._ref(constructor.present_if[0])))
+                body.append('    {} = {}'.format(name, default))
+                body.append('self.{0} = {0}'.format(name))
+        if len(body) == 0:
+            body.append('pass')
+        return ['def __init__(self{}):'.format(''.join(', ' + p for p in params))] + ['    ' + b for b in body]
+
+    def _cases(self, constructor):
+        if id(constructor) not in self.writer.references:
+            self.writer.references[id(constructor)] = self.writer.constant('{' + ', '.join(
+                '{!r}: {}'.format(key, self.writer.names[case]) for key, case in constructor.cases.items()) + '}',
+                                                                           late=True)
+        return self.writer.references[id(constructor)]
+
+    def _pack_value(self, name, constructor):
+        if self._static(constructor):
+            return repr(constructor.value)
+        value = 'self.{}'.format(name)
+        if constructor.setter is not None:
+            value = '{}({})'.format(self._ref(constructor.setter[0]), value)
+        return value
+
+    def _validate(self):
+        "Checks the values of fields with validators, as the dynamic class does when validating on pack"
+        body = []
+        for name, constructor in self.fields:
+            if issubclass(constructor, structArray) or issubclass(constructor, structOptional):
+                field_type = constructor.object_type
+            else:
+                field_type = constructor
+            if not issubclass(field_type, structField) or field_type.validator is None or \
+                    field_type._static or field_type.generator is not None:
+                continue
+            value = 'v' if issubclass(constructor, structArray) else 'self.{}'.format(name)
+            checks = []
+            for validator in field_type.validator:
+                checks.append('if not {}({}):'.format(self._ref(validator), value))
+                checks.append("    raise ValueError('Validation error, given value %r' % ({},))".format(value))
+            if issubclass(constructor, structArray):
+                body.append('for v in self.{}:'.format(name))
+            elif issubclass(constructor, structOptional):
+                body.append('if self.{} is not None:'.format(name))
+            else:
+                body.extend(checks)
+                continue
+            body.extend('    ' + check for check in checks)
+        return body
+
+    def _pack(self):
+        body = []
+        # generators that read other generated fields run after them
+        generated = list(self.cls._generated)
+        for i, (name, constructor) in enumerate(self.fields):
+            if issubclass(constructor, structField) and constructor.generator is not None and i not in generated:
+                generated.append(i)
+        for i in generated:
+            name, constructor = self.fields[i]
+            body.append('self.{} = {}(self)'.format(name, self._ref(constructor.generator[0])))
+        body.extend(self._validate())
+        track = len(self.cls._checksums) > 0
+        for n, group in enumerate(self.groups):
+            if track:
+                body.append('s{} = len(buf)'.format(n))
+            if isinstance(group, list):
+                values = ', '.join(self._pack_value(*self.fields[i]) for i in group)
+                body.append('buf += {}.pack({})'.format(self.structs[n][0], values))
+                continue
+            name, constructor = self.fields[group]
+            if issubclass(constructor, structObject):
+                body.append('self.{}._pack_to(buf)'.format(name))
+            elif issubclass(constructor, structArray):
+                if issubclass(constructor.object_type, structField):
+                    values = 'self.{}'.format(name)
+                    if constructor.object_type.setter is not None:
+                        values = '[{}(v) for v in {}]'.format(self._ref(constructor.object_type.setter[0]), values)
+                    body.append("buf += struct.pack('{}%d{}' % len(self.{}), *{})".format(
+                        self.order, constructor.object_type.fmt, name, values))
+                else:
+                    body.append('for item in self.{}:'.format(name))
+                    body.append('    item._pack_to(buf)')
+            elif issubclass(constructor, structOptional) and issubclass(constructor.object_type, structField):
+                body.append('if self.{} is not None:'.format(name))
+                body.append("    buf += struct.pack({!r}, {})".format(
+                    str(self.order + constructor.object_type.fmt), self._pack_value(name, constructor.object_type)))
+            elif issubclass(constructor, structUnion):
+                body.append('if self.{} is None:'.format(name))
+                body.append("    raise ValueError('No union case for {}')".format(name))
+                body.append('self.{}._pack_to(buf)'.format(name))
+            else:
+                body.append('if self.{} is not None:'.format(name))
+                body.append('    self.{}._pack_to(buf)'.format(name))
+        if track:
+            body.append('s{} = len(buf)'.format(len(self.groups)))
+        for i, first, last in self.cls._checksums:
+            name, constructor = self.fields[i]
+            module, expression = _checksum_source[constructor.__name__]
+            if module is not None:
+                self.writer.add_import(module)
+            body.append('self.{} = {}'.format(name, expression.format('buf[{}:{}]'.format(
+                self._start(first), self._end(last)))))
+            body.append('struct.pack_into({!r}, buf, {}, self.{})'.format(
+                str(self.order + constructor.fmt), self._start(i), name))
+        return [
+            'def pack(self):',
+            '    buf = bytearray()',
+            '    self._pack_to(buf)',
+            '    return bytes(buf)',
+            '',
+            'def _pack_to(self, buf):',
+        ] + ['    ' + b for b in body]
+
+    def _start(self, i):
+        n, k = self.group_of[i]
+        return 's{}'.format(n) if not k else 's{} + {}'.format(n, k)
+
+    def _end(self, i):
+        n, k = self.group_of[i]
+        if k is None:
+            return 's{}'.format(n + 1)
+        return 's{} + {}'.format(n, k + struct.calcsize(self.order + self.fields[i][1].fmt))
+
+    def _unpack(self):
+        body = []
+        track = len(self.cls._checksums) > 0
+        for n, group in enumerate(self.groups):
+            if track:
+                body.append('s{} = offset'.format(n))
+            if isinstance(group, list):
+                struct_name, size = self.structs[n]
+                body.append('v = {}.unpack_from(buffer, offset)'.format(struct_name))
+                for k, i in enumerate(group):
+                    name, constructor = self.fields[i]
+                    if self._static(constructor):
+                        body.append('if v[{}] != self.{}:'.format(k, name))
+                        body.append("    raise ValueError('Value (%s) does not match expected (%s) {}' % (v[{}], self.{}))"
+                                    .format(name, k, name))
+                    elif constructor.getter is not None:
+                        body.append('self.{} = {}(v[{}])'.format(name, self._ref(constructor.getter[0]), k))
+                    else:
+                        body.append('self.{} = v[{}]'.format(name, k))
+                body.append('offset += {}'.format(size))
+                continue
+            name, constructor = self.fields[group]
+            if issubclass(constructor, structObject):
+                body.extend(self._unpack_object('self.' + name, self.writer.names[constructor]))
+            elif issubclass(constructor, structArray):
+                length = getattr(constructor, 'len', None)
+                object_type = constructor.object_type
+                if isinstance(length, tuple) and isinstance(length[0], int):
+                    body.append('count = {}'.format(length[0]))
+                elif isinstance(length, tuple):
+                    body.append('count = {}(self)'.format(self._ref(length[0])))
+                else:
+                    body.append('count = (len(buffer) - offset) // {}'.format(constructor._item_size))
+                if issubclass(object_type, structField):
+                    body.append("items = list(struct.unpack_from('{}%d{}' % count, buffer, offset))".format(
+                        self.order, object_type.fmt))
+                    if object_type.getter is not None:
+                        body.append('items = [{}(v) for v in items]'.format(self._ref(object_type.getter[0])))
+                    body.append('offset += count * {}'.format(constructor._item_size))
+                else:
+                    body.append('items = []')
+                    body.append('for _ in range(count):')
+                    body.extend('    ' + line for line in self._unpack_object('item', self.writer.names[object_type]))
+                    body.append('    items.append(item)')
+                body.append('self.{} = items'.format(name))
+            elif issubclass(constructor, structUnion):
+                body.append('_type = {}.get({}(self))'.format(self._cases(constructor), self._ref(
+                    constructor.selector[0])))
+                body.append('if _type is None:')
+                body.append("    raise ValueError('No union case for {}')".format(name))
+                body.extend(self._unpack_object('self.' + name, '_type'))
+            else:
+                object_type = constructor.object_type
+                body.append('if {}(self):'.format(self._ref(constructor.present_if[0])))
+                if issubclass(object_type, structObject):
+                    body.extend('    ' + line for line in self._unpack_object(
+                        'self.' + name, self.writer.names[object_type]))
+                else:
+                    fmt = str(self.order + object_type.fmt)
+                    value = 'struct.unpack_from({!r}, buffer, offset)[0]'.format(fmt)
+                    if object_type.getter is not None:
+                        value = '{}({})'.format(self._ref(object_type.getter[0]), value)
+                    body.append('    self.{} = {}'.format(name, value))
+                    body.append('    offset += {}'.format(struct.calcsize(fmt)))
+                body.append('else:')
+                body.append('    self.{} = None'.format(name))
+        if track:
+            body.append('s{} = offset'.format(len(self.groups)))
+        for i, first, last in self.cls._checksums:
+            name, constructor = self.fields[i]
+            module, expression = _checksum_source[constructor.__name__]
+            if module is not None:
+                self.writer.add_import(module)
+            body.append('if {} != self.{}:'.format(expression.format('memoryview(buffer)[{}:{}]'.format(
+                self._start(first), self._end(last))), name))
+            body.append("    raise ValueError('{} checksum mismatch')".format(name))
+        body.append('return offset')
+        return [
+            '@classmethod',
+            'def from_bytes(cls, data):',
+            '    obj = cls.__new__(cls)',
+            '    obj._unpack_from(data, 0)',
+            '    return obj',
+            '',
+            'def unpack(self, data):',
+            '    self._unpack_from(data, 0)',
+            '',
+            'def unpack_from(self, buffer, offset=0):',
+            '    return self._unpack_from(buffer, offset) - offset',
+            '',
+            'def _unpack_from(self, buffer, offset):',
+            '    "Decodes the record starting at offset and returns the offset after it"',
+        ] + ['    ' + b for b in body]
+
+    def _unpack_object(self, target, class_name):
+        return [
+            'obj = {0}.__new__({0})'.format(class_name),
+            'offset = obj._unpack_from(buffer, offset)',
+            '{} = obj'.format(target),
+        ]
+
+    def _export(self):
+        tuple_items = []
+        dict_items = []
+        for name, constructor in self.fields:
+            value = 'self.{}'.format(name)
+            if issubclass(constructor, structField):
+                tuple_value = dict_value = value
+            elif issubclass(constructor, structObject):
+                tuple_value = value + '.to_tuple()'
+                dict_value = value + '.to_dict()'
+            elif issubclass(constructor, structArray):
+                if issubclass(constructor.object_type, structField):
+                    tuple_value = 'tuple({})'.format(value)
+                    dict_value = 'list({})'.format(value)
+                else:
+                    tuple_value = 'tuple([item.to_tuple() for item in {}])'.format(value)
+                    dict_value = '[item.to_dict() for item in {}]'.format(value)
+            elif issubclass(constructor, structOptional) and issubclass(constructor.object_type, structField):
+                tuple_value = dict_value = value
+            else:
+                tuple_value = 'None if {0} is None else {0}.to_tuple()'.format(value)
+                dict_value = 'None if {0} is None else {0}.to_dict()'.format(value)
+            tuple_items.append('({}), '.format(tuple_value))
+            dict_items.append('{!r}: ({})'.format(str(name), dict_value))
+        return [
+            'def to_tuple(self):',
+            '    return ({})'.format(''.join(tuple_items)),
+            '',
+            'def to_dict(self):',
+            '    return {{{}}}'.format(', '.join(dict_items)),
+            '',
+            'def items(self):',
+            '    return [(name, getattr(self, name)) for name in self._field_order]',
+        ]
+
+
+def compile_module(module, classes=None):
+    """Returns the source of a module with compiled versions of the structObject classes
+
+    module - the module (or its name) defining the classes
+    classes - the classes to compile, by default every structObject subclass defined in module that
+              doesn't leave fields to subclasses
+    """
+    if isinstance(module, str):
+        module = importlib.import_module(module)
+    if classes is None:
+        classes = []
+        for attr in vars(module).values():
+            if inspect.isclass(attr) and issubclass(attr, structObject) and attr.__module__ == module.__name__ \
+                    and Empty not in attr._constructors and attr is not Empty:
+                classes.append(attr)
+    writer = _moduleWriter()
+    for cls in classes:
+        compile_class(writer, cls)
+    return writer.source()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m structobject.codegen',
+                                     description='Compile the structObject classes of a module')
+    parser.add_argument('module', help='module defining the classes')
+    parser.add_argument('output', help='path of the generated module')
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, '')
+    source = compile_module(args.module)
+    with open(args.output, 'w') as f:
+        f.write(source)
+
+
+if __name__ == '__main__':
+    main()
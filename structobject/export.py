@@ -0,0 +1,191 @@
+"""
+Exports a binary file of records to JSON Lines, CSV or msgpack
+
+As a library:
+
+export_records(Path, 'paths.bin', 'paths.jsonl', format='jsonl')
+
+From the command line, naming the class as module:Class:
+
+python -m structobject.export mymodule:Path paths.bin paths.csv --format csv
+"""
+from __future__ import absolute_import
+
+import argparse
+import csv
+import importlib
+import io
+import json
+import sys
+
+from .compatibility import string_types
+from .structFile import iter_batches, DEFAULT_CHUNK_SIZE
+from .structObject import structObject, structArray
+
+formats = ('jsonl', 'csv', 'msgpack')
+
+
+def _default(value):
+    "JSON encoding of values json doesn't handle, bytes from char and string fields"
+    if isinstance(value, bytes):
+        return value.decode('latin-1')
+    raise TypeError("Object of type '{}' is not JSON serializable".format(value.__class__.__name__))
+
+
+def _fixed_array(constructor):
+    "True for arrays with a constant number of elements"
+    if not issubclass(constructor, structArray):
+        return False
+    length = getattr(constructor, 'len', None)
+    return isinstance(length, tuple) and isinstance(length[0], int)
+
+
+def columns(cls, prefix=''):
+    """Returns the CSV columns of cls, dotted names of its fields, substructures and the elements of
+    constant length arrays. Variable length arrays, unions and optional fields take one column each."""
+    names = []
+    for name, constructor in zip(cls._field_order, cls._constructors):
+        name = prefix + name
+        if issubclass(constructor, structObject):
+            names.extend(columns(constructor, name + '.'))
+        elif _fixed_array(constructor):
+            for i in range(constructor.len[0]):
+                if issubclass(constructor.object_type, structObject):
+                    names.extend(columns(constructor.object_type, "{}.{}.".format(name, i)))
+                else:
+                    names.append("{}.{}".format(name, i))
+        else:
+            names.append(name)
+    return names
+
+
+def _row(cls, record, encode, prefix='', row=None):
+    "Flattens a dict from to_dict() of cls into the columns() of cls"
+    if row is None:
+        row = {}
+    for name, constructor in zip(cls._field_order, cls._constructors):
+        value = record[name]
+        name = prefix + name
+        if issubclass(constructor, structObject):
+            _row(constructor, value, encode, name + '.', row)
+        elif _fixed_array(constructor):
+            for i, item in enumerate(value):
+                if issubclass(constructor.object_type, structObject):
+                    _row(constructor.object_type, item, encode, "{}.{}.".format(name, i), row)
+                else:
+                    row["{}.{}".format(name, i)] = item
+        elif isinstance(value, (dict, list)):
+            # the layout of these varies between records, so they are kept whole as JSON
+            row[name] = encode(value)
+        else:
+            row[name] = value
+    return row
+
+
+class _jsonlWriter(object):
+    def __init__(self, f):
+        self.f = f
+        self.encoder = json.JSONEncoder(default=_default)
+
+    def write(self, batch):
+        encode = self.encoder.encode
+        self.f.write("\n".join([encode(obj.to_dict()) for obj in batch]) + "\n")
+
+
+class _csvWriter(object):
+    def __init__(self, f):
+        self.f = f
+        self.writer = None
+        self.encode = json.JSONEncoder(default=_default).encode
+
+    def write(self, batch):
+        if len(batch) == 0:
+            return
+        cls = batch[0].__class__
+        if self.writer is None:
+            # columns follow the class layout, so every record has the same ones
+            self.writer = csv.DictWriter(self.f, fieldnames=columns(cls), restval='')
+            self.writer.writeheader()
+        self.writer.writerows([_row(cls, obj.to_dict(), self.encode) for obj in batch])
+
+
+class _msgpackWriter(object):
+    def __init__(self, f):
+        try:
+            import msgpack
+        except ImportError:
+            raise ImportError("msgpack export requires the msgpack package")
+        self.f = f
+        self.packer = msgpack.Packer()
+
+    def write(self, batch):
+        pack = self.packer.pack
+        self.f.write(b"".join([pack(obj.to_dict()) for obj in batch]))
+
+
+_writers = {
+    'jsonl': _jsonlWriter,
+    'csv': _csvWriter,
+    'msgpack': _msgpackWriter,
+}
+
+
+def export_records(cls, src, dst, format='jsonl', chunk_size=DEFAULT_CHUNK_SIZE):
+    """Decodes the records of cls in src and writes them to dst, returns the number of records
+
+    src and dst may be paths or open files, dst must be opened in text mode for jsonl and csv and
+    binary mode for msgpack. Records are decoded and written a chunk of the input at a time.
+    """
+    if format not in _writers:
+        raise ValueError("Unsupported format '{}', expected one of {}".format(format, ", ".join(formats)))
+    close = False
+    if isinstance(dst, string_types):
+        if format == 'msgpack':
+            dst = open(dst, 'wb')
+        else:
+            dst = io.open(dst, 'w', newline='')
+        close = True
+    try:
+        writer = _writers[format](dst)
+        count = 0
+        for batch in iter_batches(cls, src, chunk_size=chunk_size):
+            writer.write(batch)
+            count += len(batch)
+        return count
+    finally:
+        if close:
+            dst.close()
+
+
+def _load_class(name):
+    "Imports the structObject subclass given as 'module:Class'"
+    module_name, _, class_name = name.partition(':')
+    if not class_name:
+        raise ValueError("Class must be given as module:Class, got '{}'".format(name))
+    obj = importlib.import_module(module_name)
+    for attr in class_name.split('.'):
+        obj = getattr(obj, attr)
+    return obj
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m structobject.export',
+                                     description='Export a binary file of records')
+    parser.add_argument('cls', help='record class as module:Class')
+    parser.add_argument('src', help='binary input file')
+    parser.add_argument('dst', help="output file, '-' for stdout")
+    parser.add_argument('--format', choices=formats, default='jsonl')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help='bytes of input decoded per batch')
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, '')
+    cls = _load_class(args.cls)
+    dst = args.dst
+    if dst == '-':
+        dst = sys.stdout.buffer if args.format == 'msgpack' else sys.stdout
+    export_records(cls, args.src, dst, format=args.format, chunk_size=args.chunk_size)
+
+
+if __name__ == '__main__':
+    main()
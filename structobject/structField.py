@@ -11,6 +11,24 @@ myfieldclass = ctype_double(
 myfield = myfieldclass()
 myfieldclass()
 """
+import binascii
+import zlib
+
+
+# validation policies, see structObject._validation
+strict = 'strict'  # validate on every assignment, including unpack
+on_pack = 'on_pack'  # validate changed fields once when packed
+trusted = 'trusted'  # never validate
+
+
+class ValidationError(Exception):
+    """Raised when a field value is rejected by its validators"""
+    pass
+
+
+class ChecksumError(ValidationError):
+    """Raised by unpack when a checksum field doesn't match the bytes it covers"""
+    pass
 
 
 class structField(object):
@@ -24,6 +42,7 @@ class structField(object):
     getter - conversion function on value after unpack
     setter - conversion function of value before pack
     generator - a special function that takes the parent instance as parameter
+    depends - names of the fields a generator reads, the generated value is cached until one changes
     validator - validation function called on __set__
     value - initializing with a value sets the field as static
     """
@@ -36,12 +55,15 @@ class structField(object):
         'setter',
         'generator',
         'validator',
-        'doc')
+        'doc',
+        '_stale')
 
     _static = False  # bool, indicates weith value can be set
 
     def __init__(self, _parent, init_value=None):
         self._parent = _parent
+        if self.generator is not None:
+            self._stale = True
 
         # defaults
         # self._variable_length = False
@@ -58,47 +80,81 @@ class structField(object):
 
         if self._static == False:
             self.value = None
+            # validators only run here when the parent validates on assignment
+            validate = _parent is None or _parent._validation == strict
             if init_value == None:
-                self.set(self.default)
+                self.set(self.default, validate)
             else:
-                self.set(init_value)
+                self.set(init_value, validate)
         elif init_value != None and self.value != init_value:
             raise Exception("Can't store value for static field")
 
+    def _clone(self, _parent):
+        "Returns a copy of the field for another parent, without running __init__ and the validators"
+        field = self.__class__.__new__(self.__class__)
+        field._parent = _parent
+        if not self._static:
+            field.value = self.value
+        if self.generator is not None:
+            field._stale = True
+        return field
+
     def get(self, raw=False):
         # if self.generator != None && raw == False:
         #    return self.generator[0](self._parent)
         # else:
         return self.value
 
-    def set(self, value):
+    def set(self, value, validate=True):
         if self._static:
             raise AttributeError('Static field is not writeable')
         # elif self.generator != None:
         # raise AttributeError('Generated field is not writeable')
         else:
-            if self.validator is not None:
+            if validate and self.validator is not None:
                 for val in self.validator:
                     if not val(value):
-                        raise Exception("Validation error, given value {}".format(value))
+                        raise ValidationError("Validation error, given value {}".format(value))
 
             self.value = value
 
-    def prep(self):
+    def validate(self):
+        "Runs the validators and type check against the current value"
+        if self._static or self.generator is not None:
+            return
+        if self.validator is not None:
+            for val in self.validator:
+                if not val(self.value):
+                    raise ValidationError("Validation error, given value {}".format(self.value))
+        if self.setter is not None:
+            _tmp = self.setter[0](self.value)
+        else:
+            _tmp = self.value
+        if not isinstance(_tmp, self.python_type):
+            raise ValidationError("{} is not of type {}".format(self.value, type(self.python_type())))
+
+    def generate(self):
+        "Evaluates the generator and stores the result as the field value"
+        self.value = self.generator[0](self._parent)
+        self._stale = False
+
+    def prep(self, validate=True):
         if self.generator is not None:
-            val = self.generator[0](self._parent)
+            if self._stale or self.depends is None:
+                self.generate()
+            val = self.value
         else:
             val = self.get()
         if self.setter is not None:
             _tmp = self.setter[0](val)
         else:
             _tmp = val
-        if not isinstance(_tmp, self.python_type):
+        if validate and not isinstance(_tmp, self.python_type):
             raise Warning("{} is not of type {}, trying coercion".format(self.get(), type(self.python_type())))
             _tmp = self.python_type(_tmp)
         return _tmp
 
-    def unprep(self, value):
+    def unprep(self, value, validate=True):
         if self.getter is not None:
             _tmp = self.getter[0](value)
         else:
@@ -110,11 +166,28 @@ class structField(object):
             else:
                 pass  # looks good
         else:
-            self.set(_tmp)
+            self.set(_tmp, validate)
+            if self.generator is not None:
+                self._stale = False
         # TODO generator
         # TODO if static should match value
 
 
+class checksumField(structField):
+    """A field holding a checksum of other fields in the packed record
+
+    pack() fills it in from the bytes already written, unpack() verifies it against the input.
+
+    Parameters:
+    over - (first, last) field names of the covered range, or a single field name, defaults
+           to every field preceding the checksum
+    """
+    __slots__ = ()
+
+    def compute(self, data):
+        return self.algorithm[0](data)
+
+
 # attributes (passed into the factories as named parameters) that all
 # subclassses have in common
 _standard_parameters = [
@@ -123,6 +196,7 @@ _standard_parameters = [
     'getter',
     'setter',
     'generator',
+    'depends',
     'validator',
     'doc']
 
@@ -155,6 +229,10 @@ def attrib_housekeeping(default_attrib, user_attrib, special_attrib):
         default_attrib['generator'] = (default_attrib['generator'],)
     else:
         default_attrib['generator'] = None
+    if 'depends' in default_attrib:
+        default_attrib['depends'] = tuple(default_attrib['depends'])
+    else:
+        default_attrib['depends'] = None
     if 'validator' in default_attrib:
         default_attrib['validator'] = default_attrib['validator']
     else:
@@ -344,3 +422,65 @@ def ctype_string(**kargs):
     }
     attrib_housekeeping(obj_dict, kargs, special_parameters)
     return type('ctype_string', (structField,), obj_dict)
+
+
+def _checksum_housekeeping(default_attrib, user_attrib):
+    """Utility function for the checksumField factory functions."""
+    attrib_housekeeping(default_attrib, user_attrib, ['over'])
+    over = default_attrib.get('over')
+    if isinstance(over, str):
+        over = (over, over)
+    default_attrib['over'] = over
+    default_attrib['algorithm'] = (default_attrib['algorithm'],)  # protect from becoming class method
+
+
+def crc16_field(**kargs):
+    obj_dict = {
+        '__slots__': (),
+        'fmt': 'H',
+        'default': 0,
+        'python_type': int,
+        'doc': 'CRC-16/CCITT-FALSE checksum',
+        'algorithm': lambda data: binascii.crc_hqx(data, 0xffff),
+    }
+    _checksum_housekeeping(obj_dict, kargs)
+    return type('crc16_field', (checksumField,), obj_dict)
+
+
+def crc32_field(**kargs):
+    obj_dict = {
+        '__slots__': (),
+        'fmt': 'I',
+        'default': 0,
+        'python_type': int,
+        'doc': 'CRC-32 checksum',
+        'algorithm': lambda data: zlib.crc32(data) & 0xffffffff,
+    }
+    _checksum_housekeeping(obj_dict, kargs)
+    return type('crc32_field', (checksumField,), obj_dict)
+
+
+def sum8_field(**kargs):
+    obj_dict = {
+        '__slots__': (),
+        'fmt': 'B',
+        'default': 0,
+        'python_type': int,
+        'doc': '8 bit additive checksum',
+        'algorithm': lambda data: sum(data) & 0xff,
+    }
+    _checksum_housekeeping(obj_dict, kargs)
+    return type('sum8_field', (checksumField,), obj_dict)
+
+
+def sum16_field(**kargs):
+    obj_dict = {
+        '__slots__': (),
+        'fmt': 'H',
+        'default': 0,
+        'python_type': int,
+        'doc': '16 bit additive checksum',
+        'algorithm': lambda data: sum(data) & 0xffff,
+    }
+    _checksum_housekeeping(obj_dict, kargs)
+    return type('sum16_field', (checksumField,), obj_dict)
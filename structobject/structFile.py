@@ -0,0 +1,741 @@
+"""
+Reading and writing files of consecutive records
+
+# decode every Point in a file, holding one chunk of the file in memory at a time
+for point in iter_unpack(Point, 'points.bin'):
+    print(point.x)
+
+Paths to gzip, bz2 and xz/lzma compressed files are decompressed as they're read, and such file
+objects can be passed in directly.
+"""
+import bz2
+import gzip
+import heapq
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+try:
+    from .compatibility import string_types
+    from .structField import structField, trusted
+    from .structObject import structObject, structArray, structConditional, structUnion, structSegment, \
+        little_endian, native, _compile, _fixed_size
+except:
+    from compatibility import string_types
+    from structField import structField, trusted
+    from structObject import structObject, structArray, structConditional, structUnion, structSegment, \
+        little_endian, native, _compile, _fixed_size
+
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+
+# magic numbers and extensions of the compressed formats, lzma is missing from some builds
+_compressions = [(b'\x1f\x8b', ('.gz',), gzip.GzipFile), (b'BZh', ('.bz2',), bz2.BZ2File)]
+if lzma is not None:
+    _compressions.append((b'\xfd7zXZ\x00', ('.xz', '.lzma'), lzma.LZMAFile))
+
+
+def _open_path(path, mode):
+    "Opens a path, through a decompressor if the file is compressed (or named as such when writing)"
+    if 'r' in mode:
+        with open(path, 'rb') as f:
+            magic = f.read(6)
+        for prefix, extensions, opener in _compressions:
+            if magic.startswith(prefix):
+                return opener(path, mode)
+    else:
+        for prefix, extensions, opener in _compressions:
+            if path.endswith(extensions):
+                return opener(path, mode)
+    return open(path, mode)
+
+
+class _openRecords(object):
+    """Context manager giving a binary file object for a path or an already open file
+
+    Files opened from a path are closed on exit, file objects passed in are left open.
+    """
+
+    def __init__(self, src, mode='rb'):
+        self.src = src
+        self.mode = mode
+        self.file = None
+
+    def __enter__(self):
+        if isinstance(self.src, string_types):
+            self.file = _open_path(self.src, self.mode)
+            return self.file
+        return self.src
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.file is not None:
+            self.file.close()
+
+
+class _chunkReader(object):
+    """Reads a binary file into one reusable buffer, a chunk at a time
+
+    Iterating yields a memoryview of the bytes read so far, the caller sets consumed to the length
+    of the complete records it decoded and the rest is carried over in front of the next chunk. The
+    buffer grows if a single record doesn't fit. With copy each chunk is yielded as bytes instead,
+    for records that keep a view of what they were unpacked from (lazy arrays).
+    """
+
+    def __init__(self, f, chunk_size, name, copy=False):
+        self.f = f
+        self.buffer = bytearray(chunk_size)
+        self.length = 0
+        self.consumed = 0
+        self.eof = False
+        self.name = name
+        self.copy = copy
+
+    def __iter__(self):
+        while not self.eof:
+            if self.length == len(self.buffer):
+                self.buffer.extend(bytearray(len(self.buffer)))
+            self._fill()
+            if self.length == 0:
+                return
+            self.consumed = 0
+            with memoryview(self.buffer) as view:
+                with view[:self.length] as data:
+                    yield bytes(data) if self.copy else data
+            remainder = self.length - self.consumed
+            if self.eof and remainder > 0:
+                raise struct.error("{} trailing bytes don't hold a complete {}".format(remainder, self.name))
+            self.buffer[:remainder] = self.buffer[self.consumed:self.length]
+            self.length = remainder
+
+    def _fill(self):
+        "Reads until the buffer is full or the file ends"
+        with memoryview(self.buffer) as view:
+            while self.length < len(self.buffer):
+                with view[self.length:] as target:
+                    if hasattr(self.f, 'readinto'):
+                        n = self.f.readinto(target)
+                    else:
+                        chunk = self.f.read(len(target))
+                        n = len(chunk)
+                        target[:n] = chunk
+                if not n:
+                    self.eof = True
+                    return
+                self.length += n
+
+
+def _keeps_buffer(cls, seen=None):
+    "Returns True if records of cls can hold a view of the buffer they're unpacked from"
+    if seen is None:
+        seen = set()
+    if cls in seen:
+        return False
+    seen.add(cls)
+    for constructor in cls._constructors:
+        if issubclass(constructor, structArray):
+            if constructor.lazy:
+                return True
+            types = [constructor.object_type]
+        elif issubclass(constructor, structConditional):
+            types = list(constructor._types(constructor))
+        else:
+            types = [constructor]
+        for t in types:
+            if issubclass(t, structObject) and _keeps_buffer(t, seen):
+                return True
+    return False
+
+
+def iter_unpack(cls, src, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yields instances of cls decoded one after another from a binary file or path
+
+    The file is read chunk_size bytes at a time, a record split across two chunks is carried
+    over to the next, so memory use is bounded by the chunk size (or the largest record).
+    """
+    for batch in iter_batches(cls, src, chunk_size=chunk_size):
+        for obj in batch:
+            yield obj
+
+
+def iter_batches(cls, src, chunk_size=DEFAULT_CHUNK_SIZE):
+    "Yields lists of the instances of cls decoded from each chunk of a binary file or path"
+    with _openRecords(src) as f:
+        reader = _chunkReader(f, chunk_size, cls.__name__, _keeps_buffer(cls))
+        for data in reader:
+            batch = []
+            offset = 0
+            while offset < len(data):
+                if cls._fixed_size is not None and len(data) - offset < cls._fixed_size:
+                    break
+                obj = cls()
+                try:
+                    offset += obj.unpack_from(data, offset)
+                except struct.error:
+                    # record continues in the next chunk
+                    break
+                batch.append(obj)
+            reader.consumed = offset
+            if len(batch) > 0:
+                yield batch
+
+
+class recordWriter(object):
+    """Appends records to a file, packing them into one buffer that is written in large blocks
+
+    with recordWriter('log.bin', Datagram, flush_interval=1.0) as writer:
+        writer.write(datagram)
+        writer.write({'timestamp': t, 'body': body})
+
+    Records are instances of cls, dicts as taken by cls.from_dict or tuples of field values as
+    taken by cls.from_tuple. The buffer is written when it holds buffer_size bytes, flush_interval
+    seconds after the first record buffered since the last flush (by a timer thread if no write
+    comes first), and by flush() and close(). With fsync each of those writes is also synced to
+    disk. With max_file_size, a record that would take the file past that size starts a new one,
+    and the full files are renamed path.1, path.2 etc, oldest first. Paths ending in .gz, .bz2 or
+    .xz are compressed, sizes count the uncompressed bytes written plus the size on disk of the file
+    being appended to.
+    """
+
+    def __init__(self, path, cls, buffer_size=DEFAULT_CHUNK_SIZE, flush_interval=None, fsync=False,
+                 max_file_size=None):
+        self.path = path
+        self.cls = cls
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.max_file_size = max_file_size
+        self.count = 0
+        self._buffer = bytearray()
+        self._last_flush = time.time()
+        self._lock = threading.Lock()
+        self._timer = None
+        self._file = _open_path(path, 'ab')
+        # tell() starts at 0 when appending to a compressed file
+        self._size = os.path.getsize(path)
+        self._rotations = 0
+        while os.path.exists('{}.{}'.format(path, self._rotations + 1)):
+            self._rotations += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, record):
+        "Packs a record into the buffer, writing the buffer out if it is due"
+        if not isinstance(record, structObject):
+            if isinstance(record, dict):
+                record = self.cls.from_dict(record)
+            else:
+                record = self.cls.from_tuple(record)
+        elif record.__class__ is not self.cls:
+            raise TypeError("'{}' can't be written to a file of '{}'".format(
+                record.__class__.__name__, self.cls.__name__))
+        with self._lock:
+            buf = self._buffer
+            start = len(buf)
+            record._pack_to(buf)
+            self.count += 1
+            if self.max_file_size is not None and self._size + len(buf) > self.max_file_size and \
+                    self._size + start > 0:
+                # the record starts a new file
+                self._write(start)
+                self._rotate()
+            if len(buf) >= self.buffer_size or \
+                    (self.flush_interval is not None and time.time() - self._last_flush >= self.flush_interval):
+                self._flush()
+            elif self.flush_interval is not None and self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self._timed_flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def write_many(self, records):
+        for record in records:
+            self.write(record)
+
+    def flush(self):
+        "Writes out the buffer"
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._write(len(self._buffer))
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._last_flush = time.time()
+
+    def _timed_flush(self):
+        "Runs on the timer thread, flush_interval after a record was buffered"
+        with self._lock:
+            self._timer = None
+            if self._file is not None and len(self._buffer) > 0:
+                self._flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._flush()
+                self._file.close()
+                self._file = None
+
+    def _write(self, length):
+        if length > 0:
+            with memoryview(self._buffer) as view:
+                with view[:length] as data:
+                    self._file.write(data)
+            del self._buffer[:length]
+            self._size += length
+
+    def _rotate(self):
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._file.close()
+        self._rotations += 1
+        os.rename(self.path, '{}.{}'.format(self.path, self._rotations))
+        self._file = _open_path(self.path, 'ab')
+        self._size = 0
+
+
+def _little(byte_order):
+    "Returns True if byte_order ('=', '<', '>' or '!') is little endian"
+    if byte_order == native:
+        return sys.byteorder == 'little'
+    return byte_order == little_endian
+
+
+def _field_swaps(constructor, offset, swaps, byte_order, to_little):
+    """Appends the (offset, width) of each multi byte scalar of a fixed size field type that is stored
+    in a byte order other than the target to swaps and returns the offset after it, raises TypeError if
+    the type isn't fixed size. Scalars take the byte_order of the record holding them."""
+    if issubclass(constructor, structField) and not constructor._variable_length:
+        width = struct.calcsize(native + constructor.fmt)
+        if width > 1 and constructor.fmt not in 'sp' and _little(byte_order) != to_little:
+            swaps.append((offset, width))
+        return offset + width
+    elif issubclass(constructor, structObject) and constructor._fixed_size is not None:
+        for c in constructor._constructors:
+            offset = _field_swaps(c, offset, swaps, constructor._byte_order, to_little)
+        return offset
+    elif issubclass(constructor, structArray) and isinstance(constructor.len, tuple) and \
+            isinstance(constructor.len[0], int):
+        for i in range(constructor.len[0]):
+            offset = _field_swaps(constructor.object_type, offset, swaps, byte_order, to_little)
+        return offset
+    raise TypeError("'{}' isn't fixed size".format(constructor.__name__))
+
+
+def _record_swaps(obj, offset, swaps, plans, to_little):
+    "Appends the (offset, width) of each multi byte scalar to swap in a decoded record, returns the offset after it"
+    for n, seg in enumerate(obj._segments):
+        if isinstance(seg, structSegment):
+            key = (obj.__class__, n)
+            if key not in plans:
+                plans[key] = []
+                end = 0
+                for c in obj._constructors[seg.slice]:
+                    end = _field_swaps(c, end, plans[key], obj._byte_order, to_little)
+            swaps.extend((offset + start, width) for start, width in plans[key])
+            offset += seg.size
+        else:
+            offset = _value_swaps(obj._values[seg], offset, swaps, plans, obj._byte_order, to_little)
+    return offset
+
+
+def _value_swaps(value, offset, swaps, plans, byte_order, to_little):
+    if isinstance(value, structObject):
+        return _record_swaps(value, offset, swaps, plans, to_little)
+    elif isinstance(value, structField):
+        return _field_swaps(value.__class__, offset, swaps, byte_order, to_little)
+    elif isinstance(value, structConditional):
+        if value._value is None:
+            return offset
+        return _value_swaps(value._value, offset, swaps, plans, byte_order, to_little)
+    elif isinstance(value, structArray):
+        if issubclass(value.object_type, structField):
+            for i in range(len(value)):
+                offset = _field_swaps(value.object_type, offset, swaps, byte_order, to_little)
+            return offset
+        for item in value._elements():
+            offset = _record_swaps(item, offset, swaps, plans, to_little)
+        return offset
+    raise TypeError("Can't transcode '{}'".format(value.__class__.__name__))
+
+
+def _has_checksums(constructor):
+    "Returns True if records of a field type may hold checksum fields"
+    if issubclass(constructor, structObject):
+        return len(constructor._checksums) > 0 or any(_has_checksums(c) for c in constructor._constructors)
+    elif issubclass(constructor, structArray):
+        return _has_checksums(constructor.object_type)
+    elif issubclass(constructor, structConditional):
+        types = constructor.cases.values() if hasattr(constructor, 'cases') else (constructor.object_type,)
+        return any(_has_checksums(c) for c in types)
+    return False
+
+
+def _checksum_fields(value, offset, buf, to_byte_order):
+    """Recomputes the checksums of a decoded record over its transcoded bytes at offset of buf, those of
+    substructures first as when packing, returns the offset after the record"""
+    if isinstance(value, structObject):
+        starts = []
+        for seg in value._segments:
+            starts.append(offset)
+            if isinstance(seg, structSegment):
+                offset += seg.size
+            else:
+                offset = _checksum_fields(value._values[seg], offset, buf, to_byte_order)
+        starts.append(offset)
+        for i, first, last in value._checksums:
+            field = value._values[i]
+            with memoryview(buf) as data:
+                field.value = field.compute(data[value._span(first, starts)[0]:value._span(last, starts)[1]])
+            struct.pack_into(to_byte_order + field.fmt, buf, value._span(i, starts)[0], field.value)
+        return offset
+    elif isinstance(value, structConditional) and isinstance(value._value, structObject):
+        return _checksum_fields(value._value, offset, buf, to_byte_order)
+    elif isinstance(value, structArray) and issubclass(value.object_type, structObject):
+        for item in value._elements():
+            offset = _checksum_fields(item, offset, buf, to_byte_order)
+        return offset
+    return offset + value.size
+
+
+def transcode(cls, src, dst, to_byte_order=little_endian, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Copies the records of cls in src to dst converted to to_byte_order, returns the record count
+
+    Multi byte fields are reversed in place rather than unpacked and packed. Each field is converted
+    from the byte order of the record holding it, so substructures already in to_byte_order are left
+    as they are. Fixed size records are converted a chunk at a time by permuting the bytes at each
+    position of the record stride. Records of variable size, or holding checksums, are decoded into a
+    single reused instance to find their layout, and their checksums are computed again over the
+    converted bytes.
+    """
+    to_little = _little(to_byte_order)
+    perm = None
+    if cls._fixed_size is not None and not _has_checksums(cls):
+        swaps = []
+        _field_swaps(cls, 0, swaps, cls._byte_order, to_little)
+        perm = list(range(cls._fixed_size))
+        for start, width in swaps:
+            perm[start:start + width] = reversed(perm[start:start + width])
+        positions = [(j, k) for j, k in enumerate(perm) if j != k]
+        stride = cls._fixed_size
+    else:
+        obj = cls()
+        plans = {}
+        checksums = _has_checksums(cls)
+
+    count = 0
+    with _openRecords(src) as f, _openRecords(dst, 'wb') as out:
+        # records are copied out of each chunk anyway, so the chunk is taken as bytes to slice it with steps
+        reader = _chunkReader(f, chunk_size, cls.__name__, copy=True)
+        for data in reader:
+            if perm is not None:
+                end = len(data) - len(data) % stride
+                converted = bytearray(data[:end])
+                for j, k in positions:
+                    converted[j::stride] = data[k:end:stride]
+                count += end // stride
+            else:
+                converted = bytearray()
+                end = 0
+                while end < len(data):
+                    try:
+                        size = obj.unpack_from(data, end, trusted)
+                    except struct.error:
+                        # record continues in the next chunk
+                        break
+                    start = len(converted)
+                    converted += data[end:end + size]
+                    swaps = []
+                    _record_swaps(obj, start, swaps, plans, to_little)
+                    for i, width in swaps:
+                        converted[i:i + width] = converted[i:i + width][::-1]
+                    if checksums:
+                        _checksum_fields(obj, start, converted, to_byte_order)
+                    end += size
+                    count += 1
+            out.write(converted)
+            reader.consumed = end
+    return count
+
+
+def _locate(cls, name):
+    """Returns the byte offset and type of a scalar field at the same position in every record of cls,
+    name may be dotted to reach into substructures"""
+    head, _, rest = name.partition('.')
+    if head not in cls._field_index:
+        raise KeyError("'{}' has no field '{}'".format(cls.__name__, head))
+    i = cls._field_index[head]
+    offset = 0
+    for seg in cls._segments:
+        if isinstance(seg, structSegment):
+            if seg.slice.start <= i < seg.slice.stop:
+                offset += seg.offsets[i - seg.slice.start]
+                break
+            offset += seg.size
+        elif seg == i:
+            break
+        else:
+            size = _fixed_size(cls._constructors[seg])
+            if size is None:
+                raise ValueError("'{}' follows a variable size field, it has no fixed offset".format(name))
+            offset += size
+    constructor = cls._constructors[i]
+    if rest:
+        if not issubclass(constructor, structObject):
+            raise KeyError("'{}' has no field '{}'".format(constructor.__name__, rest))
+        inner, constructor, byte_order = _locate(constructor, rest)
+        return offset + inner, constructor, byte_order
+    if not issubclass(constructor, structField) or constructor._variable_length:
+        raise ValueError("'{}' isn't a scalar field".format(name))
+    return offset, constructor, cls._byte_order
+
+
+def _predicate(cls, where):
+    """Compiles the conditions of where into a function of (buffer, offset) that reads only the fields
+    referenced, each condition is a value to equal, a (low, high) inclusive range (either may be None)
+    or a function of the value, values are compared after the field's getter"""
+    namespace = {}
+    lines = ["def match(buffer, offset):\n"]
+    for n, (name, condition) in enumerate(sorted(where.items())):
+        offset, constructor, byte_order = _locate(cls, name)
+        namespace['_s{}'.format(n)] = struct.Struct(byte_order + constructor.fmt)
+        lines.append("    v = _s{}.unpack_from(buffer, offset + {})[0]\n".format(n, offset))
+        if constructor.getter is not None:
+            namespace['_g{}'.format(n)] = constructor.getter[0]
+            lines.append("    v = _g{}(v)\n".format(n))
+        namespace['_c{}'.format(n)] = condition
+        if callable(condition):
+            test = "_c{}(v)".format(n)
+        elif isinstance(condition, tuple) and len(condition) == 2:
+            low, high = condition
+            namespace['_l{}'.format(n)], namespace['_h{}'.format(n)] = low, high
+            bounds = []
+            if low is not None:
+                bounds.append("_l{} <= v".format(n))
+            if high is not None:
+                bounds.append("v <= _h{}".format(n))
+            test = " and ".join(bounds) or "True"
+        else:
+            test = "v == _c{}".format(n)
+        lines.append("    if not ({}):\n        return False\n".format(test))
+    lines.append("    return True\n")
+    return _compile("".join(lines), 'match', namespace)
+
+
+def scan(cls, src, where, offsets=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yields the records of cls in src matching where, or their byte offsets in src if offsets is True
+
+    src is a path, binary file or buffer (bytes, bytearray, memoryview or mmap). The conditions
+    only read the referenced fields at their offsets in the raw bytes (see _predicate), so records
+    are decoded only once they match. The size of a variable size record is found by decoding only
+    its scalar fields, which lengths and selectors read, into one reused instance (see _record_end).
+    """
+    if isinstance(src, (bytes, bytearray, memoryview, mmap.mmap)):
+        return _scan(cls, [src], None, where, offsets)
+    return _scan_file(cls, src, where, offsets, chunk_size)
+
+
+def _scan_file(cls, src, where, offsets, chunk_size):
+    with _openRecords(src) as f:
+        reader = _chunkReader(f, chunk_size, cls.__name__, _keeps_buffer(cls) and not offsets)
+        for found in _scan(cls, reader, reader, where, offsets):
+            yield found
+
+
+def _record_end(obj, buffer, offset, scratch):
+    """Returns the offset after the record of obj's class starting at offset of buffer, raises
+    struct.error if it runs past the end. Only the segments of scalar fields are decoded into obj, the
+    elements of arrays and scalar values of conditionals are skipped by their size. Substructures of
+    variable size in arrays and conditionals are walked with reused instances of scratch, by class."""
+    for seg in obj._segments:
+        if isinstance(seg, structSegment):
+            obj._unprep_segment(seg, seg.unpack_from(buffer, offset), False)
+            offset += seg.size
+            continue
+        value = obj._values[seg]
+        if isinstance(value, structObject):
+            offset = _record_end(value, buffer, offset, scratch)
+            continue
+        if isinstance(value, structArray):
+            if value.len is None:
+                count = (len(buffer) - offset) // value._item_size
+            elif isinstance(value.len[0], int):
+                count = value.len[0]
+            else:
+                count = value.len[0](obj)
+            object_type = value.object_type
+            if issubclass(object_type, structField) or object_type._fixed_size is not None:
+                offset += count * value._item_size
+                continue
+        else:
+            object_type = value._select()
+            if object_type is None:
+                if isinstance(value, structUnion):
+                    raise Exception("No union case for selector value {}".format(value.selector[0](obj)))
+                continue
+            if issubclass(object_type, structField):
+                offset += struct.calcsize(native + object_type.fmt)
+                continue
+            count = 1
+        if object_type not in scratch:
+            scratch[object_type] = object_type()
+        for i in range(count):
+            offset = _record_end(scratch[object_type], buffer, offset, scratch)
+    if offset > len(buffer):
+        raise struct.error("{} needs {} bytes, the buffer holds {}".format(
+            obj.__class__.__name__, offset, len(buffer)))
+    return offset
+
+
+def _scan(cls, chunks, reader, where, offsets):
+    "Scans each chunk, telling the reader (if any) how much of it was complete records"
+    match = _predicate(cls, where)
+    fixed = cls._fixed_size
+    scratch = None if fixed is not None else cls()
+    instances = {}
+    position = 0
+    for data in chunks:
+        offset = 0
+        while offset < len(data):
+            if fixed is not None:
+                if len(data) - offset < fixed:
+                    break
+                size = fixed
+            else:
+                try:
+                    size = _record_end(scratch, data, offset, instances) - offset
+                except struct.error:
+                    # record continues in the next chunk
+                    break
+            if match(data, offset):
+                if offsets:
+                    yield position + offset
+                else:
+                    obj = cls()
+                    obj.unpack_from(data, offset)
+                    yield obj
+            offset += size
+        if reader is not None:
+            reader.consumed = offset
+        elif offset < len(data):
+            raise struct.error("{} trailing bytes don't hold a complete {}".format(
+                len(data) - offset, cls.__name__))
+        position += offset
+
+
+def _key_extractor(cls, key):
+    """Returns a function giving the key of each record in a block of fixed size records of cls, the
+    value of the field named key or a tuple of the values when key is a sequence of names"""
+    if cls._fixed_size is None:
+        raise ValueError("Only fixed size records can be sorted, '{}' is variable".format(cls.__name__))
+    names = (key,) if isinstance(key, string_types) else tuple(key)
+    stride = cls._fixed_size
+    structs = []
+    for name in names:
+        # a Struct spanning the whole record that skips everything but the key field
+        offset, constructor, byte_order = _locate(cls, name)
+        width = struct.calcsize(native + constructor.fmt)
+        structs.append(struct.Struct('{}{}x{}{}x'.format(byte_order, offset, constructor.fmt, stride - offset - width)))
+    if len(structs) == 1:
+        unpack = structs[0].iter_unpack
+        return lambda data: [k for (k,) in unpack(data)]
+    return lambda data: list(zip(*[[k for (k,) in s.iter_unpack(data)] for s in structs]))
+
+
+def _keyed_records(cls, f, extract, block_size):
+    "Yields (key, record bytes) for each record in a binary file, reading block_size bytes at a time"
+    stride = cls._fixed_size
+    reader = _chunkReader(f, max(block_size - block_size % stride, stride), cls.__name__, copy=True)
+    for data in reader:
+        end = len(data) - len(data) % stride
+        for i, k in enumerate(extract(data[:end])):
+            yield k, data[i * stride:(i + 1) * stride]
+        reader.consumed = end
+
+
+def _merge_to(cls, files, dst, extract, block_size, reverse):
+    "k-way merges sorted binary files of records into dst, returns the record count"
+    merged = heapq.merge(*[_keyed_records(cls, f, extract, block_size) for f in files],
+                         key=lambda item: item[0], reverse=reverse)
+    count = 0
+    with _openRecords(dst, 'wb') as out:
+        buf = bytearray()
+        for k, record in merged:
+            buf += record
+            count += 1
+            if len(buf) >= block_size:
+                out.write(buf)
+                del buf[:]
+        out.write(buf)
+    return count
+
+
+def sort_records(cls, src, dst, key, memory_limit=64 << 20, reverse=False, tmpdir=None):
+    """Sorts a binary file of fixed size records of cls by one or more fields, returns the record count
+
+    key is a field name, or a sequence of names, dotted names reach into substructures. Keys are
+    read from the raw bytes at the fields' offsets and compared as stored, before any getter. Runs
+    of up to memory_limit bytes of records are sorted as index lists and spilled to temporary files
+    (in tmpdir), which are then merged. The sort is stable.
+    """
+    extract = _key_extractor(cls, key)
+    stride = cls._fixed_size
+    run_size = max(memory_limit - memory_limit % stride, stride)
+    runs = []
+    try:
+        with _openRecords(src) as f:
+            reader = _chunkReader(f, run_size, cls.__name__, copy=True)
+            for data in reader:
+                end = len(data) - len(data) % stride
+                keys = extract(data[:end])
+                order = sorted(range(len(keys)), key=keys.__getitem__, reverse=reverse)
+                run = tempfile.TemporaryFile(dir=tmpdir)
+                runs.append(run)
+                with memoryview(data) as view:
+                    run.write(b''.join([view[i * stride:(i + 1) * stride] for i in order]))
+                run.seek(0)
+                reader.consumed = end
+        # each run is read back a block at a time, with room for the output buffer
+        return _merge_to(cls, runs, dst, extract, max(memory_limit // (len(runs) + 1), stride), reverse)
+    finally:
+        for run in runs:
+            run.close()
+
+
+def merge_records(cls, srcs, dst, key, block_size=DEFAULT_CHUNK_SIZE, reverse=False):
+    """Merges binary files (or paths) of fixed size records of cls that are each sorted by key into
+    dst, returns the record count, see sort_records for key"""
+    extract = _key_extractor(cls, key)
+    with _openAll(srcs) as files:
+        return _merge_to(cls, files, dst, extract, block_size, reverse)
+
+
+class _openAll(object):
+    "Context manager opening each of a list of paths or files with _openRecords"
+
+    def __init__(self, srcs):
+        self.contexts = [_openRecords(src) for src in srcs]
+
+    def __enter__(self):
+        return [context.__enter__() for context in self.contexts]
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for context in self.contexts:
+            context.__exit__(exc_type, exc_value, traceback)
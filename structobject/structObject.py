@@ -1,12 +1,16 @@
+import io
+import keyword
+import re
 import struct
 import inspect
+import sys
 
 try:
     from .compatibility import with_metaclass, string_types
-    from .structField import structField
+    from .structField import structField, checksumField, ChecksumError, strict, on_pack, trusted
 except:
     from compatibility import with_metaclass, string_types
-    from structField import structField
+    from structField import structField, checksumField, ChecksumError, strict, on_pack, trusted
 
 native = '='
 little_endian = '<'
@@ -86,7 +90,8 @@ class metaclassFactory(type):
                 else:
                     class_attr['_constructors'].append(constructor)
 
-            # compile segments
+            # compile segments, fixed size substructures of a single segment in the same byte order and
+            # constant length scalar arrays are folded into the enclosing segment
             class_attr['_segments'] = []
             fmt = _byte_order
             start = 0
@@ -94,6 +99,8 @@ class metaclassFactory(type):
                 constructor = class_attr['_constructors'][i]
                 if issubclass(constructor, structField) and not constructor._variable_length:
                     fmt += constructor.fmt
+                elif _foldable(constructor, _byte_order):
+                    fmt += _fold_format(constructor)
                 else:  # if issubclass(constructor, (structObject,structArray)):
                     if len(fmt) > 1:
                         class_attr['_segments'].append(structSegment(fmt, start, i))
@@ -102,46 +109,539 @@ class metaclassFactory(type):
                     start = i + 1
             if len(fmt) > 1:
                 class_attr['_segments'].append(structSegment(fmt, start, i + 1))
+
+            # map each field to its segment so assignments can invalidate the packed cache,
+            # segments holding generated fields without declared dependencies are recomputed on every pack
+            class_attr['_field_segment'] = [None] * len(_field_order)
+            for n, seg in enumerate(class_attr['_segments']):
+                if isinstance(seg, structSegment):
+                    fmts = [c.fmt if issubclass(c, structField) else _fold_format(c)
+                            for c in class_attr['_constructors'][seg.slice]]
+                    seg.offsets = tuple(struct.calcsize(_byte_order + "".join(fmts[:k]))
+                                        for k in range(len(fmts) + 1))
+                    for i in range(seg.slice.start, seg.slice.stop):
+                        class_attr['_field_segment'][i] = n
+                        constructor = class_attr['_constructors'][i]
+                        if issubclass(constructor, structObject):
+                            # substructures don't notify the record when changed, the cached bytes are
+                            # checked against their own when packing instead
+                            seg.nested += (i,)
+                            if not constructor._flat.cacheable:
+                                seg.cacheable = False
+                        elif issubclass(constructor, structArray):
+                            seg.arrays += (i,)
+                        elif constructor.generator is not None and constructor.depends is None:
+                            seg.cacheable = False
+                    if len(seg.nested) > 0 or len(seg.arrays) > 0:
+                        seg.fields = _compile(_fields_source(class_attr['_constructors'], seg), 'fields')
+                else:
+                    class_attr['_field_segment'][seg] = n
+            class_attr['_folded'] = tuple(i for seg in class_attr['_segments'] if isinstance(seg, structSegment)
+                                          for i in seg.nested)
+
+            # checksum fields with the (first, last) field indexes they cover
+            class_attr['_checksums'] = []
+            for i, constructor in enumerate(class_attr['_constructors']):
+                if issubclass(constructor, checksumField):
+                    if constructor.over is None:
+                        first, last = 0, i - 1
+                    else:
+                        for name in constructor.over:
+                            if name not in _field_order:
+                                raise Exception("Checksum '{}' covers undefined field '{}'".format(
+                                    _field_order[i], name))
+                        first, last = [_field_order.index(name) for name in constructor.over]
+                    if first > last or first <= i <= last:
+                        raise Exception("Checksum '{}' has an invalid range".format(_field_order[i]))
+                    class_attr['_checksums'].append((i, first, last))
+
+            # order generated fields so generators that read other generated fields run after them
+            depends = {}
+            for i, constructor in enumerate(class_attr['_constructors']):
+                if issubclass(constructor, structField) and constructor.generator is not None and \
+                        constructor.depends is not None:
+                    for name in constructor.depends:
+                        if name not in _field_order:
+                            raise Exception("Generator of '{}' depends on undefined field '{}'".format(
+                                _field_order[i], name))
+                    depends[i] = set(_field_order.index(name) for name in constructor.depends)
+            class_attr['_generated'] = []
+            while len(depends) > 0:
+                ready = sorted(i for i in depends if not depends[i] & set(depends))
+                if len(ready) == 0:
+                    raise Exception("Circular generator dependency between '{}'".format(
+                        "', '".join(_field_order[i] for i in sorted(depends))))
+                for i in ready:
+                    class_attr['_generated'].append(i)
+                    del (depends[i])
+
+            # generated fields to invalidate when a field changes, including generators of generators
+            direct = [[] for name in _field_order]
+            for i in class_attr['_generated']:
+                for name in class_attr['_constructors'][i].depends:
+                    direct[_field_order.index(name)].append(i)
+            class_attr['_dependents'] = []
+            for j in range(len(_field_order)):
+                found = []
+                pending = list(direct[j])
+                while len(pending) > 0:
+                    i = pending.pop(0)
+                    if i not in found:
+                        found.append(i)
+                        pending.extend(direct[i])
+                class_attr['_dependents'].append(tuple(found))
+
+            # substructures (and their elements in arrays) can change without notifying the record, so
+            # generators depending on them are reevaluated on every pack
+            def nested(constructor):
+                if issubclass(constructor, structArray):
+                    return issubclass(constructor.object_type, structObject)
+                return issubclass(constructor, (structObject, structConditional))
+            class_attr['_volatile'] = frozenset(
+                i for i in class_attr['_generated']
+                if any(nested(class_attr['_constructors'][_field_order.index(name)])
+                       for name in class_attr['_constructors'][i].depends))
+
+            class_attr['_field_index'] = dict((name, i) for i, name in enumerate(_field_order))
+
+            # default instance that others are copied from, built on first use
+            class_attr['_prototype'] = None
+
+            # binary length when it doesn't depend on the values, otherwise None
+            class_attr['_fixed_size'] = 0
+            for seg in class_attr['_segments']:
+                if isinstance(seg, structSegment):
+                    size = seg.size
+                else:
+                    size = _fixed_size(class_attr['_constructors'][seg])
+                if size is None:
+                    class_attr['_fixed_size'] = None
+                    break
+                class_attr['_fixed_size'] += size
+
+            # records of a single scalar segment can be decoded in strides by arrays
+            class_attr['_flat'] = None
+            if len(class_attr['_segments']) == 1 and isinstance(class_attr['_segments'][0], structSegment) and \
+                    len(class_attr['_checksums']) == 0:
+                class_attr['_flat'] = class_attr['_segments'][0]
+
+            # export methods read _values directly, generated per class so no per field dispatch is needed
+            if 'to_tuple' not in class_attr:
+                class_attr['to_tuple'] = _compile(_to_tuple_source(class_attr['_constructors']), 'to_tuple')
+            if 'to_dict' not in class_attr:
+                class_attr['to_dict'] = _compile(_to_dict_source(_field_order, class_attr['_constructors']),
+                                                 'to_dict')
+
+            if '__eq__' not in class_attr:
+                class_attr['__eq__'] = _compile(_eq_source(class_attr['_constructors']), '__eq__')
+                class_attr.setdefault('__hash__', structObject.__hash__)
+
+            # records with _order_by compare by those fields in turn
+            if '_order_by' not in class_attr:
+                class_attr['_order_by'] = _base._order_by
+            if class_attr['_order_by'] is not None:
+                for name in class_attr['_order_by']:
+                    if name not in _field_order:
+                        raise Exception("'_order_by' names undefined field '{}'".format(name))
+                indexes = [_field_order.index(name) for name in class_attr['_order_by']]
+                for name, op in (('__lt__', '<'), ('__le__', '<='), ('__gt__', '>'), ('__ge__', '>=')):
+                    if name not in class_attr:
+                        class_attr[name] = _compile(_order_source(name, op, indexes, class_attr['_constructors']),
+                                                    name)
+
+            # __init__ takes the fields as parameters, unless a superclass defines its own
+            namespace = None
+            if '__init__' not in class_attr and getattr(_base.__init__, '_field_init', _base is structObject) and \
+                    len(_field_order) > 0 and all(_identifier(name) for name in _field_order):
+                namespace = _init_namespace(class_attr['_constructors'])
+                class_attr['__init__'] = _compile(_init_source(_field_order, class_attr['_constructors'],
+                                                               len(class_attr['_segments'])),
+                                                  '__init__', namespace)
+                class_attr['__init__']._field_init = True
+                class_attr['_clone'] = _compile(_clone_source(class_attr['_constructors']), '_clone', namespace)
+            # defaults can be copied without running __init__ only when no class in the line defines one
+            class_attr['_copyable'] = namespace is not None or ('__init__' not in class_attr and _base._copyable)
+            cls = type.__new__(metaclass, class_name, class_bases, class_attr)
+            if namespace is not None:
+                namespace['_cls'] = cls
+            return cls
         return type.__new__(metaclass, class_name, class_bases, class_attr)
 
 
+def _fixed_size(constructor):
+    "Returns the binary length of a non segment field type, or None if it is variable"
+    if issubclass(constructor, structObject):
+        return constructor._fixed_size
+    elif issubclass(constructor, structArray):
+        if isinstance(constructor.len, tuple) and isinstance(constructor.len[0], int):
+            if issubclass(constructor.object_type, structField):
+                return constructor.len[0] * constructor._item_size
+            elif constructor.object_type._fixed_size is not None:
+                return constructor.len[0] * constructor.object_type._fixed_size
+    return None
+
+
+def _foldable(constructor, byte_order):
+    """Returns True if constructor can be packed as part of an enclosing segment, a structObject of a
+    single segment in the same byte order or a constant length array of scalars
+
+    Char arrays aren't folded, as folded arrays start out full and the char default (0) can't be packed.
+    """
+    if issubclass(constructor, structObject):
+        return constructor._flat is not None and constructor._byte_order == byte_order
+    elif issubclass(constructor, structArray):
+        return not constructor.lazy and _constant_length(constructor) is not None and \
+            issubclass(constructor.object_type, structField) and constructor.object_type.fmt not in 'xspc'
+    return False
+
+
+def _constant_length(constructor):
+    "Returns the element count of an array type with an integer len, otherwise None"
+    if isinstance(constructor.len, tuple) and isinstance(constructor.len[0], int):
+        return constructor.len[0]
+    return None
+
+
+def _fold_format(constructor):
+    "Returns the format of a folded substructure or array, without byte order"
+    if issubclass(constructor, structArray):
+        return str(constructor.len[0]) + constructor.object_type.fmt
+    fmt = constructor._flat.format
+    if isinstance(fmt, bytes):
+        fmt = fmt.decode('ascii')
+    return fmt[1:]
+
+
+def _fields_source(constructors, seg):
+    "Source of a function returning the fields of a segment holding substructures or arrays, in format order"
+    parts = []
+
+    def walk(values, constructors, start, stop):
+        for i in range(start, stop):
+            if issubclass(constructors[i], structField):
+                if len(parts) == 0 or not parts[-1].startswith('['):
+                    parts.append('[]')
+                parts[-1] = "{}{}[{}], ]".format(parts[-1][:-1], values, i)
+            elif issubclass(constructors[i], structArray):
+                parts.append("{}[{}]._values".format(values, i))
+            else:
+                nested = constructors[i]._flat
+                walk("{}[{}]._values".format(values, i), constructors[i]._constructors,
+                     nested.slice.start, nested.slice.stop)
+
+    walk("v", constructors, seg.slice.start, seg.slice.stop)
+    return (
+        "def fields(self):\n"
+        "    v = self._values\n"
+        "    return {}\n"
+    ).format(" + ".join(parts))
+
+
+def _compile(source, name, namespace=None):
+    "Compiles the source of a generated function and returns the function"
+    if namespace is None:
+        namespace = {}
+    exec(compile(source, "<structobject {}>".format(name), 'exec'), namespace)
+    return namespace[name]
+
+
+def _to_tuple_source(constructors):
+    items = []
+    for i, constructor in enumerate(constructors):
+        if issubclass(constructor, structField):
+            items.append("v[{}].value, ".format(i))
+        else:
+            items.append("v[{}].to_tuple(), ".format(i))
+    return (
+        "def to_tuple(self):\n"
+        "    \"Returns the field values as a tuple, substructures and arrays as nested tuples\"\n"
+        "    self._regenerate()\n"
+        "    v = self._values\n"
+        "    return ({})\n"
+    ).format("".join(items))
+
+
+def _to_dict_source(field_order, constructors):
+    recursive = []
+    shallow = []
+    for i, constructor in enumerate(constructors):
+        key = repr(str(field_order[i]))
+        if issubclass(constructor, structField):
+            recursive.append("{}: v[{}].value".format(key, i))
+            shallow.append("{}: v[{}].value".format(key, i))
+        elif issubclass(constructor, structArray):
+            recursive.append("{}: v[{}].to_list()".format(key, i))
+            shallow.append("{}: v[{}]".format(key, i))
+        elif issubclass(constructor, structConditional):
+            recursive.append("{}: v[{}].to_dict()".format(key, i))
+            shallow.append("{}: v[{}].get()".format(key, i))
+        else:
+            recursive.append("{}: v[{}].to_dict()".format(key, i))
+            shallow.append("{}: v[{}]".format(key, i))
+    return (
+        "def to_dict(self, recursive=True):\n"
+        "    \"Returns the fields as a dict, with recursive substructures and arrays as dicts and lists\"\n"
+        "    self._regenerate()\n"
+        "    v = self._values\n"
+        "    if recursive:\n"
+        "        return {{{}}}\n"
+        "    return {{{}}}\n"
+    ).format(", ".join(recursive), ", ".join(shallow))
+
+
+def _value_source(constructor, values, i):
+    "Source of the value of field i in comparisons, substructures and arrays compare as tuples"
+    if issubclass(constructor, structField):
+        return "{}[{}].value".format(values, i)
+    return "{}[{}].to_tuple()".format(values, i)
+
+
+def _eq_source(constructors):
+    items = []
+    for i, constructor in enumerate(constructors):
+        if issubclass(constructor, structObject):
+            # nested records use their own __eq__, which may compare packed bytes
+            items.append("v[{0}] == w[{0}]".format(i))
+        else:
+            items.append("{} == {}".format(_value_source(constructor, 'v', i), _value_source(constructor, 'w', i)))
+    return (
+        "def __eq__(self, other):\n"
+        "    \"Compares the field values, or the packed bytes when both records are frozen\"\n"
+        "    if other.__class__ is not self.__class__:\n"
+        "        return NotImplemented\n"
+        "    if self._frozen and other._frozen:\n"
+        "        return self._bindata == other._bindata\n"
+        "    self._regenerate()\n"
+        "    other._regenerate()\n"
+        "    v = self._values\n"
+        "    w = other._values\n"
+        "    return {}\n"
+    ).format(" and ".join(items) or "True")
+
+
+def _order_source(name, op, indexes, constructors):
+    return (
+        "def {name}(self, other):\n"
+        "    \"Compares the fields named by _order_by in turn\"\n"
+        "    if other.__class__ is not self.__class__:\n"
+        "        return NotImplemented\n"
+        "    self._regenerate()\n"
+        "    other._regenerate()\n"
+        "    v = self._values\n"
+        "    w = other._values\n"
+        "    return ({left}) {op} ({right})\n"
+    ).format(name=name, op=op,
+             left="".join(_value_source(constructors[i], 'v', i) + ", " for i in indexes),
+             right="".join(_value_source(constructors[i], 'w', i) + ", " for i in indexes))
+
+
+# names a generated __init__ reads besides its own, which a parameter of the same name would shadow
+_init_reserved = frozenset(('self', 'isinstance', 'TypeError', 'None'))
+
+
+def _identifier(name):
+    "Returns True if a field name can be used as a parameter of a generated __init__"
+    return re.match(r'^[A-Za-z]\w*$', name) is not None and not keyword.iskeyword(name) and \
+        name not in _init_reserved
+
+
+def _init_namespace(constructors):
+    "Names read by a generated __init__, _cls is added once the class is built"
+    forms = (list, tuple, dict, memoryview) + string_types
+    first = constructors[0]
+    # a lone first argument of exactly one of these types is taken as a tuple, dict or the packed bytes,
+    # unless the only field holds such values
+    if len(constructors) == 1 and issubclass(first, structField) and first.fmt in 'scpx':
+        forms = (list, tuple, dict, memoryview)
+    elif len(constructors) == 1 and issubclass(first, structArray):
+        forms = (dict, memoryview) + string_types
+    namespace = {
+        '_forms': forms,
+        '_generic': _init_generic,
+        '_base_clone': structObject._clone,
+        '_new': object.__new__,
+        '_set': object.__setattr__,
+    }
+    for i, constructor in enumerate(constructors):
+        namespace['_c{}'.format(i)] = constructor
+        if issubclass(constructor, structField):
+            namespace['_d{}'.format(i)] = constructor.default
+    return namespace
+
+
+def _init_source(field_order, constructors, segments):
+    lines = []
+    arrays = []
+    for i, name in enumerate(field_order):
+        constructor = constructors[i]
+        if issubclass(constructor, structField):
+            if constructor._static or constructor.validator is not None:
+                lines.append("if {} is None:".format(name))
+                lines.append("    _f{0} = _p._values[{0}]._clone(self)".format(i))
+                lines.append("else:")
+                lines.append("    _f{0} = _c{0}(self, {1})".format(i, name))
+            else:
+                # plain fields skip structField.__init__, None keeps the default as it does there
+                lines.append("_f{0} = _new(_c{0})".format(i))
+                lines.append("_f{0}._parent = self".format(i))
+                lines.append("_f{0}.value = _d{0} if {1} is None else {1}".format(i, name))
+                if constructor.generator is not None:
+                    lines.append("_f{}._stale = True".format(i))
+        elif issubclass(constructor, structArray):
+            lines.append("_f{0} = _p._values[{0}]._clone(self)".format(i))
+            arrays.append(i)
+        elif issubclass(constructor, structConditional):
+            # the type is selected by the preceding fields
+            lines.append("_set(self, '_values', [{}])".format("".join("_f{}, ".format(j) for j in range(i))))
+            lines.append("_f{0} = _c{0}(self)".format(i))
+            lines.append("if {} is not None:".format(name))
+            lines.append("    _f{}.set({})".format(i, name))
+        else:
+            lines.append("if {} is None:".format(name))
+            lines.append("    _f{0} = _p._values[{0}]._clone()".format(i))
+            lines.append("elif isinstance({0}, _c{1}):".format(name, i))
+            lines.append("    _f{} = {}".format(i, name))
+            lines.append("else:")
+            lines.append("    raise TypeError(\"'{0}' must be of type '{{}}', given '{{}}'\".format(".format(name) +
+                         "_c{}.__name__, {}.__class__.__name__))".format(i, name))
+    lines.append("_set(self, '_values', [{}])".format("".join("_f{}, ".format(i) for i in range(len(field_order)))))
+    for i in arrays:
+        lines.append("if {} is not None:".format(field_order[i]))
+        lines.append("    _f{}.from_list({})".format(i, field_order[i]))
+    return (
+        "def __init__(self, {parameters}):\n"
+        "    \"Populates the record from field values, fields not given (or None) keep their defaults\"\n"
+        "    if self.__class__ is not _cls or {forms}{first}.__class__ in _forms:\n"
+        "        return _generic(self, ({names}, ))\n"
+        "    _p = _cls._prototype\n"
+        "    if _p is None:\n"
+        "        _p = _cls._build_prototype()\n"
+        "    _set(self, '_frozen', False)\n"
+        "    _set(self, '_hash', None)\n"
+        "    if {defaults}:\n"
+        "        _set(self, '_cache', _p._cache[:])\n"
+        "    else:\n"
+        "        _set(self, '_cache', [None] * {segments})\n"
+        "{body}"
+    ).format(parameters=", ".join("{}=None".format(name) for name in field_order),
+             forms="".join("{} is None and ".format(name) for name in field_order[1:]),
+             first=field_order[0],
+             segments=segments,
+             names=", ".join(field_order),
+             defaults=" and ".join("{} is None".format(name) for name in field_order),
+             body="".join("    {}\n".format(line) for line in lines))
+
+
+def _clone_source(constructors):
+    "Source of _clone for classes with a generated __init__, plain fields are copied inline"
+    lines = []
+    for i, constructor in enumerate(constructors):
+        if issubclass(constructor, structField):
+            lines.append("_f{0} = _new(_c{0})".format(i))
+            lines.append("_f{}._parent = obj".format(i))
+            if not constructor._static:
+                lines.append("_f{0}.value = v[{0}].value".format(i))
+            if constructor.generator is not None:
+                lines.append("_f{}._stale = True".format(i))
+        elif issubclass(constructor, structObject):
+            lines.append("_f{0} = v[{0}]._clone()".format(i))
+        else:
+            lines.append("_f{0} = v[{0}]._clone(obj)".format(i))
+    return (
+        "def _clone(self, _parent=None):\n"
+        "    \"Returns an unfrozen copy of the record, fields and substructures are copied rather than shared\"\n"
+        "    if self.__class__ is not _cls:\n"
+        "        return _base_clone(self)\n"
+        "    obj = _new(_cls)\n"
+        "    v = self._values\n"
+        "{body}"
+        "    _set(obj, '_values', [{values}])\n"
+        "    _set(obj, '_cache', self._cache[:])\n"
+        "    _set(obj, '_frozen', False)\n"
+        "    _set(obj, '_hash', None)\n"
+        "    return obj\n"
+    ).format(body="".join("    {}\n".format(line) for line in lines),
+             values="".join("_f{}, ".format(i) for i in range(len(constructors))))
+
+
+def _init_generic(self, values):
+    "Runs structObject.__init__ for the arguments of a generated __init__, in the forms it doesn't handle itself"
+    values = list(values)
+    while len(values) > 0 and values[-1] is None:
+        values.pop()
+    structObject.__init__(self, *values)
+
+
 class structSegment(struct.Struct):
-    __slots__ = ('slice')
+    __slots__ = ('slice', 'cacheable', 'offsets', 'nested', 'arrays', 'fields')
 
     def __init__(self, fmt, start, end):
         super(structSegment, self).__init__(fmt)
         self.slice = slice(start, end)
+        self.cacheable = True
+        self.offsets = ()  # byte offset of each field in the segment, plus the end
+        self.nested = ()  # indexes of folded substructures
+        self.arrays = ()  # indexes of folded arrays
+        self.fields = None  # compiled function giving the fields of a record in format order, if any are folded
 
 
 def printItem(item, tab=0):
-    key = item[0]
-    val = item[1]
-    rep = "{}{}: ".format("\t" * tab, key)
+    "Returns the listing of a (key, value) item as used by structObject.__str__"
+    out = []
+    _dump_item(item[0], item[1], tab, None, out, None)
+    return "".join(out)
+
+
+def dump(obj, file=None, max_items=None):
+    """Writes a readable listing of obj to file (sys.stdout by default)
+
+    Arrays longer than max_items are truncated. The listing is written in blocks of lines as it
+    is built, including within arrays, so dumping large records stays cheap.
+    """
+    if file is None:
+        file = sys.stdout
+    out = ["{}:\n".format(obj.__class__.__name__)]
+    for key, val in obj.items():
+        _dump_item(key, val, 1, max_items, out, file)
+    file.write("".join(out))
+
+
+def _flush(out, file):
+    "Writes the lines collected in out to file (if any) once there are over 1000 of them"
+    if file is not None and len(out) > 1000:
+        file.write("".join(out))
+        del out[:]
+
+
+def _dump_item(key, val, tab, max_items, out, file):
+    "Appends the lines listing one item to out, see _flush"
+    indent = "\t" * tab
     if isinstance(val, structArray):
+        count = len(val)
+        shown = count if max_items is None else min(count, max_items)
         if val.object_type.__name__ == 'ctype_char':
-            rep += "\"{}\"\n".format("".join([c.decode("latin-1") for c in val]))
-        else:
-            rep += "\n"
-            for i, subitem in enumerate(val):
-                if isinstance(subitem, structObject):
-                    rep += "{}[{}]\n".format("\t" * (tab + 1), i)
-                    for subsubitem in subitem.items():
-                        rep += printItem(subsubitem, tab + 2)
-                else:
-                    rep += "{}[{}] {}\n".format("\t" * (tab + 1), i, subitem)
-    elif isinstance(val, structObject):
-        rep += "\n"
+            text = b"".join(val[:shown]).decode("latin-1")
+            out.append("{}{}: \"{}{}\"\n".format(indent, key, text, "..." if shown < count else ""))
+            return
+        out.append("{}{}: \n".format(indent, key))
+        for i in range(shown):
+            subitem = val[i]
+            if isinstance(subitem, structObject):
+                out.append("{}\t[{}]\n".format(indent, i))
+                for subsubitem in subitem.items():
+                    _dump_item(subsubitem[0], subsubitem[1], tab + 2, max_items, out, file)
+            else:
+                out.append("{}\t[{}] {}\n".format(indent, i, subitem))
+                _flush(out, file)
+        if shown < count:
+            out.append("{}\t... {} more\n".format(indent, count - shown))
+    elif isinstance(val, (structObject, dict)):
+        out.append("{}{}: \n".format(indent, key))
         for subitem in val.items():
-            rep += printItem(subitem, tab + 1)
+            _dump_item(subitem[0], subitem[1], tab + 1, max_items, out, file)
     else:
-        try:
-            items = val.items()
-            rep += "\n"
-            for subitem in items:
-                rep += printItem(subitem, tab + 1)
-        except:
-            rep += "{}\n".format(val)
-    return rep
+        out.append("{}{}: {}\n".format(indent, key, val))
+        _flush(out, file)
 
 
 class structObject(with_metaclass(metaclassFactory, object)):
@@ -151,19 +651,47 @@ class structObject(with_metaclass(metaclassFactory, object)):
     type
     value
     len - can be int or function that returns int, function should only use field previously defined
+
+    Class attributes:
+    _validation - when field validators run; strict (on assignment and unpack), on_pack (once when
+                  changed fields are packed) or trusted (never), pack/unpack accept a per-call override
+    _order_by - names of the fields records are ordered by with <, <=, > and >=, None leaves them unordered
+
+    Class level state (segments, constructors, compiled Structs) is built by the metaclass when the
+    class is defined and only read afterwards, so one class can decode on many threads at once.
+    An instance may only be shared between threads once frozen, see freeze().
     """
     __slots__ = (
         '_values',
-        '_bindata'
+        '_bindata',
+        '_cache',
+        '_frozen',
+        '_hash'
     )
     _field_order = ()
+    _field_index = {}
     _segments = ()
     _constructors = ()
+    _field_segment = ()
+    _generated = ()
+    _dependents = ()
+    _volatile = frozenset()
+    _checksums = ()
+    _fixed_size = None
+    _flat = None
+    _folded = ()
+    _prototype = None
+    _copyable = True
+    _order_by = None
     _byte_order = None
+    _validation = strict
 
     def __init__(self, *args, **kargs):
         """Populate instance based on subclass scaffolding"""
         self._values = []
+        self._cache = [None] * len(self._segments)
+        self._frozen = False
+        self._hash = None
 
         # handle special cases where list or dict used
         if len(args) == 1 and isinstance(args[0], (list, tuple)):
@@ -178,42 +706,94 @@ class structObject(with_metaclass(metaclassFactory, object)):
             _bin = args[0]
             args = []
 
+        # defaults are copied from the class prototype rather than constructed field by field
+        # compared to None, the truth of a record is its field count
+        prototype = self._prototype
+        if prototype is None:
+            prototype = self._build_prototype()
         # TODO check that len(args[0]) <= len(self)
         if len(args) == 0 and len(kargs) == 0:
-            for i, name in enumerate(self._field_order):
-                constructor = self._constructors[i]
-                if issubclass(constructor, (structField, structArray)):
-                    self._values.append(constructor(self))
-                else:  # if issubclass(constructor, structObject):
-                    self._values.append(constructor())
+            self._values = [obj._clone(self) for obj in prototype._values]
+            if _bin == '':
+                self._cache = prototype._cache[:]
         else:
             for i, name in enumerate(self._field_order):
                 # assign order parameter and defaults for remainder
                 constructor = self._constructors[i]
-                if i < len(args):
+                if i < len(args) and args[i] is not None:
                     value = args[i]
                     if issubclass(constructor, structField):
                         self._values.append(constructor(self, value))
+                    elif issubclass(constructor, structConditional):
+                        obj = constructor(self)
+                        obj.set(value)
+                        self._values.append(obj)
+                    elif issubclass(constructor, structArray):
+                        array = prototype._values[i]._clone(self)
+                        array.from_list(value)
+                        self._values.append(array)
                     elif issubclass(constructor, structObject):
                         if isinstance(value, constructor):
                             self._values.append(value)
                         else:
                             raise TypeError("'{}' must be of type '{}', given '{}'".format(name, constructor.__name__,
                                                                                            value.__class__.__name__))
+                elif issubclass(constructor, structConditional):
+                    # the type is selected by the values given for the preceding fields
+                    self._values.append(constructor(self))
                 else:
-                    if issubclass(constructor, (structField, structArray)):
-                        self._values.append(constructor(self))
-                    else:  # if issubclass(constructor, structObject):
-                        self._values.append(constructor())
+                    self._values.append(prototype._values[i]._clone(self))
             if len(kargs) > 0:
                 self.update(kargs)
 
         if _bin != '':
             self.unpack(_bin)
 
+    @classmethod
+    def _build_prototype(cls):
+        """Constructs the default instance of the class that others are copied from, along with the
+        packed bytes of its cacheable segments"""
+        obj = cls.__new__(cls)
+        obj._values = []
+        obj._cache = [None] * len(cls._segments)
+        obj._frozen = False
+        obj._hash = None
+        for constructor in cls._constructors:
+            if issubclass(constructor, (structField, structArray, structConditional)):
+                obj._values.append(constructor(obj))
+            else:  # if issubclass(constructor, structObject):
+                obj._values.append(constructor())
+        # segments of plain fields are packed once here, generators are left to run on the copies
+        for n, seg in enumerate(cls._segments):
+            if isinstance(seg, structSegment) and seg.cacheable and seg.fields is None:
+                fields = obj._values[seg.slice]
+                if any(field.generator is not None for field in fields):
+                    continue
+                try:
+                    for field in fields:
+                        field.validate()
+                    obj._cache[n] = seg.pack(*[field.prep() for field in fields])
+                except Exception:
+                    pass  # defaults that don't validate are reported when a copy is packed
+        cls._prototype = obj
+        return obj
+
+    def _clone(self, _parent=None):
+        """Returns an unfrozen copy of the record, fields and substructures are copied rather than shared,
+        classes with their own __init__ are constructed with it instead"""
+        if not self._copyable:
+            return self.__class__()
+        # the slots are set directly, skipping __setattr__ and its field lookup
+        obj = object.__new__(self.__class__)
+        object.__setattr__(obj, '_values', [value._clone(obj) for value in self._values])
+        object.__setattr__(obj, '_cache', self._cache[:])
+        object.__setattr__(obj, '_frozen', False)
+        object.__setattr__(obj, '_hash', None)
+        return obj
+
     def _index(self, name):
         "Returns the index of the given named field"
-        return self._field_order.index(name)
+        return self._field_index[name]
 
     def __len__(self):
         return len(self._field_order)
@@ -229,10 +809,10 @@ class structObject(with_metaclass(metaclassFactory, object)):
         return s
 
     def __getattr__(self, name):
-        if name in self._field_order:
-            i = self._index(name)
+        if name in self._field_index:
+            i = self._field_index[name]
             obj = self._values[i]
-            if issubclass(obj.__class__, structField):
+            if issubclass(obj.__class__, (structField, structConditional)):
                 return obj.get()
             else:  # if issubclass(obj.__class__, (structObject, structArray)):
                 return obj
@@ -246,14 +826,21 @@ class structObject(with_metaclass(metaclassFactory, object)):
     def __setattr__(self, name, value):
         if name.startswith('_'):
             object.__setattr__(self, name, value)
-        elif name in self._field_order:
-            i = self._index(name)
+        elif name in self._field_index:
+            if self._frozen:
+                raise AttributeError("Can't assign '{}', {} is frozen".format(name, self.__class__.__name__))
+            i = self._field_index[name]
             constructor = self._constructors[i]
             if issubclass(constructor, structField):
+                self._values[i].set(value, self._validation == strict)
+                self._changed(i)
+            elif issubclass(constructor, structConditional):
                 self._values[i].set(value)
+                self._changed(i)
             elif issubclass(constructor, structObject):
                 if isinstance(value, constructor):
                     self._values[i] = value  # probably setting a substructure
+                    self._changed(i)
                 else:
                     raise TypeError("'{}' must be of type '{}', given '{}'".format(name, constructor.__name__,
                                                                                    value.__class__.__name__))
@@ -263,6 +850,20 @@ class structObject(with_metaclass(metaclassFactory, object)):
         else:
             raise AttributeError("Attribute '{}' undefined for structObject".format(name))
 
+    def _changed(self, i):
+        "Drops the packed bytes and generated values that depend on field i"
+        self._cache[self._field_segment[i]] = None
+        for g in self._dependents[i]:
+            self._values[g]._stale = True
+            self._cache[self._field_segment[g]] = None
+
+    def _touch(self, child):
+        "Called by arrays and other containers when modified in place"
+        for i, obj in enumerate(self._values):
+            if obj is child:
+                self._changed(i)
+                return
+
     def __getitem__(self, key):
         if isinstance(key, string_types):
             if '.' in key:
@@ -282,7 +883,7 @@ class structObject(with_metaclass(metaclassFactory, object)):
             _return = []
             _objs = self._values[key]
             for obj in _objs:
-                if issubclass(obj.__class__, structField):
+                if issubclass(obj.__class__, (structField, structConditional)):
                     _return.append(obj.get())
                 elif issubclass(obj.__class__, structObject):
                     _return.append(obj)
@@ -324,11 +925,123 @@ class structObject(with_metaclass(metaclassFactory, object)):
         return self._field_order[:]
 
     def values(self):
-        l = []
-        for name in self._field_order:
-            l.append(self.__getattr__(name))
-        return l
-        # return [self.__getattr__(name) for name in self._field_order]
+        return [obj.get() if isinstance(obj, (structField, structConditional)) else obj for obj in self._values]
+
+    def to_tuple(self):
+        "Generated per class by the metaclass"
+        return ()
+
+    def to_dict(self, recursive=True):
+        "Generated per class by the metaclass"
+        return {}
+
+    @classmethod
+    def from_bytes(cls, bindata, validation=None):
+        "Builds an instance from its packed bytes"
+        obj = cls()
+        obj.unpack(bindata, validation)
+        return obj
+
+    @classmethod
+    def from_tuple(cls, values):
+        "Builds an instance from field values in field order, as returned by to_tuple, substructures may be tuples"
+        return cls.from_dict(dict(zip(cls._field_order, values)))
+
+    @classmethod
+    def from_dict(cls, data):
+        """Builds an instance from a dict, as returned by to_dict, substructures may be dicts, tuples or
+        instances. Static fields are checked against their value rather than set."""
+        obj = cls()
+        for i, name in enumerate(cls._field_order):
+            if name not in data:
+                continue
+            value = data[name]
+            constructor = cls._constructors[i]
+            if issubclass(constructor, structArray):
+                obj._values[i].from_list(value)
+                continue
+            elif issubclass(constructor, structField) and constructor._static:
+                if value != obj._values[i].get():
+                    raise ValueError("Value ({}) does not match expected ({}) {}".format(
+                        value, obj._values[i].get(), name))
+                continue
+            elif issubclass(constructor, structConditional):
+                # the type is selected by the fields set before it
+                constructor = obj._values[i]._select()
+            if constructor is not None and issubclass(constructor, structObject):
+                if isinstance(value, dict):
+                    value = constructor.from_dict(value)
+                elif isinstance(value, (list, tuple)):
+                    value = constructor.from_tuple(value)
+            obj.__setattr__(name, value)
+        return obj
+
+    @classmethod
+    def _blank(cls):
+        "Returns an instance of a flat class with its fields allocated but not set, for decoding into"
+        obj = cls.__new__(cls)
+        obj._values = []
+        obj._cache = [None]
+        obj._frozen = False
+        obj._hash = None
+        for constructor in cls._constructors:
+            if issubclass(constructor, structObject):
+                obj._values.append(constructor._blank())
+                continue
+            elif issubclass(constructor, structArray):
+                obj._values.append(constructor(obj))
+                continue
+            field = constructor.__new__(constructor)
+            field._parent = obj
+            obj._values.append(field)
+        return obj
+
+    @classmethod
+    def scan(cls, src, where, offsets=False, chunk_size=1 << 20):
+        """Yields the records in a path, binary file or buffer whose fields match where, testing the
+        raw bytes before decoding, see structFile.scan
+
+        for message in Datagram.scan('log.bin', where={'timestamp': (t0, t1), 'STX': 2}):
+            ...
+        """
+        try:
+            from .structFile import scan
+        except:
+            from structFile import scan
+        return scan(cls, src, where, offsets, chunk_size)
+
+    @classmethod
+    def diff(cls, old, new):
+        """Returns a binary patch of the bytes that changed from instance old to new, see structPatch
+
+        patch = Datagram.diff(previous, current)
+        Datagram.apply(replica, patch)
+        """
+        try:
+            from .structPatch import diff
+        except:
+            from structPatch import diff
+        return diff(cls, old, new)
+
+    @classmethod
+    def apply(cls, target, patch, validation=None):
+        "Applies a patch from diff to an instance or a bytearray of its packed bytes, in place, and returns it"
+        try:
+            from .structPatch import apply
+        except:
+            from structPatch import apply
+        return apply(cls, target, patch, validation)
+
+    @classmethod
+    def pooled(cls, capacity=1024):
+        """Returns a structPool recycling up to capacity released instances of the class
+
+        with Point.pooled(capacity=256) as pool:
+            obj = pool.decode(data)
+            ...
+            pool.release(obj)
+        """
+        return structPool(cls, capacity)
 
     def update(self, *args, **kargs):
         "Same functionality as dict.update(). "
@@ -352,36 +1065,218 @@ class structObject(with_metaclass(metaclassFactory, object)):
         for key, value in kargs.items():
             self.__setattr__(key, value)
 
-    def unpack(self, bindata):
+    def unpack(self, bindata, validation=None):
         self._bindata = bindata
-        offset = 0
-        for seg in self._segments:
-            if isinstance(seg, structSegment):
-                values = seg.unpack(memoryview(bindata)[offset:offset + seg.size])
-                for i, field in enumerate(self._values[seg.slice]):
-                    try:
-                        field.unprep(values[i])
-                    except Exception as e:
-                        print(self.__class__.__name__)
-                        raise e
-            elif isinstance(seg, int):
-                seg = self._values[seg]
-                seg.unpack(memoryview(bindata)[offset:])
-            offset += seg.size
+        self._unpack_from(bindata, 0, validation)
 
-        # log(self.__class__.__name__, offset, self.size)
+    def unpack_from(self, buffer, offset=0, validation=None):
+        """Decodes the record starting at offset of buffer in place and returns the bytes consumed
 
-    def pack(self):
-        s = bytes("", "ASCII")
+        buffer may be bytes, bytearray, memoryview, mmap or anything else supporting the buffer
+        protocol, it is read without copying and not kept (other than by lazy arrays), so it can be
+        refilled (for instance with file.readinto) and decoded into the same instance again.
+        """
+        return self._unpack_from(buffer, offset, validation) - offset
+
+    def _unpack_from(self, buffer, offset, validation=None):
+        "Decodes the record starting at offset and returns the offset after it"
+        if self._frozen:
+            raise AttributeError("Can't unpack into {}, it is frozen".format(self.__class__.__name__))
+        self._cache = [None] * len(self._segments)
+        validate = (validation or self._validation) == strict
+        starts = []
         for seg in self._segments:
+            starts.append(offset)
             if isinstance(seg, structSegment):
-                prepped_items = []
-                for item in self._values[seg.slice]:
-                    prepped_items.append(item.prep())
-                s += seg.pack(*prepped_items)
+                self._unprep_segment(seg, seg.unpack_from(buffer, offset), validate)
+                offset += seg.size
             elif isinstance(seg, int):
-                s += self._values[seg].pack()
-        return s
+                value = self._values[seg]
+                if isinstance(value, structObject):
+                    value = self._thawed(seg)
+                offset = value._unpack_from(buffer, offset, validation)
+        starts.append(offset)
+
+        if len(self._checksums) > 0 and (validation or self._validation) != trusted:
+            with memoryview(buffer) as data:
+                for i, first, last in self._checksums:
+                    field = self._values[i]
+                    value = field.compute(data[self._span(first, starts)[0]:self._span(last, starts)[1]])
+                    if value != field.value:
+                        raise ChecksumError("'{}' checksum mismatch, computed {} but read {}".format(
+                            self._field_order[i], value, field.value))
+        return offset
+
+    def _unprep_segment(self, seg, values, validate):
+        "Stores the values unpacked by a segment in its fields, including those of folded substructures"
+        if self._frozen:
+            raise AttributeError("Can't unpack into {}, it is frozen".format(self.__class__.__name__))
+        if seg.fields is None:
+            for field, value in zip(self._values[seg.slice], values):
+                field.unprep(value, validate)
+            return
+        for i in seg.nested:
+            self._thawed(i)._clear_nested()
+        for i in seg.arrays:
+            self._values[i]._fit()
+        for field, value in zip(seg.fields(self), values):
+            field.unprep(value, validate)
+
+    def _thawed(self, i):
+        "Returns substructure i for decoding into, a frozen one is first replaced by an unfrozen copy"
+        child = self._values[i]
+        if child._frozen:
+            child = self._values[i] = child._clone()
+        return child
+
+    def _clear_nested(self):
+        "Drops the packed bytes of a folded substructure, and those folded into it, before unpacking into it"
+        if self._frozen:
+            raise AttributeError("Can't unpack into {}, it is frozen".format(self.__class__.__name__))
+        self._cache[0] = None
+        for i in self._flat.nested:
+            self._thawed(i)._clear_nested()
+        for i in self._flat.arrays:
+            self._values[i]._fit()
+
+    def _regenerate(self):
+        "Evaluates stale generated fields, including those of folded substructures"
+        for i in self._folded:
+            self._values[i]._regenerate()
+        for i in self._generated:
+            field = self._values[i]
+            if field._stale:
+                field.generate()
+            elif i in self._volatile:
+                value = field.value
+                field.generate()
+                if field.value != value:
+                    self._changed(i)
+
+    def pack(self, validation=None):
+        buf = bytearray()
+        self._pack_to(buf, validation)
+        return bytes(buf)
+
+    def _pack_to(self, buf, validation=None):
+        "Appends the packed record to bytearray buf, segments unchanged since the last pack are reused"
+        if self._frozen:
+            buf += self._bindata
+            return
+        policy = validation or self._validation
+        self._regenerate()
+        cache = self._cache
+        starts = []
+        for n, seg in enumerate(self._segments):
+            starts.append(len(buf))
+            if isinstance(seg, structSegment):
+                data = cache[n]
+                if data is not None and len(seg.nested) > 0 and not self._nested_current(seg, data):
+                    data = None
+                if data is None:
+                    items = self._values[seg.slice] if seg.fields is None else seg.fields(self)
+                    if policy == on_pack:
+                        for item in items:
+                            item.validate()
+                    data = seg.pack(*[item.prep(policy == strict) for item in items])
+                    if seg.cacheable:
+                        cache[n] = data
+                        if len(seg.nested) > 0:
+                            self._keep_nested(seg, data)
+                buf += data
+            elif isinstance(seg, int):
+                self._values[seg]._pack_to(buf, validation)
+        starts.append(len(buf))
+
+        # checksums are computed over the bytes already written and patched in place
+        for i, first, last in self._checksums:
+            field = self._values[i]
+            with memoryview(buf) as data:
+                field.value = field.compute(data[self._span(first, starts)[0]:self._span(last, starts)[1]])
+            struct.pack_into(self._byte_order + field.fmt, buf, self._span(i, starts)[0], field.value)
+
+    def _nested_current(self, seg, data):
+        "Returns True if the folded substructures of a segment still hold their part of its cached bytes"
+        for i in seg.nested:
+            k = i - seg.slice.start
+            child = self._values[i]
+            kept = data[seg.offsets[k]:seg.offsets[k + 1]]
+            if child._cache[0] != kept:
+                return False
+            if len(child._flat.nested) > 0 and not child._nested_current(child._flat, kept):
+                return False
+        return True
+
+    def _keep_nested(self, seg, data):
+        "Caches each folded substructure's part of the packed bytes of a segment, for _nested_current"
+        for i in seg.nested:
+            k = i - seg.slice.start
+            child = self._values[i]
+            if child._frozen:
+                continue  # frozen records keep their bytes from freeze() and aren't written to
+            child._cache[0] = data[seg.offsets[k]:seg.offsets[k + 1]]
+            if len(child._flat.nested) > 0:
+                child._keep_nested(child._flat, child._cache[0])
+
+    def _span(self, i, starts):
+        "Returns the (start, end) byte positions of field i given the start position of each segment"
+        n = self._field_segment[i]
+        seg = self._segments[n]
+        if isinstance(seg, structSegment):
+            k = i - seg.slice.start
+            return starts[n] + seg.offsets[k], starts[n] + seg.offsets[k + 1]
+        return starts[n], starts[n + 1]
+
+    def validate(self):
+        "Runs every field validator in the record (and substructures), raises ValidationError on failure"
+        for obj in self._values:
+            obj.validate()
+
+    def freeze(self):
+        """Makes the record and its substructures read only and returns it
+
+        Generated and checksum fields are computed and the packed bytes kept, so a frozen record is
+        only read by pack(), to_tuple() etc. and can be shared between threads. Frozen records are
+        hashable, assigning fields or unpacking into them raises AttributeError.
+        """
+        if not self._frozen:
+            for obj in self._values:
+                if isinstance(obj, structObject):
+                    obj.freeze()
+                elif isinstance(obj, structArray):
+                    for item in obj.materialize()._values:
+                        if isinstance(item, structObject):
+                            item.freeze()
+                elif isinstance(obj, structConditional) and isinstance(obj._value, structObject):
+                    obj._value.freeze()
+            self._bindata = self.pack()
+            self._frozen = True
+        return self
+
+    @classmethod
+    def decode_frozen(cls, buffer, offset=0, validation=None):
+        "Returns a frozen instance holding the record starting at offset of buffer"
+        obj = cls()
+        obj._unpack_from(buffer, offset, validation)
+        return obj.freeze()
+
+    def __eq__(self, other):
+        "Generated per class by the metaclass"
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self.to_tuple() == other.to_tuple()
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __hash__(self):
+        "Hash of the class and packed bytes of a frozen record"
+        if not self._frozen:
+            raise TypeError("unhashable type: '{}', freeze() it first".format(self.__class__.__name__))
+        if self._hash is None:
+            self._hash = hash((self.__class__, self._bindata))
+        return self._hash
 
     def _pack(self):
         "Old style packing, goes element by element"
@@ -400,10 +1295,9 @@ class structObject(with_metaclass(metaclassFactory, object)):
     # def itervalues(self): pass
 
     def __str__(self):
-        rep = "{}:\n".format(self.__class__.__name__)
-        for item in self.items():
-            rep += printItem(item, 1)
-        return rep
+        out = io.StringIO()
+        dump(self, out)
+        return out.getvalue()
 
 
 class Empty(structObject):
@@ -424,12 +1318,22 @@ class structArray(object):
         '_parent',
         '_values',
         '_item_size',
+        '_cache',
+        # lazy arrays hold the unpacked bytes, element count, decoded structObject elements and policy
+        '_buffer',
+        '_count',
+        '_decoded',
+        '_policy',
         'len'
     )
+    lazy = False
+    _fold_length = None  # element count of an array packed as part of its record's segment
 
     def __init__(self, _parent):
         self._parent = _parent
         self._values = []
+        self._cache = None
+        self._buffer = None
 
         try:
             self.len
@@ -441,12 +1345,42 @@ class structArray(object):
         else:
             self._variable_length = True
 
+        # constant length scalar arrays start out with default elements, as they pack at full length
+        if self._fold_length is not None:
+            self._values = [self.object_type(_parent) for i in range(self._fold_length)]
+
+    def _clone(self, _parent):
+        "Returns a copy of the array for another parent, lazy arrays are decoded first"
+        self.materialize()
+        obj = self.__class__.__new__(self.__class__)
+        obj._parent = _parent
+        obj._variable_length = self._variable_length
+        if self.len is None:
+            obj.len = None
+        obj._buffer = None
+        obj._cache = self._cache
+        if issubclass(self.object_type, structField):
+            obj._values = [item._clone(_parent) for item in self._values]
+        else:
+            obj._values = [item._clone() for item in self._values]
+        return obj
+
+    def _fit(self):
+        "Sets the element count of a folded array to its length before values are unpacked into it"
+        count = self._fold_length
+        del self._values[count:]
+        while len(self._values) < count:
+            self._values.append(self.object_type(self._parent))
+        self._cache = None
+
     def __len__(self):
+        if self._buffer is not None:
+            return self._count
         return len(self._values)
 
     @property
     def size(self):
-        if issubclass(self.object_type, structField):
+        if issubclass(self.object_type, structField) or self._buffer is not None:
             return self._item_size * self.__len__()
         else:
             size = 0
@@ -456,12 +1390,17 @@ class structArray(object):
 
     def __getitem__(self, key):
         if isinstance(key, int):
-            obj = self._values[key]
+            if self._buffer is not None:
+                obj = self._element(key)
+            else:
+                obj = self._values[key]
             if issubclass(self.object_type, structField):
                 return obj.get()
             else:
                 return obj
         elif isinstance(key, slice):
+            if self._buffer is not None:
+                return structArrayView(self, *key.indices(self.__len__()))
             values = []
             for i in range(*key.indices(self.__len__())):
                 values.append(self.__getitem__(i))
@@ -469,7 +1408,13 @@ class structArray(object):
         else:
             raise Exception("Unrecognized index: {}".format(key))
 
+    def _check_frozen(self):
+        if self._parent._frozen:
+            raise AttributeError("Can't modify array, {} is frozen".format(self._parent.__class__.__name__))
+
     def __setitem__(self, key, value):
+        self._check_frozen()
+        self.materialize()
         if isinstance(key, int):
             if key < len(self._values):
                 self._values[key].set(value)
@@ -480,43 +1425,197 @@ class structArray(object):
                 self._values[index].set(value[i])
         else:
             raise Exception("Unrecognized index: {}".format(key))
+        self._cache = None
+        self._parent._touch(self)
+
+    def _element(self, i, keep=True):
+        "Decodes element i of a lazy array, structObject elements are kept so changes to them are packed"
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError("Index: {} not in object".format(i))
+        if issubclass(self.object_type, structField):
+            obj = self.object_type(self._parent)
+            obj.unprep(struct.unpack_from(self._parent._byte_order + obj.fmt, self._buffer, i * self._item_size)[0],
+                       (self._policy or self._parent._validation) == strict)
+            return obj
+        obj = self._decoded.get(i)
+        if obj is None:
+            obj = self.object_type._blank() if self.object_type._flat is not None else self.object_type()
+            obj.unpack_from(self._buffer, i * self._item_size, self._policy)
+            if keep:
+                self._decoded[i] = obj
+        return obj
+
+    def _elements(self):
+        "Iterates over the element fields or objects, decoding those of a lazy array without keeping them"
+        if self._buffer is None:
+            return iter(self._values)
+        return (self._element(i, False) for i in range(self._count))
+
+    def materialize(self):
+        "Decodes every element of a lazy array, which then behaves as an ordinary array"
+        if self._buffer is not None:
+            self._values = [self._element(i) for i in range(self._count)]
+            self._buffer = None
+            self._decoded = None
+        return self
+
+    def validate(self):
+        for obj in self._elements():
+            obj.validate()
+
+    def to_tuple(self):
+        if issubclass(self.object_type, structField):
+            return tuple([obj.value for obj in self._elements()])
+        return tuple([obj.to_tuple() for obj in self._elements()])
+
+    def to_list(self, recursive=True):
+        if issubclass(self.object_type, structField):
+            return [obj.value for obj in self._elements()]
+        elif recursive:
+            return [obj.to_dict() for obj in self._elements()]
+        return list(self.materialize()._values)
+
+    def from_list(self, values):
+        "Replaces the elements, structObject elements may be given as dicts"
+        self._check_frozen()
+        self._buffer = None
+        self._values = []
+        for value in values:
+            if issubclass(self.object_type, structField):
+                self._values.append(self.object_type(self._parent, value))
+            elif isinstance(value, dict):
+                self._values.append(self.object_type.from_dict(value))
+            elif isinstance(value, (list, tuple)):
+                self._values.append(self.object_type.from_tuple(value))
+            elif isinstance(value, self.object_type):
+                self._values.append(value)
+            else:
+                raise TypeError("Elements must be of type '{}', given '{}'".format(
+                    self.object_type.__name__, value.__class__.__name__))
+        self._cache = None
+        self._parent._touch(self)
 
     def append(self, *args, **kargs):
+        self._check_frozen()
+        self.materialize()
         if issubclass(self.object_type, structField):
             obj = self.object_type(self._parent, *args)
         else:
             obj = self.object_type(*args, **kargs)
         self._values.append(obj)
-
-    def pack(self):
-        if issubclass(self.object_type, structField):
-            return struct.pack(str(self.__len__()) + self.object_type.fmt, *self._values)
+        self._cache = None
+        self._parent._touch(self)
+
+    def pack(self, validation=None):
+        buf = bytearray()
+        self._pack_to(buf, validation)
+        return bytes(buf)
+
+    def _pack_to(self, buf, validation=None):
+        if self._buffer is not None:
+            # untouched bytes are copied, decoded structObject elements are packed as they may have changed
+            if len(self._decoded) == 0:
+                buf += self._buffer
+                return
+            size = self._item_size
+            for i in range(self._count):
+                if i in self._decoded:
+                    self._decoded[i]._pack_to(buf, validation)
+                else:
+                    buf += self._buffer[i * size:(i + 1) * size]
+        elif issubclass(self.object_type, structField):
+            # structObject elements cache their own segments, scalar elements are cached here
+            if self._cache is None:
+                policy = validation or self._parent._validation
+                if policy == on_pack:
+                    self.validate()
+                fmt = self._parent._byte_order + str(self.__len__()) + self.object_type.fmt
+                self._cache = struct.pack(fmt, *[item.prep(policy == strict) for item in self._values])
+            buf += self._cache
         elif issubclass(self.object_type, structObject):
-            s = bytes("", "ASCII")
             for val in self._values:
-                s += val.pack()
-            return s
+                val._pack_to(buf, validation)
+
+    def unpack(self, bindata, validation=None):
+        self._unpack_from(bindata, 0, validation)
 
-    def unpack(self, bindata):
+    def _unpack_from(self, buffer, offset, validation=None):
+        "Decodes the elements starting at offset, reusing existing elements, returns the offset after them"
+        self._cache = None
         if self.len != None:
             if isinstance(self.len[0], int):
                 count = self.len[0]
             else:
                 count = self.len[0](self._parent)
         else:
-            count = len(bindata) - len(bindata) % self._item_size
-
+            count = (len(buffer) - offset) // self._item_size
+
+        if self.lazy:
+            # keep a view of the bytes, elements are decoded when accessed
+            end = offset + count * self._item_size
+            view = memoryview(buffer)
+            if view.nbytes < end:
+                raise struct.error("unpack requires a buffer of {} bytes for {} elements".format(
+                    end - offset, count))
+            self._buffer = view[offset:end]
+            self._count = count
+            self._decoded = {}
+            self._policy = validation
+            self._values = None
+            return end
+        elif self._values is None:
+            self._buffer = None
+            self._values = []
+
+        # drop surplus elements, the rest are overwritten in place
+        del self._values[count:]
         if issubclass(self.object_type, structField):
             # lets just unpack these all at once
-            fmt = str(count) + self.object_type.fmt
-            values = struct.unpack(fmt, bindata[0:count * self._item_size])
-            for value in values:
-                self.append(value)
+            fmt = self._parent._byte_order + str(count) + self.object_type.fmt
+            values = struct.unpack_from(fmt, buffer, offset)
+            validate = (validation or self._parent._validation) == strict
+            for i, value in enumerate(values):
+                if i < len(self._values):
+                    self._values[i].unprep(value, validate)
+                else:
+                    obj = self.object_type(self._parent)
+                    obj.unprep(value, validate)
+                    self._values.append(obj)
+            return offset + count * self._item_size
+        elif self.object_type._flat is not None:
+            return self._unpack_strided(buffer, offset, count, validation)
         else:
-            offset = 0
             for i in range(count):
-                self.append(memoryview(bindata)[offset:])
-                offset += self._values[-1].size
+                if i == len(self._values):
+                    self._values.append(self.object_type())
+                elif self._values[i]._frozen:
+                    self._values[i] = self.object_type()
+                offset = self._values[i]._unpack_from(buffer, offset, validation)
+            return offset
+
+    def _unpack_strided(self, buffer, offset, count, validation=None):
+        "Decodes count fixed size records of a flat class at a fixed stride without per element dispatch"
+        object_type = self.object_type
+        unpack_from = object_type._flat.unpack_from
+        stride = object_type._flat.size
+        validate = (validation or object_type._validation) == strict
+        values = self._values
+        for i in range(count):
+            if i < len(values) and not values[i]._frozen:
+                obj = values[i]
+                obj._cache[0] = None
+            else:
+                # frozen elements may be shared, so they're replaced rather than overwritten
+                obj = object_type._blank()
+            obj._unprep_segment(object_type._flat, unpack_from(buffer, offset), validate)
+            if i == len(values):
+                values.append(obj)
+            else:
+                values[i] = obj
+            offset += stride
+        return offset
 
 
 def struct_array(**kargs):
@@ -525,11 +1624,318 @@ def struct_array(**kargs):
     }
     obj_dict.update(kargs)
     if issubclass(obj_dict['object_type'], structField):
-        obj_dict['_item_size'] = struct.calcsize(obj_dict['object_type'].fmt)
+        # standard sizes, matching the byte orders available to structObject
+        obj_dict['_item_size'] = struct.calcsize(native + obj_dict['object_type'].fmt)
     elif issubclass(obj_dict['object_type'], structObject):
         obj_dict['_item_size'] = obj_dict['object_type']().size
 
     if 'len' in obj_dict:
         obj_dict['len'] = (obj_dict['len'],)  # protect from becomeing class method
 
-    return type('struct_array', (structArray,), obj_dict)
+    if obj_dict.get('lazy') and issubclass(obj_dict['object_type'], structObject) and \
+            obj_dict['object_type']._fixed_size is None:
+        raise Exception("Lazy arrays require fixed size elements, '{}' is variable".format(
+            obj_dict['object_type'].__name__))
+
+    cls = type('struct_array', (structArray,), obj_dict)
+    if _foldable(cls, None):
+        cls._fold_length = cls.len[0]
+    return cls
+
+
+class structArrayView(object):
+    """Read only window onto the elements of a lazy structArray, returned when slicing one
+
+    Elements are decoded when accessed, slicing a view returns another view.
+    """
+    __slots__ = (
+        '_array',
+        '_start',
+        '_step',
+        '_count'
+    )
+
+    def __init__(self, array, start, stop, step):
+        self._array = array
+        self._start = start
+        self._step = step
+        self._count = len(range(start, stop, step))
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            if key < 0:
+                key += self._count
+            if not 0 <= key < self._count:
+                raise IndexError("Index: {} not in view".format(key))
+            return self._array[self._start + key * self._step]
+        elif isinstance(key, slice):
+            start, stop, step = key.indices(self._count)
+            return structArrayView(self._array, self._start + start * self._step,
+                                   self._start + stop * self._step, step * self._step)
+        else:
+            raise Exception("Unrecognized index: {}".format(key))
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self[i]
+
+
+class structConditional(object):
+    """Base for fields whose type or presence is decided by previous fields of the parent
+
+    The value is a structObject instance, or for scalar types the field value, and None when absent.
+    """
+    __slots__ = (
+        '_parent',
+        '_value'
+    )
+    _variable_length = True
+
+    def __init__(self, _parent):
+        self._parent = _parent
+        self._value = None
+        object_type = self._select()
+        if object_type is not None:
+            self._value = self._make(object_type)
+
+    def _clone(self, _parent):
+        "Returns a copy of the conditional for another parent"
+        obj = self.__class__.__new__(self.__class__)
+        obj._parent = _parent
+        obj._value = self._value
+        if isinstance(self._value, structField):
+            obj._value = self._value._clone(_parent)
+        elif isinstance(self._value, structObject):
+            obj._value = self._value._clone()
+        return obj
+
+    def _select(self):
+        "Returns the type chosen by the parent's current values, or None when absent"
+        raise NotImplementedError()
+
+    def _types(self):
+        "Returns the types the value may take"
+        raise NotImplementedError()
+
+    def _make(self, object_type):
+        if issubclass(object_type, structField):
+            return object_type(self._parent)
+        else:
+            return object_type()
+
+    def get(self):
+        if isinstance(self._value, structField):
+            return self._value.get()
+        return self._value
+
+    def set(self, value, validate=True):
+        if value is None or isinstance(value, structObject):
+            if value is not None and value.__class__ not in self._types():
+                raise TypeError("'{}' is not one of '{}'".format(
+                    value.__class__.__name__, "', '".join(t.__name__ for t in self._types())))
+            self._value = value
+        else:
+            # scalar value, wrap it in a field of the selected type
+            object_type = self._select()
+            if object_type is None or not issubclass(object_type, structField):
+                raise TypeError("'{}' can't be stored in this field".format(value.__class__.__name__))
+            self._value = object_type(self._parent, value)
+
+    @property
+    def size(self):
+        if self._value is None:
+            return 0
+        elif isinstance(self._value, structField):
+            return struct.calcsize(native + self._value.fmt)
+        return self._value.size
+
+    def validate(self):
+        if self._value is not None:
+            self._value.validate()
+
+    def to_tuple(self):
+        if isinstance(self._value, structObject):
+            return self._value.to_tuple()
+        return self.get()
+
+    def to_dict(self, recursive=True):
+        if isinstance(self._value, structObject):
+            return self._value.to_dict(recursive)
+        return self.get()
+
+    def pack(self, validation=None):
+        buf = bytearray()
+        self._pack_to(buf, validation)
+        return bytes(buf)
+
+    def _pack_to(self, buf, validation=None):
+        object_type = self._select()
+        if (self._value.__class__ if self._value is not None else None) is not object_type:
+            raise TypeError("Value of type '{}' doesn't match the selected type '{}'".format(
+                self._value.__class__.__name__, getattr(object_type, '__name__', None)))
+        if isinstance(self._value, structField):
+            policy = validation or self._parent._validation
+            if policy == on_pack:
+                self._value.validate()
+            buf += struct.pack(self._parent._byte_order + self._value.fmt, self._value.prep(policy == strict))
+        elif self._value is not None:
+            self._value._pack_to(buf, validation)
+
+    def unpack(self, bindata, validation=None):
+        self._unpack_from(bindata, 0, validation)
+
+    def _unpack_from(self, buffer, offset, validation=None):
+        "Decodes the value starting at offset, reusing the current one if the type matches"
+        object_type = self._select()
+        if object_type is None:
+            self._value = None
+            return offset
+        if self._value.__class__ is not object_type or getattr(self._value, '_frozen', False):
+            self._value = self._make(object_type)
+        if issubclass(object_type, structField):
+            field = self._value
+            field.unprep(struct.unpack_from(self._parent._byte_order + field.fmt, buffer, offset)[0],
+                         (validation or self._parent._validation) == strict)
+            return offset + struct.calcsize(native + field.fmt)
+        return self._value._unpack_from(buffer, offset, validation)
+
+
+class structUnion(structConditional):
+    __slots__ = ()
+
+    def _select(self):
+        return self.cases.get(self.selector[0](self._parent))
+
+    def _types(self):
+        return tuple(self.cases.values())
+
+    def _pack_to(self, buf, validation=None):
+        if self._select() is None:
+            raise Exception("No union case for selector value {}".format(self.selector[0](self._parent)))
+        super(structUnion, self)._pack_to(buf, validation)
+
+    def _unpack_from(self, buffer, offset, validation=None):
+        if self._select() is None:
+            raise Exception("No union case for selector value {}".format(self.selector[0](self._parent)))
+        return super(structUnion, self)._unpack_from(buffer, offset, validation)
+
+
+class structOptional(structConditional):
+    __slots__ = ()
+
+    def _select(self):
+        if self.present_if[0](self._parent):
+            return self.object_type
+        return None
+
+    def _types(self):
+        return (self.object_type,)
+
+
+def union_field(**kargs):
+    """Field holding one of several structObject types, chosen by previous fields
+
+    Parameters:
+    selector - function taking the parent instance and returning a key of cases
+    cases - dict of selector value to structObject subclass
+    """
+    obj_dict = {
+        '__slots__': (),
+    }
+    obj_dict.update(kargs)
+    obj_dict['selector'] = (obj_dict['selector'],)  # protect from becomeing class method
+    return type('union_field', (structUnion,), obj_dict)
+
+
+def optional_field(**kargs):
+    """Field that is only present when a condition on previous fields holds
+
+    Parameters:
+    object_type - structObject subclass or structField type of the value
+    present_if - function taking the parent instance and returning True when present
+    """
+    obj_dict = {
+        '__slots__': (),
+    }
+    obj_dict.update(kargs)
+    obj_dict['present_if'] = (obj_dict['present_if'],)  # protect from becomeing class method
+    return type('optional_field', (structOptional,), obj_dict)
+
+
+class structPool(object):
+    """Free list of instances of a structObject class, see structObject.pooled()
+
+    Released instances keep their child fields, arrays and substructures, which are overwritten in
+    place when the instance is decoded again, so a steady decode/release loop allocates nothing.
+    Acquired instances hold the values of their previous use until decoded or assigned.
+    """
+
+    def __init__(self, cls, capacity=1024):
+        self.cls = cls
+        self.capacity = capacity
+        self._free = []
+        self.hits = 0
+        self.misses = 0
+        self.dropped = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.clear()
+
+    def __len__(self):
+        return len(self._free)
+
+    def acquire(self):
+        "Returns a released instance, or a new one if none are free"
+        if len(self._free) > 0:
+            self.hits += 1
+            return self._free.pop()
+        self.misses += 1
+        return self.cls()
+
+    def decode(self, buffer, offset=0, validation=None):
+        "Returns an instance holding the record starting at offset of buffer"
+        obj = self.acquire()
+        try:
+            obj.unpack_from(buffer, offset, validation)
+        except Exception:
+            self.release(obj)
+            raise
+        return obj
+
+    def release(self, obj):
+        "Returns obj to the pool, it must not be used by the caller afterwards"
+        if obj.__class__ is not self.cls:
+            raise TypeError("'{}' can't be released to a pool of '{}'".format(
+                obj.__class__.__name__, self.cls.__name__))
+        if obj._frozen:
+            raise TypeError("Frozen instances can't be recycled")
+        if len(self._free) < self.capacity:
+            self._free.append(obj)
+        else:
+            self.dropped += 1
+
+    def clear(self):
+        "Drops the free instances"
+        del self._free[:]
+
+    @property
+    def hit_rate(self):
+        "Fraction of acquisitions served from the free list"
+        total = self.hits + self.misses
+        return float(self.hits) / total if total > 0 else 0.0
+
+    def stats(self):
+        return {
+            'capacity': self.capacity,
+            'free': len(self._free),
+            'hits': self.hits,
+            'misses': self.misses,
+            'dropped': self.dropped,
+            'hit_rate': self.hit_rate,
+        }
@@ -0,0 +1,182 @@
+"""
+Binary patches between two versions of a record
+
+# send only the fields that changed since the last version
+patch = Datagram.diff(previous, current)
+...
+Datagram.apply(replica, patch)
+
+A patch holds the packed length of the new record followed by runs of changed bytes, each a varint
+of the bytes skipped since the previous run, a varint length and the bytes themselves. Runs follow
+the field boundaries of the compiled segments, substructures are compared field by field and arrays
+of fixed size elements element by element.
+"""
+try:
+    from .structField import structField, strict
+    from .structObject import structObject, structArray, structSegment
+except:
+    from structField import structField, strict
+    from structObject import structObject, structArray, structSegment
+
+# unchanged bytes between two runs are sent rather than starting a new run, which costs at least 2
+MERGE_GAP = 2
+
+
+def _write_varint(buf, n):
+    "Appends n to bytearray buf as an unsigned LEB128 varint"
+    while n > 0x7f:
+        buf.append(0x80 | (n & 0x7f))
+        n >>= 7
+    buf.append(n)
+
+
+def _read_varint(data, pos):
+    "Returns the varint at pos of data and the position after it"
+    n = 0
+    shift = 0
+    while True:
+        if pos >= len(data):
+            raise ValueError("Truncated patch")
+        byte = data[pos]
+        pos += 1
+        n |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return n, pos
+        shift += 7
+
+
+def _starts(obj, offset):
+    "Returns the position of each segment of obj packed at offset, and the position after the last"
+    starts = []
+    for seg in obj._segments:
+        starts.append(offset)
+        if isinstance(seg, structSegment):
+            offset += seg.size
+        else:
+            offset += obj._values[seg].size
+    starts.append(offset)
+    return starts
+
+
+def _add(runs, start, end):
+    "Adds the changed range [start, end) to runs, joining it to the previous run if the gap is small"
+    if len(runs) > 0 and start - runs[-1][1] <= MERGE_GAP:
+        runs[-1][1] = end
+    else:
+        runs.append([start, end])
+
+
+def _element_size(array):
+    "Returns the packed size of each element of an array, or None if they vary"
+    if issubclass(array.object_type, structField):
+        return array._item_size
+    return array.object_type._fixed_size
+
+
+def _compare(old, new, old_data, new_data, offset, runs):
+    """Adds the ranges where the fields of new differ from those of old, both packed at offset, to
+    runs, returns the position from which their layouts differ or None if they match"""
+    old_starts = _starts(old, offset)
+    new_starts = _starts(new, offset)
+    for i in range(len(new._field_order)):
+        start, end = new._span(i, new_starts)
+        if old._span(i, old_starts) != (start, end):
+            return start
+        if old_data[start:end] == new_data[start:end]:
+            continue
+        old_value = old._values[i]
+        new_value = new._values[i]
+        if isinstance(new_value, structObject) and new_value.__class__ is old_value.__class__:
+            diverged = _compare(old_value, new_value, old_data, new_data, start, runs)
+            if diverged is not None:
+                return diverged
+        elif isinstance(new_value, structArray) and len(new_value) == len(old_value) and \
+                _element_size(new_value) is not None:
+            size = _element_size(new_value)
+            for position in range(start, end, size):
+                if old_data[position:position + size] != new_data[position:position + size]:
+                    _add(runs, position, position + size)
+        else:
+            _add(runs, start, end)
+    return None
+
+
+def diff(cls, old, new):
+    "Returns a patch turning the packed bytes of old into those of new, both instances of cls"
+    for obj in (old, new):
+        if obj.__class__ is not cls:
+            raise TypeError("'{}' is not '{}'".format(obj.__class__.__name__, cls.__name__))
+    old_bytes = old.pack()
+    new_bytes = new.pack()
+    runs = []
+    with memoryview(old_bytes) as old_data, memoryview(new_bytes) as new_data:
+        diverged = _compare(old, new, old_data, new_data, 0, runs)
+    if diverged is not None and diverged < len(new_bytes):
+        # the fields after a variable size part that changed length are sent whole
+        _add(runs, diverged, len(new_bytes))
+
+    patch = bytearray()
+    _write_varint(patch, len(new_bytes))
+    position = 0
+    for start, end in runs:
+        _write_varint(patch, start - position)
+        _write_varint(patch, end - start)
+        patch += new_bytes[start:end]
+        position = end
+    return bytes(patch)
+
+
+def _patch(data, patch):
+    "Applies patch to the writable buffer data, returns the changed (start, end) ranges"
+    size, pos = _read_varint(patch, 0)
+    if len(data) != size:
+        if not isinstance(data, bytearray):
+            raise ValueError("Patch is for {} bytes, the buffer holds {}".format(size, len(data)))
+        del data[size:]
+        data.extend(bytearray(size - len(data)))
+    runs = []
+    position = 0
+    while pos < len(patch):
+        gap, pos = _read_varint(patch, pos)
+        length, pos = _read_varint(patch, pos)
+        start = position + gap
+        position = start + length
+        if position > size or pos + length > len(patch):
+            raise ValueError("Corrupt patch, run at {} overruns the record".format(start))
+        data[start:position] = patch[pos:pos + length]
+        pos += length
+        runs.append((start, position))
+    return runs
+
+
+def apply(cls, target, patch, validation=None):
+    """Applies a patch from diff to an instance of cls, or to a bytearray or writable buffer holding
+    its packed bytes, in place and returns the target
+
+    Instances of fixed size classes without checksums only decode the segments that changed, others
+    are decoded whole. Only a bytearray can change length.
+    """
+    if not isinstance(target, structObject):
+        _patch(target, patch)
+        return target
+    if target.__class__ is not cls:
+        raise TypeError("'{}' is not '{}'".format(target.__class__.__name__, cls.__name__))
+    if target._frozen:
+        raise AttributeError("Can't unpack into {}, it is frozen".format(cls.__name__))
+    data = bytearray(target.pack())
+    runs = _patch(data, patch)
+    if cls._fixed_size is None or len(cls._checksums) > 0:
+        target.unpack(bytes(data), validation)
+        return target
+
+    validate = (validation or target._validation) == strict
+    starts = _starts(target, 0)
+    for n, seg in enumerate(cls._segments):
+        if not any(start < starts[n + 1] and end > starts[n] for start, end in runs):
+            continue
+        if isinstance(seg, structSegment):
+            target._cache[n] = None
+            target._unprep_segment(seg, seg.unpack_from(data, starts[n]), validate)
+        else:
+            target._values[seg]._unpack_from(data, starts[n], validation)
+    return target
@@ -0,0 +1,85 @@
+"""
+Throughput of decoding record files, uncompressed and through each stdlib codec, and the time to
+construct default records with substructures
+
+python tests/benchStructFile.py [record count]
+"""
+from __future__ import print_function
+
+import bz2
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from structobject import *
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+
+class Point(structObject):
+    _field_order = ('x', 'y')
+    x = ctype_double()
+    y = ctype_double()
+
+
+class Message(structObject):
+    _field_order = ('STX', 'timestamp', 'position', 'value')
+    STX = ctype_uchar(value=0x02)
+    timestamp = ctype_uint()
+    position = Point
+    value = ctype_float()
+
+
+class BoundingBox(structObject):
+    _field_order = ('northwest', 'southeast')
+    northwest = Point
+    southeast = Point
+
+
+def bench(label, path, size):
+    start = time.time()
+    count = sum(1 for obj in iter_unpack(Message, path))
+    decode = time.time() - start
+    start = time.time()
+    found = sum(1 for offset in Message.scan(path, where={'timestamp': (0, 999)}, offsets=True))
+    scan = time.time() - start
+    print("{:<14}{:>10} records{:>10.1f} MB/s decode{:>10.1f} MB/s scan ({} found)".format(
+        label, count, size / decode / 1e6, size / scan / 1e6, found))
+
+
+def bench_defaults(number=20000):
+    "Default records are copied from the class prototype, given substructures are built by the caller"
+    copied = min(timeit.repeat(BoundingBox, number=number, repeat=5)) / number
+    built = min(timeit.repeat(lambda: BoundingBox(Point(), Point()), number=number, repeat=5)) / number
+    print("{:<14}{:>10.2f} us copied from the prototype{:>10.2f} us with new substructures".format(
+        'defaults', copied * 1e6, built * 1e6))
+
+
+def main(count=200000):
+    data = b''.join(Message(timestamp=i, position=Point(float(i), 0.0), value=1.0).pack() for i in range(count))
+    codecs = [('uncompressed', bytes), ('gzip', gzip.compress), ('bz2', bz2.compress)]
+    if lzma is not None:
+        codecs.append(('lzma', lzma.compress))
+    directory = tempfile.mkdtemp()
+    try:
+        for label, compress in codecs:
+            path = os.path.join(directory, label)
+            with open(path, 'wb') as f:
+                f.write(compress(data))
+            bench(label, path, len(data))
+    finally:
+        shutil.rmtree(directory)
+    bench_defaults()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -3,6 +3,10 @@ import unittest
 from testStructArray import structArrayTests
 from testStructField import structFieldTests
 from testStructObject import structObjectTests
+from testStructFile import structFileTests
+from testExport import exportTests
+from testCodegen import codegenTests
+from testStructPatch import structPatchTests
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,144 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import calendar
+import importlib
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.append("..\\..\\")
+
+from structobject import *
+from structobject.codegen import compile_module, compile_class, _moduleWriter
+
+
+class Point(structObject):
+    "Basic point class"
+    _field_order = ('x', 'y')
+    x = ctype_double()
+    y = ctype_double()
+
+
+class BoundingBox(structObject):
+    _field_order = ('northwest', 'southeast')
+    northwest = Point
+    southeast = Point
+
+
+class Path(structObject):
+    _field_order = ('point_count', 'points', 'tags')
+    point_count = ctype_uint(generator=lambda self: len(self.points), depends=('points',))
+    points = struct_array(object_type=Point, len=lambda self: self.point_count)
+    tags = struct_array(object_type=ctype_ushort(), len=3)
+
+
+class Datagram(structObject):
+    _field_order = ('STX', 'timestamp', 'msg_type', 'body', 'temperature', 'crc', 'ETX')
+    _byte_order = big_endian
+    STX = ctype_uchar(value=0x02)
+    timestamp = ctype_uint(setter=calendar.timegm, getter=time.gmtime)
+    msg_type = ctype_uchar()
+    body = union_field(selector=lambda self: self.msg_type, cases={1: Point, 2: BoundingBox})
+    temperature = optional_field(object_type=ctype_float(), present_if=lambda self: self.msg_type == 2)
+    crc = crc16_field(over=('STX', 'temperature'))
+    ETX = ctype_uchar(value=0x03)
+
+
+class Reading(structObject):
+    _field_order = ('flags', 'level', 'stamp')
+    flags = ctype_uchar()
+    level = ctype_ushort(validator=[lambda value: value < 1000])
+    stamp = optional_field(object_type=ctype_uint(setter=calendar.timegm, getter=time.gmtime),
+                           present_if=lambda self: self.flags & 1)
+
+
+class codegenTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        with open(os.path.join(cls.directory, 'compiled_schema.py'), 'w') as f:
+            f.write(compile_module(sys.modules[__name__]))
+        sys.path.insert(0, cls.directory)
+        cls.compiled = importlib.import_module('compiled_schema')
+
+    @classmethod
+    def tearDownClass(cls):
+        sys.path.remove(cls.directory)
+        del sys.modules['compiled_schema']
+        shutil.rmtree(cls.directory)
+
+    def assertRoundTrip(self, cls, data):
+        "Decodes data with the dynamic and the compiled class and checks both pack back to data"
+        dynamic = cls(data)
+        compiled = getattr(self.compiled, cls.__name__).from_bytes(data)
+        self.assertEqual(dynamic.pack(), data)
+        self.assertEqual(compiled.pack(), data)
+        self.assertEqual(compiled.size, dynamic.size)
+        return dynamic, compiled
+
+    def testNoMetaclass(self):
+        self.assertIs(type(self.compiled.Point), type)
+        self.assertNotIn('structobject', self.compiled.__dict__)
+
+    def testPoint(self):
+        dynamic, compiled = self.assertRoundTrip(Point, struct.pack('dd', 1.5, -2.0))
+        self.assertEqual(compiled.to_dict(), dynamic.to_dict())
+        self.assertEqual(self.compiled.Point(1.5, -2.0).pack(), Point(1.5, -2.0).pack())
+
+    def testBoundingBox(self):
+        dynamic, compiled = self.assertRoundTrip(BoundingBox, struct.pack('dddd', 0.0, 10.0, 15.0, 0.0))
+        self.assertEqual(compiled.to_tuple(), dynamic.to_tuple())
+
+    def testPath(self):
+        data = struct.pack('=IddddHHH', 2, 0.0, 10.0, 10.0, 20.0, 1, 2, 3)
+        dynamic, compiled = self.assertRoundTrip(Path, data)
+        self.assertEqual(compiled.unpack_from(b'\x00' + data, 1), len(data))
+        self.assertEqual(compiled.to_dict(), dynamic.to_dict())
+        compiled.points.append(self.compiled.Point(5.0, 6.0))
+        dynamic.points.append(5.0, 6.0)
+        self.assertEqual(compiled.pack(), dynamic.pack())
+
+    def testDatagram(self):
+        for msg_type, body in ((1, struct.pack('>dd', 1.0, 2.0)),
+                               (2, struct.pack('>ddddf', 1.0, 2.0, 3.0, 4.0, 20.5))):
+            dynamic = Datagram(timestamp=time.gmtime(100), msg_type=msg_type)
+            dynamic.unpack(struct.pack('>BIB', 2, 100, msg_type) + body + struct.pack('>HB', 0, 3),
+                           validation=trusted)
+            data = dynamic.pack()
+            dynamic, compiled = self.assertRoundTrip(Datagram, data)
+            self.assertEqual(compiled.timestamp, time.gmtime(100))
+        self.assertRaises(ValueError, self.compiled.Datagram.from_bytes, data[:-3] + b'\x00\x00\x03')
+        self.assertRaises(ValueError, self.compiled.Datagram(timestamp=time.gmtime(0), msg_type=3).pack)
+
+    def testReading(self):
+        dynamic = Reading(1, 500, time.gmtime(100))
+        dynamic, compiled = self.assertRoundTrip(Reading, dynamic.pack())
+        self.assertEqual(compiled.stamp, time.gmtime(100))
+        self.assertEqual(self.compiled.Reading(0, 5).pack(), Reading(0, 5).pack())
+        compiled.level = 5000
+        self.assertRaises(ValueError, compiled.pack)
+
+    def testUnsupported(self):
+        class Padded(structObject):
+            _field_order = ('flags', 'pad')
+            flags = ctype_uchar()
+            pad = ctype_pad()
+
+        class Closure(structObject):
+            _field_order = ('count',)
+            count = ctype_uint(generator=lambda self: len(Padded._field_order))
+
+        self.assertRaises(TypeError, compile_class, _moduleWriter(), Padded)
+        self.assertRaises(ValueError, compile_class, _moduleWriter(), Closure)
+
+
+if __name__ == '__main__':
+    unittest.main()
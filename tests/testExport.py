@@ -0,0 +1,113 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import csv
+import io
+import json
+import os
+import struct
+import sys
+import tempfile
+import unittest
+
+sys.path.append("..\\..\\")
+
+from structobject import *
+from structobject.export import export_records, columns, main
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class Point(structObject):
+    "Basic point class"
+    _field_order = ('x', 'y')
+    x = ctype_double()
+    y = ctype_double()
+
+
+class BoundingBox(structObject):
+    _field_order = ('northwest', 'southeast')
+    northwest = Point
+    southeast = Point
+
+
+def boxes_bytes(count):
+    return b''.join(struct.pack('dddd', i, i + 1, i + 2, i + 3) for i in range(count))
+
+
+class exportTests(unittest.TestCase):
+
+    def testColumns(self):
+        class Track(structObject):
+            _field_order = ('box', 'corners', 'flags')
+            box = BoundingBox
+            corners = struct_array(object_type=Point, len=2)
+            flags = struct_array(object_type=ctype_uchar(), len=2)
+
+        self.assertEqual(columns(Track), ['box.northwest.x', 'box.northwest.y', 'box.southeast.x', 'box.southeast.y',
+                                          'corners.0.x', 'corners.0.y', 'corners.1.x', 'corners.1.y',
+                                          'flags.0', 'flags.1'])
+
+    def testJsonLines(self):
+        out = io.StringIO()
+        count = export_records(BoundingBox, io.BytesIO(boxes_bytes(10)), out, format='jsonl', chunk_size=64)
+        self.assertEqual(count, 10)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 10)
+        self.assertEqual(json.loads(lines[9]),
+                         {'northwest': {'x': 9.0, 'y': 10.0}, 'southeast': {'x': 11.0, 'y': 12.0}})
+
+    def testCsv(self):
+        out = io.StringIO()
+        export_records(BoundingBox, io.BytesIO(boxes_bytes(3)), out, format='csv')
+        rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[2]['southeast.y'], '5.0')
+
+    def testCsvVariableRecords(self):
+        class Path(structObject):
+            _field_order = ('count', 'origin', 'points')
+            count = ctype_uint(generator=lambda self: len(self.points), depends=('points',))
+            origin = Point
+            points = struct_array(object_type=Point, len=lambda self: self.count)
+
+        data = Path(points=[(1.0, 2.0)]).pack() + Path(points=[(3.0, 4.0), (5.0, 6.0)]).pack() + Path().pack()
+        out = io.StringIO()
+        self.assertEqual(export_records(Path, io.BytesIO(data), out, format='csv'), 3)
+        rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+        self.assertEqual(list(rows[0].keys()), ['count', 'origin.x', 'origin.y', 'points'])
+        self.assertEqual([row['count'] for row in rows], ['1', '2', '0'])
+        self.assertEqual(json.loads(rows[1]['points']), [{'x': 3.0, 'y': 4.0}, {'x': 5.0, 'y': 6.0}])
+        self.assertEqual(json.loads(rows[2]['points']), [])
+
+    @unittest.skipIf(msgpack is None, 'msgpack not installed')
+    def testMsgpack(self):
+        out = io.BytesIO()
+        export_records(BoundingBox, io.BytesIO(boxes_bytes(3)), out, format='msgpack')
+        records = list(msgpack.Unpacker(io.BytesIO(out.getvalue()), raw=False))
+        self.assertEqual(records[1]['northwest'], {'x': 1.0, 'y': 2.0})
+
+    def testUnsupportedFormat(self):
+        self.assertRaises(ValueError, export_records, Point, io.BytesIO(), io.StringIO(), format='xml')
+
+    def testCommandLine(self):
+        directory = tempfile.mkdtemp()
+        src = os.path.join(directory, 'boxes.bin')
+        dst = os.path.join(directory, 'boxes.jsonl')
+        with open(src, 'wb') as f:
+            f.write(boxes_bytes(5))
+        main(['testExport:BoundingBox', src, dst])
+        with open(dst) as f:
+            self.assertEqual(len(f.readlines()), 5)
+        os.remove(src)
+        os.remove(dst)
+        os.rmdir(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -44,6 +44,16 @@ class structFieldTests(unittest.TestCase):
         self.assertRaises(Exception, field, None, value=11)
         self.assertRaises(Exception, fieldInstance.set, 11)
 
+    def testChecksumFactories(self):
+        self.assertEqual(crc16_field().__base__, checksumField)
+        self.assertEqual(crc32_field().__base__, checksumField)
+        self.assertEqual(sum8_field().__base__, checksumField)
+        self.assertEqual(sum16_field().__base__, checksumField)
+        self.assertEqual(crc16_field(over='body').over, ('body', 'body'))
+        self.assertEqual(crc16_field()(None).compute(b'123456789'), 0x29b1)
+        self.assertEqual(crc32_field()(None).compute(b'123456789'), 0xcbf43926)
+        self.assertEqual(sum8_field()(None).compute(b'\xff\x02'), 0x01)
+
     def testGetterSetter(self):
         field = ctype_uint(
             setter=calendar.timegm,
@@ -55,7 +65,25 @@ class structFieldTests(unittest.TestCase):
         self.assertEqual(fieldInstance.prep(), 13000000)
 
     def testGenerator(self):
-        self.fail('testGenerator() not yet implemented')
+        calls = []
+
+        def answer(parent):
+            calls.append(parent)
+            return 42
+
+        field = ctype_int(generator=answer, depends=('x',))
+        fieldInstance = field(None)
+        self.assertEqual(fieldInstance.prep(), 42)
+        self.assertEqual(fieldInstance.get(), 42)
+        self.assertEqual(fieldInstance.prep(), 42)
+        self.assertEqual(len(calls), 1)
+
+        # generators without declared dependencies run on every prep
+        field = ctype_int(generator=answer)
+        fieldInstance = field(None)
+        fieldInstance.prep()
+        fieldInstance.prep()
+        self.assertEqual(len(calls), 3)
 
     def testValidator(self):
         def is_odd(s): return s % 2 != 0
@@ -64,6 +92,16 @@ class structFieldTests(unittest.TestCase):
         fieldInstance = field(None, 11)  # should not raise error
         self.assertRaises(Exception, field, None, value=10)
 
+    def testValidatorSkipped(self):
+        def is_odd(s): return s % 2 != 0
+
+        field = ctype_int(validator=[is_odd])
+        fieldInstance = field(None, 11)
+        fieldInstance.set(10, validate=False)
+        self.assertEqual(fieldInstance.get(), 10)
+        self.assertRaises(ValidationError, fieldInstance.validate)
+        self.assertRaises(ValidationError, fieldInstance.set, 12)
+
     def testString(self):
         # using the 's' format there should be an exception raised if no length specified
         self.fail('testString() not yet implemented')
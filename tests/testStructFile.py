@@ -0,0 +1,343 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import bz2
+import gzip
+import io
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.append("..\\..\\")
+
+from structobject import *
+
+
+class Point(structObject):
+    "Basic point class"
+    _field_order = ('x', 'y')
+    x = ctype_double()
+    y = ctype_double()
+
+
+class Path(structObject):
+    _field_order = ('point_count', 'points')
+    point_count = ctype_uint(
+        generator=lambda self: len(self.points),
+        depends=('points',)
+    )
+    points = struct_array(
+        object_type=Point,
+        len=lambda self: self.point_count
+    )
+
+
+class NetworkPoint(structObject):
+    _field_order = ('x', 'y', 'flags')
+    _byte_order = network
+    x = ctype_double()
+    y = ctype_int()
+    flags = ctype_uchar()
+
+
+class LittlePoint(NetworkPoint):
+    _byte_order = little_endian
+
+
+class NetworkTrack(structObject):
+    _field_order = ('id', 'count', 'points', 'samples', 'crc')
+    _byte_order = network
+    id = ctype_ushort()
+    count = ctype_uint(generator=lambda self: len(self.points), depends=('points',))
+    points = struct_array(object_type=NetworkPoint, len=lambda self: self.count)
+    samples = struct_array(object_type=ctype_short(), len=lambda self: self.count)
+    crc = crc16_field()
+
+
+class LittleTrack(structObject):
+    _field_order = ('id', 'count', 'points', 'samples', 'crc')
+    _byte_order = little_endian
+    id = ctype_ushort()
+    count = ctype_uint(generator=lambda self: len(self.points), depends=('points',))
+    points = struct_array(object_type=LittlePoint, len=lambda self: self.count)
+    samples = struct_array(object_type=ctype_short(), len=lambda self: self.count)
+    crc = crc16_field()
+
+
+def path_bytes(count):
+    return struct.pack('=I', count) + b''.join(struct.pack('dd', i, -i) for i in range(count))
+
+
+class structFileTests(unittest.TestCase):
+
+    def testIterUnpackFixedSize(self):
+        data = b''.join(struct.pack('dd', i, -i) for i in range(100))
+        points = list(iter_unpack(Point, io.BytesIO(data), chunk_size=50))
+        self.assertEqual(len(points), 100)
+        self.assertEqual(points[99].to_tuple(), (99.0, -99.0))
+
+    def testIterUnpackVariableSize(self):
+        data = b''.join(path_bytes(i) for i in range(20))
+        paths = list(iter_unpack(Path, io.BytesIO(data), chunk_size=64))
+        self.assertEqual([p.point_count for p in paths], list(range(20)))
+        self.assertEqual(paths[19].points[18].y, -18.0)
+
+    def testIterUnpackTruncated(self):
+        data = struct.pack('dd', 1.0, 2.0) + b'\x00' * 3
+        with self.assertRaises(struct.error):
+            list(iter_unpack(Point, io.BytesIO(data)))
+
+    def testIterBatches(self):
+        data = b''.join(struct.pack('dd', i, -i) for i in range(10))
+        batches = list(iter_batches(Point, io.BytesIO(data), chunk_size=64))
+        self.assertEqual([len(batch) for batch in batches], [4, 4, 2])
+
+    def testTranscodeFixedSize(self):
+        points = [NetworkPoint(i * 0.5, -i, i) for i in range(50)]
+        data = b''.join(p.pack() for p in points)
+        out = io.BytesIO()
+        self.assertEqual(transcode(NetworkPoint, io.BytesIO(data), out, little_endian, chunk_size=40), 50)
+        self.assertEqual(out.getvalue(), b''.join(LittlePoint(*p.to_tuple()).pack() for p in points))
+
+        out = io.BytesIO()
+        transcode(NetworkPoint, io.BytesIO(data), out, big_endian)
+        self.assertEqual(out.getvalue(), data)
+        with self.assertRaises(struct.error):
+            transcode(NetworkPoint, io.BytesIO(data[:-1]), io.BytesIO())
+
+    def testTranscodeVariableSize(self):
+        tracks = []
+        for i in range(10):
+            t = NetworkTrack(id=i)
+            for j in range(i):
+                t.points.append(float(j), j, j)
+                t.samples.append(-j)
+            tracks.append(t)
+        data = b''.join(t.pack() for t in tracks)
+        out = io.BytesIO()
+        self.assertEqual(transcode(NetworkTrack, io.BytesIO(data), out, chunk_size=32), 10)
+        expected = b''
+        for t in tracks:
+            little = LittleTrack(id=t.id)
+            little.points.from_list([LittlePoint(*p.to_tuple()) for p in t.points])
+            little.samples.from_list(t.samples[:])
+            expected += little.pack()
+        # the checksums are computed again over the little endian bytes
+        self.assertEqual(out.getvalue(), expected)
+        self.assertEqual(len(list(iter_unpack(LittleTrack, io.BytesIO(out.getvalue())))), 10)
+
+    def testTranscodeNestedByteOrder(self):
+        class Reading(structObject):
+            _field_order = ('seq', 'position', 'crc')
+            _byte_order = big_endian
+            seq = ctype_uint()
+            position = LittlePoint
+            crc = crc16_field()
+
+        class LittleReading(Reading):
+            _byte_order = little_endian
+
+        records = [Reading(i, LittlePoint(0.5, 5, 1)) for i in range(4)]
+        out = io.BytesIO()
+        transcode(Reading, io.BytesIO(b''.join(r.pack() for r in records)), out, little_endian)
+        converted = list(iter_unpack(LittleReading, io.BytesIO(out.getvalue())))
+        self.assertEqual([r.seq for r in converted], [0, 1, 2, 3])
+        self.assertEqual(converted[3].position.y, 5)
+        self.assertEqual(out.getvalue(), b''.join(LittleReading(i, LittlePoint(0.5, 5, 1)).pack() for i in range(4)))
+
+
+    def testScanFixedSize(self):
+        class Message(structObject):
+            _field_order = ('STX', 'timestamp', 'position', 'value')
+            STX = ctype_uchar()
+            timestamp = ctype_uint()
+            position = Point
+            value = ctype_float()
+
+        data = b''.join(Message(i % 3, i, Point(float(i), 0.0), 1.5).pack() for i in range(100))
+        found = list(Message.scan(io.BytesIO(data), where={'timestamp': (10, 40), 'STX': 2}, chunk_size=50))
+        self.assertEqual([m.timestamp for m in found], [11, 14, 17, 20, 23, 26, 29, 32, 35, 38])
+        self.assertIsInstance(found[0].position, Point)
+
+        size = Message._fixed_size
+        self.assertEqual(list(Message.scan(data, where={'timestamp': (None, 2)}, offsets=True)), [0, size, 2 * size])
+        self.assertEqual(list(Message.scan(memoryview(data), where={'position.x': lambda x: x > 97.5})),
+                         [Message(data[98 * size:99 * size]), Message(data[99 * size:])])
+        self.assertRaises(KeyError, list, Message.scan(data, where={'missing': 1}))
+        with self.assertRaises(struct.error):
+            list(Message.scan(io.BytesIO(data[:-1]), where={'STX': 0}))
+
+    def testScanVariableSize(self):
+        data = b''.join(path_bytes(i) for i in range(20))
+        found = list(Path.scan(io.BytesIO(data), where={'point_count': (5, 7)}, chunk_size=64))
+        self.assertEqual([p.point_count for p in found], [5, 6, 7])
+        self.assertEqual(found[2].points[6].to_tuple(), (6.0, -6.0))
+        with self.assertRaises(ValueError):
+            list(NetworkTrack.scan(b'', where={'crc': 0}))
+
+        class Message(structObject):
+            _field_order = ('kind', 'count', 'paths', 'body')
+            kind = ctype_uchar()
+            count = ctype_ushort(generator=lambda self: len(self.paths), depends=('paths',))
+            paths = struct_array(object_type=Path, len=lambda self: self.count)
+            body = union_field(selector=lambda self: self.kind, cases={1: Point, 2: Path})
+
+        messages = []
+        for i in range(12):
+            m = Message(kind=1 + i % 2)
+            for j in range(i % 4):
+                m.paths.append(Path.from_bytes(path_bytes(j)))
+            if m.kind == 2:
+                m.body.unpack(path_bytes(i))
+            messages.append(m)
+        data = b''.join(m.pack() for m in messages)
+        found = list(Message.scan(io.BytesIO(data), where={'kind': 2}, chunk_size=100))
+        self.assertEqual(found, messages[1::2])
+        self.assertEqual(list(Message.scan(data, where={'kind': 1}, offsets=True))[1],
+                         len(messages[0].pack()) + len(messages[1].pack()))
+        with self.assertRaises(struct.error):
+            list(Message.scan(data[:-1], where={'kind': 1}))
+
+
+    def testCompressed(self):
+        import lzma
+        data = b''.join(path_bytes(i) for i in range(30))
+        directory = tempfile.mkdtemp()
+        try:
+            for name, compress in (('paths.gz', gzip.compress), ('paths.bz2', bz2.compress),
+                                   ('paths.xz', lzma.compress), ('paths.bin', bytes)):
+                # compression is detected from the contents, not the name
+                path = os.path.join(directory, name + '.archive')
+                with open(path, 'wb') as f:
+                    f.write(compress(data))
+                paths = list(iter_unpack(Path, path, chunk_size=100))
+                self.assertEqual([p.point_count for p in paths], list(range(30)))
+                self.assertEqual(len(list(Path.scan(path, where={'point_count': (10, 19)}))), 10)
+
+            with gzip.GzipFile(fileobj=io.BytesIO(gzip.compress(data))) as f:
+                self.assertEqual(len(list(iter_unpack(Path, f, chunk_size=64))), 30)
+
+            path = os.path.join(directory, 'points.gz')
+            transcode(NetworkPoint, io.BytesIO(NetworkPoint(1.0, 2, 3).pack()), path)
+            with gzip.open(path) as f:
+                self.assertEqual(f.read(), LittlePoint(1.0, 2, 3).pack())
+        finally:
+            shutil.rmtree(directory)
+
+    def testLazyRecordsCopied(self):
+        class LazyPath(structObject):
+            _field_order = ('point_count', 'points')
+            point_count = ctype_uint(generator=lambda self: len(self.points), depends=('points',))
+            points = struct_array(object_type=Point, len=lambda self: self.point_count, lazy=True)
+
+        data = b''.join(path_bytes(i) for i in range(10))
+        paths = list(iter_unpack(LazyPath, io.BytesIO(data), chunk_size=40))
+        self.assertEqual([p.points[-1].x for p in paths[1:]], [float(i - 1) for i in range(1, 10)])
+        self.assertEqual(b''.join(p.pack() for p in paths), data)
+
+    def testRecordWriter(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'points.bin')
+            with recordWriter(path, Point, buffer_size=64) as writer:
+                writer.write(Point(1.0, 2.0))
+                writer.write({'x': 3.0, 'y': 4.0})
+                writer.write((5.0, 6.0))
+                # 48 bytes are still buffered
+                self.assertEqual(os.path.getsize(path), 0)
+                writer.write_many(Point(float(i), 0.0) for i in range(2))
+                self.assertEqual(os.path.getsize(path), 64)
+                self.assertRaises(TypeError, writer.write, Path())
+            self.assertEqual([p.to_tuple() for p in iter_unpack(Point, path)],
+                             [(1.0, 2.0), (3.0, 4.0), (5.0, 6.0), (0.0, 0.0), (1.0, 0.0)])
+
+            with recordWriter(path, Point, flush_interval=0, fsync=True) as writer:
+                writer.write(Point(7.0, 8.0))
+                self.assertEqual(os.path.getsize(path), 96)
+                self.assertEqual(writer.count, 1)
+
+            # an idle writer is flushed by its timer
+            with recordWriter(path, Point, flush_interval=0.05) as writer:
+                writer.write(Point(9.0, 10.0))
+                self.assertEqual(os.path.getsize(path), 96)
+                for i in range(100):
+                    time.sleep(0.01)
+                    if os.path.getsize(path) == 112:
+                        break
+                self.assertEqual(os.path.getsize(path), 112)
+        finally:
+            shutil.rmtree(directory)
+
+    def testRecordWriterRotation(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'paths.bin')
+            with recordWriter(path, Path, max_file_size=100) as writer:
+                for i in range(6):
+                    writer.write(Path(struct.pack('=I', i) + b''.join(struct.pack('dd', j, -j) for j in range(i))))
+            # appending carries on with the current file and the rotated file numbering
+            with recordWriter(path, Path, max_file_size=100) as writer:
+                writer.write(Path())
+                writer.write(Path(struct.pack('=I', 1) + struct.pack('dd', 1.0, -1.0)))
+            counts = []
+            for name in ('paths.bin.1', 'paths.bin.2', 'paths.bin.3', 'paths.bin.4', 'paths.bin'):
+                name = os.path.join(directory, name)
+                self.assertLessEqual(os.path.getsize(name), 100)
+                counts.append([p.point_count for p in iter_unpack(Path, name)])
+            self.assertEqual(counts, [[0, 1, 2], [3], [4], [5, 0], [1]])
+
+            # appending to a compressed file counts its size on disk
+            path = os.path.join(directory, 'points.gz')
+            with recordWriter(path, Point) as writer:
+                writer.write_many(Point(float(i), 0.0) for i in range(20))
+            with recordWriter(path, Point, max_file_size=os.path.getsize(path) + 8) as writer:
+                writer.write(Point())
+            self.assertTrue(os.path.exists(path + '.1'))
+            self.assertEqual(len(list(iter_unpack(Point, path))), 1)
+        finally:
+            shutil.rmtree(directory)
+
+    def testSortRecords(self):
+        import random
+        rng = random.Random(5)
+        points = [NetworkPoint(float(rng.randint(0, 20)), i, rng.randint(0, 3)) for i in range(200)]
+        src = io.BytesIO(b''.join(p.pack() for p in points))
+        # runs of 10 records spill to 20 temporary files
+        dst = io.BytesIO()
+        self.assertEqual(sort_records(NetworkPoint, src, dst, key='x', memory_limit=130), 200)
+        result = [p.to_tuple() for p in iter_unpack(NetworkPoint, io.BytesIO(dst.getvalue()))]
+        # stable, ties keep their original order
+        self.assertEqual(result, sorted([p.to_tuple() for p in points], key=lambda t: t[0]))
+
+        src.seek(0)
+        dst = io.BytesIO()
+        sort_records(NetworkPoint, src, dst, key=('flags', 'x'), memory_limit=1000, reverse=True)
+        result = [p.to_tuple() for p in iter_unpack(NetworkPoint, io.BytesIO(dst.getvalue()))]
+        self.assertEqual(result, sorted([p.to_tuple() for p in points], key=lambda t: (t[2], t[0]), reverse=True))
+
+        self.assertRaises(ValueError, sort_records, Path, io.BytesIO(), io.BytesIO(), 'point_count')
+        self.assertRaises(Exception, sort_records, NetworkPoint, io.BytesIO(), io.BytesIO(), 'z')
+
+    def testMergeRecords(self):
+        directory = tempfile.mkdtemp()
+        try:
+            names = []
+            for start in range(3):
+                names.append(os.path.join(directory, 'points{}.bin.gz'.format(start)))
+                with gzip.open(names[-1], 'wb') as f:
+                    f.write(b''.join(Point(float(i), float(start)).pack() for i in range(start, 30, 3)))
+            dst = os.path.join(directory, 'merged.bin')
+            self.assertEqual(merge_records(Point, names, dst, key='x', block_size=40), 30)
+            self.assertEqual([p.x for p in iter_unpack(Point, dst)], [float(i) for i in range(30)])
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
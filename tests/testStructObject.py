@@ -7,6 +7,7 @@ import sys
 import unittest
 import struct
 import calendar
+import inspect
 import time
 
 sys.path.append("..\\..\\")
@@ -223,6 +224,220 @@ class structObjectTests(unittest.TestCase):
         self.assertEqual(list(bb.northwest.items()), [('x', 0.0), ('y', 10.0)])
         self.assertEqual(list(bb.southeast.items()), [('x', 15.0), ('y', 0.0)])
 
+    def testUnpackFrom(self):
+        import mmap
+
+        class Path(structObject):
+            _field_order = ('point_count', 'points', 'ETX')
+            point_count = ctype_uint(generator=lambda self: len(self.points), depends=('points',))
+            points = struct_array(object_type=Point, len=lambda self: self.point_count)
+            ETX = ctype_uchar(value=0x03)
+
+        first = struct.pack('=IddddB', 2, 0.0, 10.0, 10.0, 20.0, 3)
+        second = struct.pack('=IddB', 1, 5.0, 6.0, 3)
+        data = b'\xff' + first + second
+        for buffer in (data, bytearray(data), memoryview(data)):
+            p = Path()
+            self.assertEqual(p.unpack_from(buffer, 1), len(first))
+            self.assertEqual(p.pack(), first)
+            point = p.points[0]
+            self.assertEqual(p.unpack_from(buffer, 1 + len(first)), len(second))
+            self.assertEqual(p.pack(), second)
+            # elements are overwritten in place and not appended to
+            self.assertIs(p.points[0], point)
+            self.assertEqual(len(p.points), 1)
+
+        m = mmap.mmap(-1, len(data))
+        m.write(data)
+        p = Path()
+        self.assertEqual(p.unpack_from(m, 1), len(first))
+        self.assertEqual(p.to_tuple(), (2, ((0.0, 10.0), (10.0, 20.0)), 3))
+        m.close()
+
+    def testUnpackFromReadinto(self):
+        import io
+        f = io.BytesIO(struct.pack('dddd', 0.0, 10.0, 15.0, 0.0) + struct.pack('dddd', 1.0, 2.0, 3.0, 4.0))
+        bb = BoundingBox()
+        buffer = bytearray(bb.size)
+        records = []
+        while f.readinto(buffer) == len(buffer):
+            bb.unpack_from(buffer)
+            records.append(bb.to_tuple())
+        self.assertEqual(records, [((0.0, 10.0), (15.0, 0.0)), ((1.0, 2.0), (3.0, 4.0))])
+
+    def testArrayStrideDecode(self):
+        class Sample(structObject):
+            _field_order = ('STX', 'value', 'timestamp')
+            STX = ctype_uchar(value=0x02)
+            value = ctype_short(validator=[lambda v: v >= 0])
+            timestamp = ctype_uint(setter=calendar.timegm, getter=time.gmtime)
+
+        class Series(structObject):
+            _field_order = ('count', 'samples')
+            count = ctype_uint(generator=lambda self: len(self.samples), depends=('samples',))
+            samples = struct_array(object_type=Sample, len=lambda self: self.count)
+
+        self.assertIs(Sample._flat, Sample._segments[0])
+        self.assertIsNone(Series._flat)
+        data = struct.pack('=IBhIBhI', 2, 2, 10, 100, 2, 20, 200)
+        s = Series(data)
+        self.assertEqual(s.to_tuple(), (2, ((2, 10, time.gmtime(100)), (2, 20, time.gmtime(200)))))
+        self.assertEqual(s.pack(), data)
+        first = s.samples[0]
+        s.unpack(struct.pack('=IBhI', 1, 2, 30, 300))
+        self.assertIs(s.samples[0], first)
+        self.assertEqual(len(s.samples), 1)
+        self.assertEqual(s.samples[0].value, 30)
+        self.assertEqual(s.pack(), struct.pack('=IBhI', 1, 2, 30, 300))
+
+        self.assertRaises(ValidationError, Series, struct.pack('=IBhI', 1, 2, -1, 0))
+        self.assertRaises(Exception, Series, struct.pack('=IBhI', 1, 3, 1, 0))
+        self.assertRaises(struct.error, Series, data[:-1])
+
+    def testLazyArray(self):
+        class Path(structObject):
+            _field_order = ('point_count', 'points', 'depths')
+            point_count = ctype_uint(generator=lambda self: len(self.points), depends=('points',))
+            points = struct_array(object_type=Point, len=lambda self: self.point_count, lazy=True)
+            depths = struct_array(object_type=ctype_ushort(), len=lambda self: self.point_count, lazy=True)
+
+        data = struct.pack('=I' + 'dd' * 4 + 'H' * 4, 4, 0.0, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0, 1, 2, 3, 4)
+        p = Path(data)
+        self.assertEqual(len(p.points), 4)
+        self.assertEqual(p.size, len(data))
+        self.assertEqual(p.points._decoded, {})
+        self.assertEqual(p.points[-1].to_tuple(), (6.0, 7.0))
+        self.assertIs(p.points[-1], p.points[3])
+        self.assertEqual(len(p.points._decoded), 1)
+        self.assertEqual(p.depths[1], 2)
+        self.assertRaises(IndexError, p.points.__getitem__, 4)
+
+        view = p.points[1:]
+        self.assertIsInstance(view, structArrayView)
+        self.assertEqual([point.x for point in view[::2]], [2.0, 6.0])
+        self.assertEqual(list(p.depths[::-1]), [4, 3, 2, 1])
+        self.assertEqual(p.to_tuple(), (4, ((0.0, 1.0), (2.0, 3.0), (4.0, 5.0), (6.0, 7.0)), (1, 2, 3, 4)))
+        self.assertEqual(len(p.points._decoded), 2)
+
+        self.assertEqual(p.pack(), data)
+        p.points[0].x = 10.0
+        self.assertEqual(p.pack(), data[:4] + struct.pack('=d', 10.0) + data[12:])
+
+        p.depths.append(5)
+        self.assertIsNone(p.depths._buffer)
+        self.assertEqual(p.depths.to_list(), [1, 2, 3, 4, 5])
+        self.assertEqual(p.points.materialize()[0].x, 10.0)
+        self.assertIsNone(p.points._buffer)
+
+        self.assertRaises(struct.error, Path, data[:-1])
+        with self.assertRaises(Exception):
+            struct_array(object_type=Path, lazy=True)
+
+    def testFreeze(self):
+        class Path(structObject):
+            _field_order = ('point_count', 'points', 'crc')
+            point_count = ctype_uint(generator=lambda self: len(self.points), depends=('points',))
+            points = struct_array(object_type=Point, len=lambda self: self.point_count, lazy=True)
+            crc = crc16_field()
+
+        p = Path()
+        p.points.append(0.0, 1.0)
+        p.points.append(2.0, 3.0)
+        data = p.pack()
+        self.assertIs(p.freeze(), p)
+        self.assertEqual(p.pack(), data)
+        self.assertRaises(AttributeError, setattr, p, 'crc', 0)
+        self.assertRaises(AttributeError, setattr, p.points[0], 'x', 5.0)
+        self.assertRaises(AttributeError, p.points.append, 4.0, 5.0)
+        self.assertRaises(AttributeError, p.unpack, data)
+        self.assertRaises(TypeError, hash, Path())
+
+        q = Path.decode_frozen(b'\x00' + data, 1)
+        self.assertIsNone(q.points._buffer)
+        self.assertEqual(q, p)
+        self.assertEqual(len(set([p, q, Path.decode_frozen(data)])), 1)
+        self.assertNotEqual(q, Path())
+        self.assertRaises(TypeError, Path.pooled().release, q)
+
+    def testUnpackReplacesFrozenElements(self):
+        class Path(structObject):
+            _field_order = ('point_count', 'points')
+            point_count = ctype_uint(generator=lambda self: len(self.points), depends=('points',))
+            points = struct_array(object_type=Point, len=lambda self: self.point_count)
+
+        class Box(structObject):
+            _field_order = ('count', 'corners')
+            count = ctype_uint(generator=lambda self: len(self.corners), depends=('corners',))
+            corners = struct_array(object_type=BoundingBox, len=lambda self: self.count)
+
+        fp = Point(1.0, 2.0).freeze()
+        path = Path(points=[fp])
+        path.unpack(struct.pack('=Idd', 1, 7.0, 8.0))
+        self.assertEqual(path.points[0].to_tuple(), (7.0, 8.0))
+        self.assertEqual(fp.to_tuple(), (1.0, 2.0))
+        self.assertEqual(fp, Point(1.0, 2.0).freeze())
+
+        fb = BoundingBox(Point(1.0, 2.0), Point(3.0, 4.0)).freeze()
+        box = Box(corners=[fb])
+        box.unpack(struct.pack('=I4d', 1, 5.0, 6.0, 7.0, 8.0))
+        self.assertEqual(box.corners[0].southeast.x, 7.0)
+        self.assertEqual(fb.southeast.x, 3.0)
+
+        # frozen substructure fields are replaced as frozen array elements are
+        outer = BoundingBox(fp, Point())
+        outer.unpack(struct.pack('4d', 5.0, 6.0, 7.0, 8.0))
+        self.assertEqual(outer.northwest.to_tuple(), (5.0, 6.0))
+        self.assertFalse(outer.northwest._frozen)
+        self.assertEqual(fp.to_tuple(), (1.0, 2.0))
+
+    def testConcurrentDecode(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        class Series(structObject):
+            _field_order = ('count', 'samples', 'crc')
+            count = ctype_uint(generator=lambda self: len(self.samples), depends=('samples',))
+            samples = struct_array(object_type=Point3D, len=lambda self: self.count)
+            crc = crc32_field()
+
+        records = []
+        for n in range(200):
+            s = Series()
+            for i in range(n % 7):
+                s.samples.append(float(n), float(i), float(n * i))
+            records.append(s.pack())
+        expected = [Series(data).to_tuple() for data in records]
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            decoded = list(executor.map(Series.decode_frozen, records * 5))
+            self.assertEqual([obj.to_tuple() for obj in decoded], expected * 5)
+            # frozen records are only read, so they can be packed and hashed concurrently
+            shared = decoded[:200]
+            packed = list(executor.map(lambda obj: obj.pack(), shared * 5))
+            self.assertEqual(packed, records * 5)
+            self.assertEqual(list(executor.map(hash, shared * 5)), [hash(obj) for obj in shared] * 5)
+
+    def testPool(self):
+        data = struct.pack('dddd', 0.0, 10.0, 15.0, 0.0) + struct.pack('dddd', 1.0, 2.0, 3.0, 4.0)
+        with BoundingBox.pooled(capacity=1) as pool:
+            first = pool.decode(data)
+            northwest = first.northwest
+            self.assertEqual(first.to_tuple(), ((0.0, 10.0), (15.0, 0.0)))
+            pool.release(first)
+            second = pool.decode(data, 32)
+            self.assertIs(second, first)
+            self.assertIs(second.northwest, northwest)
+            self.assertEqual(second.to_tuple(), ((1.0, 2.0), (3.0, 4.0)))
+
+            third = pool.acquire()
+            self.assertIsNot(third, second)
+            pool.release(second)
+            pool.release(third)
+            self.assertEqual(len(pool), 1)
+            self.assertRaises(TypeError, pool.release, Point())
+            self.assertEqual(pool.stats(), {'capacity': 1, 'free': 1, 'hits': 1, 'misses': 2,
+                                            'dropped': 1, 'hit_rate': 1.0 / 3})
+        self.assertEqual(len(pool), 0)
+
     def testLen(self):
         bb = BoundingBox()
         p = Point3D()
@@ -272,6 +487,631 @@ class structObjectTests(unittest.TestCase):
         bb = BetterBoundingBox(Point(0, 10), Point(10, 0))
         self.assertEqual(bb.area, 100)
 
+    def testPackReusesUnchangedSegments(self):
+        p = Point(5000.0, 300.5)
+        packed = p.pack()
+        cached = p._cache[0]
+        self.assertEqual(p.pack(), packed)
+        self.assertIs(p._cache[0], cached)
+        p.y = 20.0
+        self.assertIsNone(p._cache[0])
+        self.assertEqual(p.pack(), struct.pack('dd', 5000.0, 20.0))
+
+    def testPackCacheWithSubstructure(self):
+        bb = BoundingBox(Point(0.0, 10.0), Point(15.0, 0.0))
+        bb.pack()
+        bb.northwest.x = 5.0
+        self.assertEqual(bb.pack(), struct.pack('dddd', 5.0, 10.0, 15.0, 0.0))
+
+    def testNestedSegmentsFolded(self):
+        self.assertEqual([seg.format for seg in BoundingBox._segments], ['=dddd'])
+        self.assertEqual(BoundingBox._segments[0].nested, (0, 1))
+        self.assertIs(BoundingBox._flat, BoundingBox._segments[0])
+
+        class Frame(structObject):
+            _field_order = ('STX', 'box', 'counter', 'crc')
+            STX = ctype_uchar(value=0x02)
+            box = BoundingBox
+            counter = ctype_ushort(generator=lambda self: self.box.northwest.x > 0, depends=('box',))
+            crc = crc16_field(over=('box', 'counter'))
+
+        class Swapped(structObject):
+            _field_order = ('box',)
+            _byte_order = big_endian
+            box = BoundingBox
+
+        self.assertEqual([seg.format for seg in Frame._segments], ['=BddddHH'])
+        self.assertEqual(Frame._segments[0].offsets, (0, 1, 33, 35, 37))
+        self.assertEqual(Swapped._segments, [0])
+
+        f = Frame(box=BoundingBox(Point(1.0, 2.0), Point(3.0, 4.0)))
+        data = f.pack()
+        g = Frame(data)
+        self.assertEqual(g.to_tuple(), f.to_tuple())
+        self.assertEqual(g.pack(), data)
+        northwest = g.box.northwest
+        northwest.x = -1.0
+        g.box.southeast = Point(5.0, 6.0)
+        self.assertEqual(g.pack()[1:33], struct.pack('=dddd', -1.0, 2.0, 5.0, 6.0))
+        g.unpack(data)
+        self.assertIs(g.box.northwest, northwest)
+        self.assertEqual(northwest.pack(), struct.pack('=dd', 1.0, 2.0))
+        self.assertRaises(ChecksumError, Frame, data[:1] + struct.pack('=d', 9.0) + data[9:])
+
+        class Boxes(structObject):
+            _field_order = ('boxes', 'lazy_boxes')
+            boxes = struct_array(object_type=BoundingBox, len=2)
+            lazy_boxes = struct_array(object_type=BoundingBox, len=1, lazy=True)
+
+        values = tuple(float(i) for i in range(12))
+        b = Boxes(struct.pack('=' + 'd' * 12, *values))
+        self.assertEqual(b.to_tuple(), ((((0.0, 1.0), (2.0, 3.0)), ((4.0, 5.0), (6.0, 7.0))),
+                                        (((8.0, 9.0), (10.0, 11.0)),)))
+        self.assertEqual(b.pack(), struct.pack('=' + 'd' * 12, *values))
+
+        frozen = Point(7.0, 8.0).freeze()
+        g.box.northwest = frozen
+        g.unpack(data)
+        self.assertEqual(g.pack(), data)
+        self.assertEqual(frozen.to_tuple(), (7.0, 8.0))
+
+    def testFoldedSegmentsCached(self):
+        class Frame(structObject):
+            _field_order = ('box', 'position', 'vector')
+            box = BoundingBox
+            position = Point
+            vector = struct_array(object_type=ctype_float(), len=400)
+
+        f = Frame()
+        data = f.pack()
+        cached = f._cache[0]
+        self.assertIsNotNone(cached)
+        self.assertEqual(f.pack(), data)
+        self.assertIs(f._cache[0], cached)
+
+        f.box.southeast.y = 3.0
+        f.position.x = 1.0
+        f.vector[399] = 2.0
+        self.assertEqual(f.pack(), struct.pack('=6d400f', 0, 0, 0, 3.0, 1.0, 0, *([0] * 399 + [2.0])))
+        self.assertIsNot(f._cache[0], cached)
+
+        # a substructure shared by two records is repacked by one, the other still notices the change
+        g = Frame(position=f.position)
+        g.pack()
+        f.pack()
+        f.position.y = 4.0
+        f.pack()
+        self.assertEqual(g.pack()[32:48], struct.pack('=dd', 1.0, 4.0))
+
+    def testConstantArraysFolded(self):
+        class Sensor(structObject):
+            _field_order = ('id', 'timestamp', 'vector', 'status')
+            id = ctype_ushort()
+            timestamp = ctype_uint()
+            vector = struct_array(object_type=ctype_float(), len=16)
+            status = ctype_uchar()
+
+        class Reading(structObject):
+            _field_order = ('sensor', 'name')
+            sensor = Sensor
+            name = struct_array(object_type=ctype_char(), len=4)
+
+        self.assertEqual([seg.format for seg in Sensor._segments], ['=HI16fB'])
+        # char arrays aren't folded, they start out empty
+        self.assertEqual([seg.format for seg in Reading._segments[:1]], ['=HI16fB'])
+        self.assertEqual(Reading._segments[1], 1)
+
+        s = Sensor()
+        self.assertEqual(len(s.vector), 16)
+        self.assertEqual(s.pack(), struct.pack('=HI16fB', *([0] * 19)))
+        data = struct.pack('=HI16fB', *([1, 2] + [float(i) for i in range(16)] + [3]))
+        s.unpack(data)
+        element = s.vector._values[0]
+        self.assertEqual(s.vector[15], 15.0)
+        self.assertEqual(s.pack(), data)
+        s.vector[1] = 0.5
+        self.assertEqual(s.pack(), data[:10] + struct.pack('=f', 0.5) + data[14:])
+        s.vector.append(16.0)
+        self.assertRaises(struct.error, s.pack)
+        s.unpack(data)
+        self.assertEqual(len(s.vector), 16)
+        self.assertIs(s.vector._values[0], element)
+
+        r = Reading(data + b'abcd')
+        self.assertEqual(r.name[:], [b'a', b'b', b'c', b'd'])
+        self.assertEqual(r.pack(validation=trusted), data + b'abcd')
+        r = Reading()
+        self.assertEqual(r.name[:], [])
+        self.assertEqual(r.pack(), struct.pack('=HI16fB', *([0] * 19)))
+        self.assertIn('name', str(r))
+
+    def testPrototypeDefaults(self):
+        checked = []
+
+        def positive(value):
+            checked.append(value)
+            return value >= 0
+
+        class Command(structObject):
+            _field_order = ('opcode', 'gain', 'box', 'args', 'crc')
+            opcode = ctype_ushort(validator=[positive])
+            gain = ctype_float()
+            box = BoundingBox
+            args = struct_array(object_type=ctype_short(), len=3)
+            crc = crc16_field()
+
+        class Extended(Command):
+            opcode = ctype_ushort(value=7)
+
+        first = Command()
+        self.assertEqual(len(checked), 1)
+        second = Command()
+        # copies of the prototype don't run validators again or share fields
+        self.assertEqual(len(checked), 1)
+        self.assertIsNot(first._values[0], second._values[0])
+        self.assertIsNot(first.box.northwest, second.box.northwest)
+        self.assertIs(first.args._values[0]._parent, first)
+        first.opcode = 9
+        first.box.northwest.x = 1.0
+        first.args[0] = 4
+        self.assertEqual(second.to_tuple(), (0, 0.0, ((0.0, 0.0), (0.0, 0.0)), (0, 0, 0), 0))
+        self.assertEqual(Command(3, gain=1.5).to_tuple()[:2], (3, 1.5))
+        self.assertEqual(Extended().opcode, 7)
+        self.assertEqual(Command().opcode, 0)
+
+        packed = struct.pack('=Hf4d3h', *([0] * 9))
+        self.assertEqual(second.pack(), packed + struct.pack('=H', crc16_field().algorithm[0](packed)))
+        self.assertEqual(second.crc, crc16_field().algorithm[0](packed))
+        self.assertEqual(Command().crc, 0)
+
+    def testPrototypeRunsCustomInit(self):
+        class Tagged(structObject):
+            __slots__ = ('tag',)
+            _field_order = ('x',)
+            x = ctype_double()
+
+            def __init__(self, *args, **kargs):
+                super(Tagged, self).__init__(*args, **kargs)
+                self.tag = 'hello'
+
+        class Outer(structObject):
+            _field_order = ('kind', 't', 'body')
+            kind = ctype_uchar()
+            t = Tagged
+            body = union_field(selector=lambda self: self.kind, cases={0: Tagged})
+
+        self.assertEqual(Outer().t.tag, 'hello')
+        self.assertEqual(Outer().body.tag, 'hello')
+        self.assertIsNot(Outer().t, Outer().t)
+        self.assertEqual(Outer(kind=0).t.tag, 'hello')
+
+    def testGeneratedInit(self):
+        class Track(structObject):
+            _field_order = ('id', 'box', 'count', 'samples')
+            id = ctype_ushort(validator=[lambda value: value < 100])
+            box = BoundingBox
+            count = ctype_uint(generator=lambda self: len(self.samples), depends=('samples',))
+            samples = struct_array(object_type=ctype_short(), len=lambda self: self.count)
+
+        self.assertEqual(inspect.getfullargspec(Track.__init__).args, ['self', 'id', 'box', 'count', 'samples'])
+        t = Track(5, samples=[1, 2, 3])
+        self.assertEqual(t.pack(), struct.pack('=H4dI3h', 5, 0, 0, 0, 0, 3, 1, 2, 3))
+        self.assertEqual(t.to_tuple(), (5, ((0.0, 0.0), (0.0, 0.0)), 3, (1, 2, 3)))
+        self.assertIs(Track(box=t.box).box, t.box)
+        self.assertRaises(TypeError, Track, 5, (1, 2))
+        self.assertRaises(TypeError, Track, identifier=5)
+        self.assertRaises(ValidationError, Track, 500)
+
+        p = Point.from_tuple((1.0, 2.0))
+        self.assertEqual(Point.from_bytes(p.pack()), p)
+        self.assertEqual(Point.from_dict({'y': 2.0, 'x': 1.0}), p)
+        # the single argument forms of the generic __init__ still work
+        self.assertEqual(Point((1.0, 2.0)), p)
+        self.assertEqual(Point({'x': 1.0, 'y': 2.0}), p)
+        self.assertEqual(Point(p.pack()), p)
+        self.assertEqual(Point(None, 2.0).to_tuple(), (0.0, 2.0))
+
+        # so do lone bytes, tuples and dicts when the first field could hold them
+        class Message(structObject):
+            _field_order = ('tag', 'n')
+            tag = ctype_char()
+            n = ctype_uint()
+
+        m = Message(struct.pack('=cI', b'B', 7))
+        self.assertEqual((m.tag, m.n), (b'B', 7))
+        self.assertEqual(Message((b'C', 8)).n, 8)
+        self.assertEqual(Message(b'D', 9).to_tuple(), (b'D', 9))
+
+        class Samples(structObject):
+            _field_order = ('values', 'flags')
+            values = struct_array(object_type=ctype_ushort(), len=2)
+            flags = ctype_uchar()
+
+        self.assertEqual(Samples(([1, 2], 3)).to_tuple(), ((1, 2), 3))
+
+        # fields named like what the generated __init__ uses keep the generic one
+        class Shadowing(structObject):
+            _field_order = ('self', 'isinstance', 'TypeError', 'box')
+            self = ctype_uchar()
+            isinstance = ctype_uchar()
+            TypeError = ctype_uchar()
+            box = BoundingBox
+
+        s = Shadowing(1, 2, 3, BoundingBox(Point(1.0, 2.0)))
+        self.assertEqual(s.to_tuple()[:3], (1, 2, 3))
+        self.assertEqual(s.box.northwest.y, 2.0)
+
+    def testEqualityAndOrdering(self):
+        class Datagram(structObject):
+            _field_order = ('seq', 'timestamp', 'position', 'samples')
+            _order_by = ('timestamp', 'seq')
+            seq = ctype_ushort()
+            timestamp = ctype_double()
+            position = Point
+            samples = struct_array(object_type=ctype_short(), len=2)
+
+        a = Datagram(1, 10.0, Point(1.0, 2.0), [3, 4])
+        b = Datagram.from_bytes(a.pack())
+        self.assertEqual(a, b)
+        self.assertFalse(a != b)
+        b.samples[1] = 5
+        self.assertNotEqual(a, b)
+        b.samples[1] = 4
+        b.position.y = 0.0
+        self.assertNotEqual(a, b)
+        self.assertNotEqual(a, Point())
+
+        # frozen records compare and hash by their packed bytes
+        frozen = [Datagram.decode_frozen(Datagram(i % 3, 5.0).pack()) for i in range(9)]
+        self.assertEqual(len(set(frozen)), 3)
+        self.assertEqual(frozen[0], Datagram(0, 5.0))
+        self.assertEqual(hash(frozen[0]), hash(Datagram(0, 5.0).freeze()))
+        self.assertNotEqual(Datagram(timestamp=0.0).freeze(), Datagram(timestamp=-0.0).freeze())
+
+        self.assertLess(Datagram(2, 1.0), Datagram(1, 2.0))
+        self.assertLess(Datagram(1, 2.0), Datagram(2, 2.0))
+        self.assertGreaterEqual(Datagram(2, 2.0), Datagram(2, 2.0))
+        self.assertEqual([d.seq for d in sorted(Datagram(i, float(-i // 2)) for i in range(4))], [3, 1, 2, 0])
+        self.assertRaises(TypeError, lambda: Point() < Point())
+        with self.assertRaises(Exception):
+            class Unordered(structObject):
+                _field_order = ('x',)
+                _order_by = ('y',)
+                x = ctype_double()
+
+    def testPackCacheClearedByUnpack(self):
+        p = Point(5000.0, 300.5)
+        p.pack()
+        p.unpack(struct.pack('dd', 1.0, 2.0))
+        self.assertEqual(p.pack(), struct.pack('dd', 1.0, 2.0))
+
+    def testPackGeneratedSegmentNotCached(self):
+        class Counted(structObject):
+            _field_order = ('count', 'samples')
+            count = ctype_uint(generator=lambda self: len(self.samples))
+            samples = struct_array(object_type=ctype_uchar(), len=lambda self: self.count)
+
+        c = Counted()
+        self.assertEqual(c.pack(), struct.pack('I', 0))
+        c.samples.append(7)
+        self.assertEqual(c.pack(), struct.pack('IB', 1, 7))
+        c.samples[0] = 9
+        self.assertEqual(c.pack(), struct.pack('IB', 1, 9))
+
+    def testValidationStrict(self):
+        class Positive(structObject):
+            _field_order = ('x',)
+            x = ctype_int(validator=[lambda v: v >= 0])
+
+        p = Positive()
+        self.assertRaises(ValidationError, p.__setattr__, 'x', -1)
+        self.assertRaises(ValidationError, Positive, struct.pack('i', -1))
+        p.unpack(struct.pack('i', -1), validation=trusted)
+        self.assertEqual(p.x, -1)
+
+    def testValidationOnPack(self):
+        class Positive(structObject):
+            _field_order = ('x', 'y')
+            _validation = on_pack
+            x = ctype_int(validator=[lambda v: v >= 0])
+            y = ctype_int()
+
+        p = Positive(struct.pack('ii', -1, 0))
+        p.x = -2
+        self.assertRaises(ValidationError, p.validate)
+        self.assertRaises(ValidationError, p.pack)
+        p.x = 2
+        self.assertEqual(p.pack(), struct.pack('ii', 2, 0))
+        p.y = '3'
+        self.assertRaises(ValidationError, p.pack)
+
+    def testValidationTrusted(self):
+        class Positive(structObject):
+            _field_order = ('x',)
+            _validation = trusted
+            x = ctype_int(validator=[lambda v: v >= 0])
+
+        p = Positive(struct.pack('i', -1))
+        p.x = -2
+        self.assertEqual(p.pack(), struct.pack('i', -2))
+        self.assertRaises(ValidationError, p.validate)
+
+    def testGeneratorDependencies(self):
+        calls = []
+
+        def summed(self):
+            calls.append(self)
+            return sum(self.samples[:]) % 256
+
+        class Counted(structObject):
+            _field_order = ('count', 'samples', 'checksum', 'flags')
+            count = ctype_uint(generator=lambda self: len(self.samples), depends=('samples',))
+            samples = struct_array(object_type=ctype_uchar(), len=lambda self: self.count)
+            checksum = ctype_uchar(generator=summed, depends=('count', 'samples'))
+            flags = ctype_uchar()
+
+        self.assertEqual(Counted._generated, [0, 2])
+        self.assertEqual(Counted._dependents[1], (0, 2))
+
+        c = Counted()
+        c.samples.append(7)
+        c.samples.append(9)
+        self.assertEqual(c.pack(), struct.pack('IBBBB', 2, 7, 9, 16, 0))
+        self.assertEqual(len(calls), 1)
+        c.flags = 1
+        self.assertEqual(c.pack(), struct.pack('IBBBB', 2, 7, 9, 16, 1))
+        self.assertEqual(len(calls), 1)
+        c.samples[1] = 10
+        self.assertEqual(c.pack(), struct.pack('IBBBB', 2, 7, 10, 17, 1))
+        self.assertEqual(len(calls), 2)
+
+        c = Counted(struct.pack('IBBBB', 2, 7, 9, 16, 0))
+        self.assertEqual(c.pack(), struct.pack('IBBBB', 2, 7, 9, 16, 0))
+        self.assertEqual(len(calls), 2)
+
+    def testGeneratorDependsOnSubstructure(self):
+        class Inner(structObject):
+            _field_order = ('a', 'b')
+            a = ctype_uint()
+            b = ctype_uint()
+
+        class Outer(structObject):
+            _field_order = ('inner', 'total', 'count', 'points', 'sum')
+            _byte_order = big_endian
+            inner = Inner
+            total = ctype_uint(generator=lambda self: self.inner.a + self.inner.b, depends=('inner',))
+            count = ctype_uint(generator=lambda self: len(self.points), depends=('points',))
+            points = struct_array(object_type=Point, len=lambda self: self.count)
+            sum = ctype_double(generator=lambda self: sum(p.x for p in self.points), depends=('points',))
+
+        self.assertEqual(Outer._volatile, frozenset([1, 2, 4]))
+        o = Outer()
+        o.points.append(1.0, 0.0)
+        o.pack()
+        o.inner.a = 5
+        o.points[0].x = 2.0
+        data = o.pack()
+        self.assertEqual(o.total, 5)
+        self.assertEqual(o.sum, 2.0)
+        self.assertEqual(Outer(data).to_tuple(), ((5, 0), 5, 1, ((2.0, 0.0),), 2.0))
+
+    def testGeneratorDependencyErrors(self):
+        with self.assertRaises(Exception):
+            class Undefined(structObject):
+                _field_order = ('count',)
+                count = ctype_uint(generator=lambda self: 0, depends=('missing',))
+
+        with self.assertRaises(Exception):
+            class Circular(structObject):
+                _field_order = ('a', 'b')
+                a = ctype_uint(generator=lambda self: self.b, depends=('b',))
+                b = ctype_uint(generator=lambda self: self.a, depends=('a',))
+
+    def testChecksumPack(self):
+        import zlib
+
+        class Datagram(structObject):
+            _field_order = ('STX', 'timestamp', 'body', 'crc', 'ETX')
+            STX = ctype_uchar(value=0x02)
+            timestamp = ctype_uint()
+            body = BoundingBox
+            crc = crc32_field(over=('STX', 'body'))
+            ETX = ctype_uchar(value=0x03)
+
+        d = Datagram(timestamp=100)
+        d.body.northwest.y = 10.0
+        covered = struct.pack('=BIdddd', 2, 100, 0.0, 10.0, 0.0, 0.0)
+        crc = zlib.crc32(covered) & 0xffffffff
+        self.assertEqual(d.pack(), covered + struct.pack('=IB', crc, 3))
+        self.assertEqual(d.crc, crc)
+        d.timestamp = 101
+        covered = struct.pack('=BIdddd', 2, 101, 0.0, 10.0, 0.0, 0.0)
+        self.assertEqual(d.pack()[:-5], covered)
+        self.assertEqual(d.crc, zlib.crc32(covered) & 0xffffffff)
+
+    def testChecksumUnpack(self):
+        class Datagram(structObject):
+            _field_order = ('STX', 'length', 'sum', 'ETX')
+            STX = ctype_uchar(value=0x02)
+            length = ctype_ushort()
+            sum = sum8_field()
+            ETX = ctype_uchar(value=0x03)
+
+        d = Datagram(struct.pack('=BHBB', 2, 0x0101, 4, 3))
+        self.assertEqual(d.sum, 4)
+        with self.assertRaises(ChecksumError):
+            Datagram(struct.pack('=BHBB', 2, 0x0101, 5, 3))
+        d.unpack(struct.pack('=BHBB', 2, 0x0101, 5, 3), validation=trusted)
+        self.assertEqual(d.sum, 5)
+
+    def testChecksumBadRange(self):
+        with self.assertRaises(Exception):
+            class Datagram(structObject):
+                _field_order = ('a', 'crc')
+                a = ctype_uchar()
+                crc = crc16_field(over=('a', 'crc'))
+
+    def testUnionField(self):
+        class Message(structObject):
+            _field_order = ('msg_type', 'body', 'ETX')
+            msg_type = ctype_uchar()
+            body = union_field(
+                selector=lambda self: self.msg_type,
+                cases={1: Point, 2: Point3D}
+            )
+            ETX = ctype_uchar(value=0x03)
+
+        self.assertEqual([seg if isinstance(seg, int) else seg.format for seg in Message._segments],
+                         ['=B', 1, '=B'])
+        m = Message(struct.pack('=BdddB', 2, 1.0, 2.0, 3.0, 3))
+        self.assertIsInstance(m.body, Point3D)
+        self.assertEqual(m.body.z, 3.0)
+        self.assertEqual(m.size, 26)
+        m = Message(struct.pack('=BddB', 1, 1.0, 2.0, 3))
+        self.assertIsInstance(m.body, Point)
+        self.assertRaises(Exception, Message, struct.pack('=BB', 3, 3))
+
+        m = Message()
+        self.assertIsNone(m.body)
+        # bytes that couldn't be read back aren't written either
+        self.assertRaises(Exception, m.pack)
+        m.msg_type = 1
+        m.body = Point(1.0, 2.0)
+        self.assertEqual(m.pack(), struct.pack('=BddB', 1, 1.0, 2.0, 3))
+        self.assertRaises(TypeError, m.__setattr__, 'body', BoundingBox())
+        m.msg_type = 2
+        self.assertRaises(TypeError, m.pack)
+
+    def testOptionalField(self):
+        class Reading(structObject):
+            _field_order = ('flags', 'position', 'temperature')
+            flags = ctype_uchar()
+            position = optional_field(object_type=Point, present_if=lambda self: self.flags & 1)
+            temperature = optional_field(object_type=ctype_float(), present_if=lambda self: self.flags & 2)
+
+        r = Reading(struct.pack('=Bf', 2, 20.5))
+        self.assertIsNone(r.position)
+        self.assertEqual(r.temperature, 20.5)
+        r = Reading(struct.pack('=Bddf', 3, 1.0, 2.0, 20.5))
+        self.assertEqual(r.position.y, 2.0)
+        self.assertEqual(r.temperature, 20.5)
+        self.assertEqual(r.pack(), struct.pack('=Bddf', 3, 1.0, 2.0, 20.5))
+
+        r = Reading(1, Point(1.0, 2.0))
+        self.assertIsNone(r.temperature)
+        self.assertEqual(r.pack(), struct.pack('=Bdd', 1, 1.0, 2.0))
+        r.flags = 3
+        r.temperature = 5.0
+        self.assertEqual(r.pack(), struct.pack('=Bddf', 3, 1.0, 2.0, 5.0))
+
+    def testToTuple(self):
+        bb = BoundingBox(Point(0.0, 10.0), Point(15.0, 0.0))
+        self.assertEqual(bb.to_tuple(), ((0.0, 10.0), (15.0, 0.0)))
+
+    def testToDict(self):
+        class Path(structObject):
+            _field_order = ('point_count', 'points')
+            point_count = ctype_uint(generator=lambda self: len(self.points), depends=('points',))
+            points = struct_array(object_type=Point, len=lambda self: self.point_count)
+
+        p = Path(struct.pack('=Idddd', 2, 0.0, 10.0, 10.0, 20.0))
+        self.assertEqual(p.to_dict(), {'point_count': 2, 'points': [{'x': 0.0, 'y': 10.0}, {'x': 10.0, 'y': 20.0}]})
+        self.assertIs(p.to_dict(recursive=False)['points'], p.points)
+        self.assertEqual(p.to_tuple(), (2, ((0.0, 10.0), (10.0, 20.0))))
+
+    def testFromDict(self):
+        bb = BoundingBox.from_dict({'northwest': {'x': 0.0, 'y': 10.0}, 'southeast': Point(15.0, 0.0)})
+        self.assertEqual(bb.pack(), struct.pack('dddd', 0.0, 10.0, 15.0, 0.0))
+
+        class Path(structObject):
+            _field_order = ('point_count', 'points')
+            point_count = ctype_uint(generator=lambda self: len(self.points), depends=('points',))
+            points = struct_array(object_type=Point, len=lambda self: self.point_count)
+
+        p = Path.from_dict({'points': [{'x': 0.0, 'y': 10.0}, {'x': 10.0, 'y': 20.0}]})
+        self.assertEqual(p.pack(), struct.pack('=Idddd', 2, 0.0, 10.0, 10.0, 20.0))
+        self.assertEqual(Path.from_dict(p.to_dict()).to_dict(), p.to_dict())
+
+    def testFromTuple(self):
+        class Path(structObject):
+            _field_order = ('point_count', 'points')
+            point_count = ctype_uint(generator=lambda self: len(self.points), depends=('points',))
+            points = struct_array(object_type=Point, len=lambda self: self.point_count)
+
+        p = Path(points=[(1.0, 2.0), Point(3.0, 4.0)])
+        self.assertEqual(p.points[0].x, 1.0)
+        self.assertEqual(p.pack(), struct.pack('=Idddd', 2, 1.0, 2.0, 3.0, 4.0))
+        self.assertEqual(Path.from_tuple(p.to_tuple()), p)
+        bb = BoundingBox(Point(0.0, 10.0), Point(15.0, 0.0))
+        self.assertEqual(BoundingBox.from_tuple(bb.to_tuple()), bb)
+        self.assertRaises(TypeError, Path, points=[1.0])
+
+    def testRegenerateBeforeExport(self):
+        class Path(structObject):
+            _field_order = ('point_count', 'points')
+            point_count = ctype_uint(generator=lambda self: len(self.points), depends=('points',))
+            points = struct_array(object_type=Point, len=lambda self: self.point_count)
+
+        p = Path(points=[(1.0, 2.0)])
+        self.assertEqual(p, Path(Path(points=[(1.0, 2.0)]).pack()))
+        self.assertEqual(Path(points=[(1.0, 2.0)]).to_tuple(), (1, ((1.0, 2.0),)))
+        p.points.append(3.0, 4.0)
+        self.assertEqual(p.to_dict()['point_count'], 2)
+
+    def testRoundTripStaticAndUnion(self):
+        class Datagram(structObject):
+            _field_order = ('STX', 'msg_type', 'body', 'temperature', 'ETX')
+            STX = ctype_uchar(value=0x02)
+            msg_type = ctype_uchar()
+            body = union_field(selector=lambda self: self.msg_type, cases={1: Point, 2: BoundingBox})
+            temperature = optional_field(object_type=ctype_float(), present_if=lambda self: self.msg_type == 2)
+            ETX = ctype_uchar(value=0x03)
+
+        for d in (Datagram(msg_type=1, body=Point(1.0, 2.0)),
+                  Datagram(msg_type=2, body=BoundingBox(Point(1.0, 2.0), Point(3.0, 4.0)), temperature=20.5)):
+            self.assertEqual(Datagram.from_dict(d.to_dict()).pack(), d.pack())
+            self.assertEqual(Datagram.from_tuple(d.to_tuple()).pack(), d.pack())
+        self.assertRaises(ValueError, Datagram.from_dict, {'STX': 5})
+
+    def testStr(self):
+        bb = BoundingBox(Point(0.0, 10.0), Point(15.0, 0.0))
+        self.assertEqual(str(bb), "BoundingBox:\n\tnorthwest: \n\t\tx: 0.0\n\t\ty: 10.0\n"
+                                  "\tsoutheast: \n\t\tx: 15.0\n\t\ty: 0.0\n")
+
+    def testDumpTruncatesArrays(self):
+        import io
+
+        class Path(structObject):
+            _field_order = ('name', 'points')
+            name = struct_array(object_type=ctype_char(), len=8)
+            points = struct_array(object_type=Point, len=3)
+
+        p = Path(b'abcdefgh' + struct.pack('dddddd', 1.0, 2.0, 3.0, 4.0, 5.0, 6.0))
+        out = io.StringIO()
+        dump(p, out, max_items=2)
+        self.assertEqual(out.getvalue(), "Path:\n\tname: \"ab...\"\n\tpoints: \n"
+                                         "\t\t[0]\n\t\t\tx: 1.0\n\t\t\ty: 2.0\n"
+                                         "\t\t[1]\n\t\t\tx: 3.0\n\t\t\ty: 4.0\n"
+                                         "\t\t... 1 more\n")
+
+        class Samples(structObject):
+            _field_order = ('count', 'values')
+            count = ctype_uint(generator=lambda self: len(self.values), depends=('values',))
+            values = struct_array(object_type=ctype_ushort(), len=lambda self: self.count)
+
+        class Writer(object):
+            "Records the number of lines in each write"
+            def __init__(self):
+                self.writes = []
+
+            def write(self, text):
+                self.writes.append(text.count("\n"))
+
+        writer = Writer()
+        dump(Samples(values=list(range(5000))), writer)
+        self.assertEqual(sum(writer.writes), 5003)
+        self.assertLessEqual(max(writer.writes), 1001)
+
 
 if __name__ == '__main__':
     unittest.main()
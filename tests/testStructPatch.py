@@ -0,0 +1,94 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import sys
+import unittest
+
+sys.path.append("..\\..\\")
+
+from structobject import *
+
+
+class Point(structObject):
+    "Basic point class"
+    _field_order = ('x', 'y')
+    x = ctype_double()
+    y = ctype_double()
+
+
+class State(structObject):
+    _field_order = ('seq', 'position', 'velocity', 'gains', 'mode')
+    seq = ctype_uint()
+    position = Point
+    velocity = Point
+    gains = struct_array(object_type=ctype_float(), len=32)
+    mode = ctype_uchar()
+
+
+class Track(structObject):
+    _field_order = ('id', 'count', 'points', 'crc')
+    id = ctype_ushort()
+    count = ctype_uint(generator=lambda self: len(self.points), depends=('points',))
+    points = struct_array(object_type=Point, len=lambda self: self.count)
+    crc = crc16_field()
+
+
+class structPatchTests(unittest.TestCase):
+    def testFixedSize(self):
+        old = State(1, Point(1.0, 2.0), Point(0.5, 0.5), [float(i) for i in range(32)], 3)
+        new = State.from_bytes(old.pack())
+        new.seq = 2
+        new.velocity.y = -0.5
+        new.gains[20] = 0.25
+        patch = State.diff(old, new)
+        # seq, velocity.y and gains[20] with their offsets, well under the 165 byte record
+        self.assertEqual(len(patch), 2 + 3 * 2 + 4 + 8 + 4)
+        self.assertEqual(State.diff(new, new), b'\xa5\x01')
+
+        replica = State.from_bytes(old.pack())
+        position = replica.position
+        self.assertIs(State.apply(replica, patch), replica)
+        self.assertEqual(replica, new)
+        self.assertIs(replica.position, position)
+        self.assertEqual(replica.pack(), new.pack())
+
+        data = bytearray(old.pack())
+        State.apply(data, patch)
+        self.assertEqual(bytes(data), new.pack())
+        view = memoryview(bytearray(old.pack()))
+        State.apply(view, patch)
+        self.assertEqual(view.tobytes(), new.pack())
+
+        self.assertRaises(TypeError, State.diff, old, Point())
+        self.assertRaises(AttributeError, State.apply, State().freeze(), patch)
+        self.assertRaises(ValueError, State.apply, memoryview(bytearray(10)), patch)
+        self.assertRaises(ValueError, State.apply, bytearray(old.pack()), patch[:-1])
+
+    def testVariableSize(self):
+        old = Track(7)
+        for i in range(10):
+            old.points.append(float(i), float(-i))
+        new = Track.from_bytes(old.pack())
+        new.points[4].y = 1.0
+        patch = Track.diff(old, new)
+        # the changed point and the checksum
+        self.assertEqual(len(patch), 2 + 2 * 2 + 16 + 2)
+        replica = Track.apply(Track.from_bytes(old.pack()), patch)
+        self.assertEqual(replica.pack(), new.pack())
+
+        new.points.append(10.0, -10.0)
+        patch = Track.diff(old, new)
+        self.assertEqual(Track.apply(bytearray(old.pack()), patch), bytearray(new.pack()))
+        replica = Track.apply(Track.from_bytes(old.pack()), patch)
+        self.assertEqual(len(replica.points), 11)
+        self.assertEqual(replica, new)
+
+        shorter = Track(7)
+        patch = Track.diff(new, shorter)
+        self.assertEqual(Track.apply(bytearray(new.pack()), patch), bytearray(shorter.pack()))
+
+
+if __name__ == '__main__':
+    unittest.main()